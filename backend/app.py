@@ -1,24 +1,50 @@
+import atexit
 import json
-from flask import Flask, request, jsonify
-import io
+import os
+import re
+from flask import Flask, Response, request, jsonify
 import numpy as np
 from flask_cors import CORS
 import logging
-from s3_data_handling import capture_and_save
-import cv2
+from eye_extraction import eye_extractor
+from image_header import InvalidImageError
+from ingest_queue import IngestQueue, QueueFullError
+from metrics import BYTES, REQUESTS, Gauge, registry, stage_timer
+from s3_data_handling import capture_and_save, capture_and_save_batch, prepare_image_for_storage, update_metadata_if_changed
+from sessions import SessionStore
+from storage import get_storage, metadata_key
 
 logging.basicConfig(level=logging.DEBUG)
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=['Retry-After'])
 
-@app.route('/')
-def index():
-    return "Pupil Detection API"
+ingest_queue = IngestQueue(
+    max_size=int(os.environ.get('INGEST_QUEUE_SIZE', 256)),
+    num_workers=int(os.environ.get('INGEST_WORKERS', 4)),
+)
+if eye_extractor is not None:
+    # atexit runs handlers last-in first-out, so this runs after the drain below.
+    atexit.register(eye_extractor.shutdown)
+# gunicorn.conf.py drains on worker exit; this covers the development server.
+atexit.register(ingest_queue.drain, timeout=30)
+Gauge('ingest_queue_depth', "Jobs waiting in the ingest queue.", ingest_queue.depth)
+
+session_store = SessionStore(max_sessions=int(os.environ.get('SESSION_CACHE_SIZE', 1024)))
+
+def parse_screen_and_camera_info(user_id):
+    """
+    Returns (screen_data, camera_matrix, dist_coeffs) for a calibration request,
+    from its registered session when it sends a sessionId, otherwise from the
+    form fields. Returns None for an unknown session.
+    """
+    session_id = request.form.get('sessionId')
+    if session_id:
+        session = session_store.get(get_storage(), user_id, session_id)
+        if session is None:
+            return None
+        camera_matrix, dist_coeffs = session['cameraInfo']
+        return session['screenData'], camera_matrix, dist_coeffs
 
-@app.route('/calibrate', methods=['POST'])
-def calibrate():
-    user_id = request.form.get('userId')
-    calibration_points = json.loads(request.form.get('calibrationPoints')) 
     screen_data = json.loads(request.form.get('screenData')) if request.form.get('screenData') else None
     camera_matrix_str = request.form.get('cameraMatrix')
     dist_coeffs_str = request.form.get('distCoeffs')
@@ -26,22 +52,98 @@ def calibrate():
     # Parse camera matrix and distortion coefficients as numpy arrays
     camera_matrix = np.array(json.loads(camera_matrix_str)) if camera_matrix_str else None
     dist_coeffs = np.array(json.loads(dist_coeffs_str)) if dist_coeffs_str else None
+    return screen_data, camera_matrix, dist_coeffs
+
+# Name the frontend gives the i-th image of a batch, used to check frames and images line up
+BATCH_IMAGE_NAME = re.compile(r'^frame_(\d+)\.\w+$')
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def validate_frame(frame_metadata, data_type):
+    """Returns why a /process-batch frames entry cannot be stored, or None if it is valid."""
+    if not isinstance(frame_metadata, dict):
+        return "Frame metadata must be an object"
+    if data_type == 'calibration':
+        points = frame_metadata.get('calibrationPoints')
+        if not isinstance(points, list) or len(points) != 2 or not all(is_number(value) for value in points):
+            return "calibrationPoints must be a list of two numbers"
+    else:
+        cursor_position = frame_metadata.get('cursorPosition')
+        if not isinstance(cursor_position, dict) or not all(is_number(cursor_position.get(axis)) for axis in ('x', 'y')):
+            return "cursorPosition must have numeric x and y"
+    return None
+
+def enqueue_capture(fn, *args, response_data=None):
+    try:
+        job_id = ingest_queue.submit(fn, *args)
+    except QueueFullError as e:
+        response = jsonify({'message': str(e), 'data': response_data or {}})
+        response.headers['Retry-After'] = str(ingest_queue.retry_after)
+        return response, 429
+    return jsonify({'message': "Image queued for saving.", 'data': {'jobId': job_id, **(response_data or {})}}), 202
+
+@app.before_request
+def parse_form():
+    # Force the multipart parse here so it is timed as its own stage
+    if request.method == 'POST':
+        with stage_timer('parse'):
+            request.form, request.files
+
+@app.after_request
+def count_request(response):
+    REQUESTS.inc(endpoint=request.endpoint or 'unknown', status=response.status_code)
+    BYTES.inc(request.content_length or 0, kind='request')
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/')
+def index():
+    return "Pupil Detection API"
+
+@app.route('/session', methods=['POST'])
+def start_session():
+    user_id = request.form.get('userId')
+    if not user_id:
+        return jsonify({'message': "No user id!", 'data': {}}), 400
+    screen_and_camera_info = parse_screen_and_camera_info(user_id)
+    if screen_and_camera_info is None:
+        return jsonify({'message': "Unknown session!", 'data': {}}), 400
+    screen_data, camera_matrix, dist_coeffs = screen_and_camera_info
+    camera_info = [np.asarray(camera_matrix).tolist() if camera_matrix is not None else None,
+                   np.asarray(dist_coeffs).tolist() if dist_coeffs is not None else None]
+
+    storage = get_storage()
+    session_id = session_store.register(storage, user_id, screen_data, camera_info)
+    update_metadata_if_changed(storage, metadata_key(user_id), {"screenData": screen_data, "cameraInfo": camera_info})
+
+    return jsonify({'message': "Session started.", 'data': {'sessionId': session_id}})
+
+@app.route('/calibrate', methods=['POST'])
+def calibrate():
+    user_id = request.form.get('userId')
+    calibration_points = json.loads(request.form.get('calibrationPoints')) 
+    screen_and_camera_info = parse_screen_and_camera_info(user_id)
+    if screen_and_camera_info is None:
+        return jsonify({'message': "Unknown session!", 'data': {}}), 400
+    screen_data, camera_matrix, dist_coeffs = screen_and_camera_info
 
     file = request.files['image']
 
     if file.filename == '':
         return jsonify({'message': "No image found!", 'data': {}}), 400
 
-    in_memory_file = io.BytesIO()
-    file.save(in_memory_file)
-    data = np.frombuffer(in_memory_file.getvalue(), dtype=np.uint8)
-    image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    try:
+        image_bytes, image_info = prepare_image_for_storage(file.read())
+    except InvalidImageError as e:
+        return jsonify({'message': f"Invalid image: {e}", 'data': {}}), 400
 
-    # Capture and save data to S3
+    # Capture and save data to S3 in the background
     additional_data = [calibration_points, screen_data, camera_matrix, dist_coeffs]
-    capture_and_save(user_id, image, additional_data, 'calibration')
-
-    return jsonify({'message': "Calibration image saved successfully!"})
+    return enqueue_capture(capture_and_save, user_id, image_bytes, image_info, additional_data, 'calibration')
 
 @app.route('/process-image', methods=['POST'])
 def process_image():
@@ -55,16 +157,83 @@ def process_image():
     if file.filename == '':
         return jsonify({'message': "No image found!", 'data': {}}), 400
 
-    in_memory_file = io.BytesIO()
-    file.save(in_memory_file)
-    data = np.frombuffer(in_memory_file.getvalue(), dtype=np.uint8)
-    image = cv2.imdecode(data, cv2.IMREAD_COLOR)
+    try:
+        image_bytes, image_info = prepare_image_for_storage(file.read())
+    except InvalidImageError as e:
+        return jsonify({'message': f"Invalid image: {e}", 'data': {}}), 400
 
-    # Capture and save data to S3
+    # Capture and save data to S3 in the background
     additional_data = [cursor_position]
-    capture_and_save(user_id, image, additional_data, 'eye_gaze')
+    return enqueue_capture(capture_and_save, user_id, image_bytes, image_info, additional_data, 'eye_gaze')
+
+@app.route('/process-batch', methods=['POST'])
+def process_batch():
+    user_id = request.form.get('userId')
+    data_type = request.form.get('dataType', 'eye_gaze')
+    files = request.files.getlist('images')
+    try:
+        frames_metadata = json.loads(request.form.get('frames')) if request.form.get('frames') else []
+    except ValueError:
+        return jsonify({'message': "frames is not valid JSON!", 'data': {}}), 400
+
+    if not user_id:
+        return jsonify({'message': "No user id!", 'data': {}}), 400
+    if data_type not in ('eye_gaze', 'calibration'):
+        return jsonify({'message': f"Unknown data type {data_type}!", 'data': {}}), 400
+    if not isinstance(frames_metadata, list) or not files or len(files) != len(frames_metadata):
+        return jsonify({'message': "Expected one frames entry per image!", 'data': {}}), 400
+    for i, file in enumerate(files):
+        match = BATCH_IMAGE_NAME.match(file.filename or '')
+        if match and int(match.group(1)) != i:
+            return jsonify({'message': f"Image {file.filename} is at position {i}; frames and images are out of order!", 'data': {}}), 400
+
+    # Screen and camera info are shared by every calibration frame in the batch
+    try:
+        screen_and_camera_info = parse_screen_and_camera_info(user_id) if data_type == 'calibration' else (None, None, None)
+    except ValueError as e:
+        return jsonify({'message': f"Invalid screen or camera info: {e}", 'data': {}}), 400
+    if screen_and_camera_info is None:
+        return jsonify({'message': "Unknown session!", 'data': {}}), 400
+    screen_data, camera_matrix, dist_coeffs = screen_and_camera_info
+    if screen_data is not None and not isinstance(screen_data, (dict, list)):
+        return jsonify({'message': "screenData must be an object or a list!", 'data': {}}), 400
+
+    rejected = {}
+    frames = []
+    for i, (file, frame_metadata) in enumerate(zip(files, frames_metadata)):
+        # Checked here so a bad frame is reported in this response, not later by a storage worker
+        problem = validate_frame(frame_metadata, data_type)
+        if problem is not None:
+            rejected[i] = {'status': 'error', 'message': problem}
+            continue
+        try:
+            image_bytes, image_info = prepare_image_for_storage(file.read())
+        except InvalidImageError as e:
+            rejected[i] = {'status': 'error', 'message': f"Invalid image: {e}"}
+            continue
+
+        if data_type == 'calibration':
+            additional_data = [frame_metadata['calibrationPoints'], screen_data, camera_matrix, dist_coeffs]
+        else:
+            additional_data = [frame_metadata['cursorPosition']]
+        frames.append((image_bytes, image_info, additional_data))
+
+    if not frames:
+        return jsonify({'message': "No valid frames in the batch!", 'data': {'rejected': rejected}}), 400
+
+    # Capture and save all valid frames to S3 in one background job
+    return enqueue_capture(capture_and_save_batch, user_id, frames, data_type, response_data={'rejected': rejected})
+
+@app.route('/ingest-status', methods=['GET'])
+def ingest_status():
+    return jsonify({'message': "Ingest queue status", 'data': ingest_queue.stats()})
 
-    return jsonify({'message': "Image saved successfully!"})
+@app.route('/ingest-status/<job_id>', methods=['GET'])
+def ingest_job_status(job_id):
+    job = ingest_queue.status(job_id)
+    if job is None:
+        return jsonify({'message': "Unknown or expired job!", 'data': {}}), 404
+    return jsonify({'message': f"Job {job['status']}", 'data': job})
 
 if __name__ == '__main__':
     app.run()
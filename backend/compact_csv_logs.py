@@ -0,0 +1,27 @@
+import argparse
+import logging
+from s3_data_handling import compact_csv_log
+from storage import DATA_ROOT, data_csv_key, get_storage
+
+DATA_TYPES = ['calibration', 'eye_gaze']
+
+def compact_all(storage, user_ids=None):
+    if not user_ids:
+        user_ids = [prefix[len(DATA_ROOT):].rstrip('/') for prefix in storage.list_prefixes(DATA_ROOT)]
+
+    total_parts = 0
+    for user_id in user_ids:
+        for data_type in DATA_TYPES:
+            total_parts += compact_csv_log(storage, data_csv_key(user_id, data_type))
+    return total_parts
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold the append-only CSV part logs into the canonical CSVs.")
+    parser.add_argument('--user', action='append', dest='user_ids', help="Only compact this user (repeatable).")
+    args = parser.parse_args()
+
+    total_parts = compact_all(get_storage(), args.user_ids)
+    logging.info(f"Compacted {total_parts} parts.")
+
+if __name__ == '__main__':
+    main()
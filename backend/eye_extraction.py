@@ -0,0 +1,145 @@
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from metrics import BYTES, ERRORS, STAGE_SECONDS
+from storage import eye_crop_keys
+
+logging.basicConfig(level=logging.DEBUG)
+
+# EYE_EXTRACTION=1 stores a 200x100 eye crop and the face landmarks next to every frame.
+EYE_EXTRACTION_ENABLED = os.environ.get('EYE_EXTRACTION', '0') == '1'
+SHAPE_PREDICTOR_PATH = os.environ.get('SHAPE_PREDICTOR_PATH', 'shape_predictor_68_face_landmarks.dat')
+EYE_EXTRACTION_WORKERS = int(os.environ.get('EYE_EXTRACTION_WORKERS', 2))
+# Frames waiting for a worker beyond this are skipped; offline builds fall back to full detection for them.
+EYE_EXTRACTION_MAX_PENDING = int(os.environ.get('EYE_EXTRACTION_MAX_PENDING', 64))
+CROP_SIZE = (200, 100)
+
+# Set in each worker process by _init_worker
+_image_processor = None
+_detector = None
+_predictor = None
+
+def _init_worker(predictor_path):
+    global _image_processor, _detector, _predictor
+    # The extraction itself is shared with the offline pipeline in data_processing/
+    sys.path.append(str(Path(__file__).resolve().parents[1] / 'data_processing'))
+    import dlib
+    from classes.image_processing import ImageProcessor
+
+    _detector = dlib.get_frontal_face_detector()
+    _predictor = dlib.shape_predictor(predictor_path)
+    _image_processor = ImageProcessor(_detector, _predictor)
+
+def extract_eye_crop(image_bytes):
+    """
+    Runs in a worker process: decodes the frame and cuts the combined eye region.
+    Returns:
+        (crop_png_bytes, landmarks_dict), with crop_png_bytes None if no face was found.
+    """
+    import cv2
+    import numpy as np
+
+    frame = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    extracted = _image_processor.extract_combined_eyes(frame, _detector, _predictor, CROP_SIZE)
+    if extracted is None:
+        return None, {'face': False}
+
+    combined_eyes, landmarks, bounding_box = extracted
+    _, buffer = cv2.imencode('.png', combined_eyes)
+    return buffer.tobytes(), {
+        'face': True,
+        'landmarks': landmarks.tolist(),
+        'boundingBox': [int(value) for value in bounding_box],
+        'cropSize': list(CROP_SIZE),
+    }
+
+class EyeExtractor:
+    """
+    Extracts eye crops for stored frames on a process pool, off the request and
+    ingest threads. The pool is started on first use, so it is created inside
+    each gunicorn worker rather than inherited from the master.
+    """
+
+    def __init__(self, predictor_path=SHAPE_PREDICTOR_PATH, num_workers=EYE_EXTRACTION_WORKERS,
+                 max_pending=EYE_EXTRACTION_MAX_PENDING):
+        self.predictor_path = predictor_path
+        self.num_workers = num_workers
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+        # Done callbacks run on the pool's result thread, so storage writes are handed off
+        self._store_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='eye-crop-store')
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn rather than fork: the parent runs request and storage threads
+                self._pool = ProcessPoolExecutor(max_workers=self.num_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_worker, initargs=(self.predictor_path,))
+            return self._pool
+
+    def submit(self, storage, image_key, image_bytes):
+        """Queues extraction for a stored frame. Returns False if it was skipped."""
+        if not self._pending.acquire(blocking=False):
+            ERRORS.inc(stage='eye_extraction_skipped')
+            return False
+        submitted_at = time.perf_counter()
+        try:
+            future = self._get_pool().submit(extract_eye_crop, image_bytes)
+        except RuntimeError as e:
+            self._pending.release()
+            logging.error(f"Could not queue eye extraction for {image_key}: {e}")
+            return False
+        future.add_done_callback(lambda future: self._on_done(storage, image_key, future, submitted_at))
+        return True
+
+    def _on_done(self, storage, image_key, future, submitted_at):
+        try:
+            self._store_executor.submit(self._store_result, storage, image_key, future, submitted_at)
+        except RuntimeError:
+            self._store_result(storage, image_key, future, submitted_at)
+
+    def _store_result(self, storage, image_key, future, submitted_at):
+        try:
+            crop_bytes, landmarks = future.result()
+            STAGE_SECONDS.observe(time.perf_counter() - submitted_at, stage='eye_extraction')
+            store_eye_crop(storage, image_key, crop_bytes, landmarks)
+        except Exception as e:
+            ERRORS.inc(stage='eye_extraction')
+            logging.error(f"Eye extraction failed for {image_key}: {e}")
+        finally:
+            self._pending.release()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=wait)
+                self._pool = None
+        self._store_executor.shutdown(wait=wait)
+
+def store_eye_crop(storage, image_key, crop_bytes, landmarks):
+    """
+    Stores the crop and landmarks next to the frame. Frames without a face
+    still get a landmarks file, so offline builds can skip them outright.
+    """
+    crop_key, landmarks_key = eye_crop_keys(image_key)
+    if crop_bytes is not None:
+        storage.put_bytes(crop_key, crop_bytes, 'image/png')
+        BYTES.inc(len(crop_bytes), kind='eye_crop')
+    storage.put_bytes(landmarks_key, json.dumps({'image': image_key, **landmarks}).encode('utf-8'), 'application/json')
+
+eye_extractor = None
+if EYE_EXTRACTION_ENABLED:
+    # dlib is only needed for this optional mode, so it is not in requirements.txt
+    if importlib.util.find_spec('dlib') is None:
+        logging.error("EYE_EXTRACTION=1 but dlib is not installed; eye extraction is disabled.")
+    else:
+        eye_extractor = EyeExtractor()
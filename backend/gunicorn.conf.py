@@ -0,0 +1,29 @@
+# Picked up automatically by `gunicorn app:app` when run from this directory.
+
+# Time a worker gets after SIGTERM to finish requests and drain its ingest queue.
+graceful_timeout = 25
+
+def on_starting(server):
+    # With METRICS_MULTIPROC_DIR set, /metrics adds up every worker's file; start from a clean slate
+    from metrics import clear_multiproc_dir
+    clear_multiproc_dir()
+
+def post_fork(server, worker):
+    # A preloaded app was imported before the fork, and its flush thread did not survive it
+    from metrics import registry
+    registry.start_flushing()
+
+def worker_exit(server, worker):
+    from app import eye_extractor, ingest_queue
+    from metrics import registry
+    if not ingest_queue.drain(timeout=graceful_timeout):
+        server.log.error("Worker exited before its ingest queue was drained.")
+    if eye_extractor is not None:
+        eye_extractor.shutdown()
+    # So the last second of counts is not lost with the worker
+    registry.flush()
+
+def child_exit(server, worker):
+    # Runs in the master for every worker that exits, including crashed ones
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
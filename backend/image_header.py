@@ -0,0 +1,96 @@
+import struct
+
+MAX_IMAGE_DIMENSION = 8192
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers that stand alone, without a length field after them
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+
+class InvalidImageError(ValueError):
+    pass
+
+def probe_image(data, max_dimension=MAX_IMAGE_DIMENSION):
+    """
+    Identifies an encoded image and reads its size from the header alone,
+    without decoding any pixels.
+    Args:
+        data: The encoded image bytes as uploaded.
+        max_dimension: Largest accepted width or height.
+    Returns:
+        A dict with content_type, extension, width, height and size.
+    Raises:
+        InvalidImageError: If the format is unsupported, the header is
+            malformed, the file is truncated or the size is out of range.
+    """
+    if data.startswith(PNG_SIGNATURE):
+        content_type, extension, (width, height) = 'image/png', 'png', _png_size(data)
+    elif data.startswith(b'\xff\xd8'):
+        content_type, extension, (width, height) = 'image/jpeg', 'jpg', _jpeg_size(data)
+    elif data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        content_type, extension, (width, height) = 'image/webp', 'webp', _webp_size(data)
+    else:
+        raise InvalidImageError("Unsupported image format")
+
+    if not (0 < width <= max_dimension and 0 < height <= max_dimension):
+        raise InvalidImageError(f"Image dimensions {width}x{height} are out of range")
+
+    return {
+        'content_type': content_type,
+        'extension': extension,
+        'width': width,
+        'height': height,
+        'size': len(data),
+    }
+
+def _png_size(data):
+    if len(data) < 33 or data[12:16] != b'IHDR':
+        raise InvalidImageError("Malformed PNG header")
+    # Every complete PNG ends with an empty IEND chunk and its CRC
+    if data[-12:-4] != b'\x00\x00\x00\x00IEND':
+        raise InvalidImageError("Truncated PNG")
+    return struct.unpack('>II', data[16:24])
+
+def _jpeg_size(data):
+    if not data.rstrip(b'\x00').endswith(b'\xff\xd9'):
+        raise InvalidImageError("Truncated JPEG")
+
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            raise InvalidImageError("Malformed JPEG marker")
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            offset += 2
+            continue
+
+        segment_length = struct.unpack('>H', data[offset + 2:offset + 4])[0]
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 9 > len(data):
+                break
+            height, width = struct.unpack('>HH', data[offset + 5:offset + 9])
+            return width, height
+        if marker == 0xDA:
+            # Entropy-coded data starts here; a frame header must come before it
+            break
+        offset += 2 + segment_length
+
+    raise InvalidImageError("JPEG has no frame header")
+
+def _webp_size(data):
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and len(data) >= 30:
+        width, height = struct.unpack('<HH', data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b'VP8L' and len(data) >= 25 and data[20] == 0x2F:
+        bits = struct.unpack('<I', data[21:25])[0]
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X' and len(data) >= 30:
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+        return width, height
+    raise InvalidImageError("Malformed WebP header")
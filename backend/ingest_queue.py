@@ -0,0 +1,124 @@
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from metrics import ERRORS, QUEUE_REJECTIONS, STAGE_SECONDS
+
+logging.basicConfig(level=logging.DEBUG)
+
+class QueueFullError(Exception):
+    pass
+
+class IngestQueue:
+    """
+    Bounded write-behind queue drained by a pool of storage worker threads.
+    Request handlers submit the storage work and return straight away; clients
+    poll status() with the returned job id to learn when it has completed.
+    """
+
+    # How often an idle worker checks whether the queue is being drained
+    _POLL_SECONDS = 0.1
+
+    def __init__(self, max_size=256, num_workers=4, max_tracked_jobs=10000, retry_after=1):
+        self.max_size = max_size
+        self.num_workers = num_workers
+        self.max_tracked_jobs = max_tracked_jobs
+        self.retry_after = retry_after
+        self._queue = queue.Queue(maxsize=max_size)
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._accepting = True
+        self._stopping = threading.Event()
+        self._workers = []
+        for i in range(num_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f'ingest-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, fn, *args, **kwargs):
+        job_id = uuid.uuid4().hex
+        # Checked and enqueued under the lock, so nothing is queued once drain() has begun
+        with self._lock:
+            if not self._accepting:
+                raise QueueFullError("Ingest queue is shutting down")
+            try:
+                self._queue.put_nowait((job_id, time.perf_counter(), fn, args, kwargs))
+            except queue.Full:
+                QUEUE_REJECTIONS.inc()
+                raise QueueFullError("Ingest queue is full")
+            self._track_job(job_id, {'status': 'queued'})
+        return job_id
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            'depth': self.depth(),
+            'maxSize': self.max_size,
+            'workers': self.num_workers,
+            'accepting': self._accepting,
+        }
+
+    def join(self):
+        """Blocks until every job submitted so far has finished, leaving the workers running."""
+        self._queue.join()
+
+    def drain(self, timeout=None):
+        """
+        Stops accepting new work and waits for every queued job to be stored.
+        Returns True if the queue emptied before the timeout.
+        """
+        with self._lock:
+            self._accepting = False
+        # Workers finish whatever is queued, then exit when they find the queue empty
+        self._stopping.set()
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for worker in self._workers:
+            worker.join(max(0, deadline - time.monotonic()) if deadline is not None else None)
+        drained = not any(worker.is_alive() for worker in self._workers)
+        if drained:
+            logging.info("Ingest queue drained.")
+        else:
+            logging.error(f"Ingest queue still had {self.depth()} jobs after drain timeout.")
+        return drained
+
+    def _set_job(self, job_id, job):
+        with self._lock:
+            self._track_job(job_id, job)
+
+    def _track_job(self, job_id, job):
+        # Caller holds self._lock
+        self._jobs[job_id] = job
+        self._jobs.move_to_end(job_id)
+        while len(self._jobs) > self.max_tracked_jobs:
+            self._jobs.popitem(last=False)
+
+    def _worker_loop(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self._POLL_SECONDS)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            try:
+                job_id, queued_at, fn, args, kwargs = item
+                STAGE_SECONDS.observe(time.perf_counter() - queued_at, stage='queue_wait')
+                self._set_job(job_id, {'status': 'processing'})
+                try:
+                    result = fn(*args, **kwargs)
+                    self._set_job(job_id, {'status': 'done', 'result': result})
+                except Exception as e:
+                    ERRORS.inc(stage='ingest_job')
+                    logging.error(f"Ingest job {job_id} failed: {e}")
+                    self._set_job(job_id, {'status': 'error', 'message': str(e)})
+            finally:
+                self._queue.task_done()
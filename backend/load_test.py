@@ -0,0 +1,234 @@
+import argparse
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+DEFAULT_IMAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eye_head_capture_1702669188.0753756.png')
+
+def load_frame(image_path=None, resolution=None, image_format='png'):
+    """
+    Returns the encoded bytes of the frame every request will send: the bundled
+    capture by default, or a synthetic frame of the given (width, height).
+    """
+    if resolution is None:
+        with open(image_path or DEFAULT_IMAGE, 'rb') as f:
+            return f.read()
+
+    width, height = resolution
+    rng = np.random.default_rng(0)
+    # Smoothed noise compresses roughly like a real webcam frame, unlike raw noise
+    frame = cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (7, 7), 0)
+    _, buffer = cv2.imencode(f'.{image_format}', frame)
+    return buffer.tobytes()
+
+class InProcessClient:
+    """Posts to the Flask app in this process, backed by a LocalStorage in a temporary directory."""
+
+    def __init__(self, storage_root):
+        from storage import LocalStorage, set_storage
+        set_storage(LocalStorage(storage_root))
+        import app
+        self.app_module = app
+        self._local = threading.local()
+
+    def post(self, path, data, files):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app_module.app.test_client()
+        form = dict(data)
+        for name, (filename, content) in files:
+            form.setdefault(name, []).append((io.BytesIO(content), filename))
+        response = client.post(path, data=form, content_type='multipart/form-data')
+        return response.status_code, response.get_json(silent=True)
+
+    def drain(self, job_ids):
+        """
+        Waits for the write-behind queue and returns (seconds taken, jobs that
+        failed outright, frames that a finished job reported as not stored).
+        """
+        start = time.perf_counter()
+        self.app_module.ingest_queue.join()
+        elapsed = time.perf_counter() - start
+        job_errors = frame_errors = 0
+        for job_id in job_ids:
+            job = self.app_module.ingest_queue.status(job_id)
+            if job is None:
+                continue
+            if job['status'] == 'error':
+                job_errors += 1
+            elif job['status'] == 'done':
+                # One result per frame for /process-batch, a single one otherwise
+                results = job['result'] if isinstance(job['result'], list) else [job['result']]
+                frame_errors += sum(1 for result in results if result.get('status') == 'error')
+        return elapsed, job_errors, frame_errors
+
+class HttpClient:
+    """Posts to a running server."""
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url.rstrip('/')
+        self._local = threading.local()
+        self._requests = requests
+
+    def post(self, path, data, files):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.post(f'{self.base_url}{path}', data=data,
+                                files=[(name, (filename, content)) for name, (filename, content) in files])
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body
+
+    def drain(self, job_ids):
+        return None, None, None
+
+def build_request(endpoint, user_id, session_id, frame, batch_size, request_index):
+    point = [request_index % 1000, request_index % 700]
+    if endpoint == 'process-image':
+        data = {'userId': user_id, 'cursorPosition': json.dumps({'x': point[0], 'y': point[1]})}
+        return '/process-image', data, [('image', ('frame.png', frame))], 1
+    if endpoint == 'calibrate':
+        data = {'userId': user_id, 'sessionId': session_id, 'calibrationPoints': json.dumps(point)}
+        return '/calibrate', data, [('image', ('frame.png', frame))], 1
+    if endpoint == 'process-batch':
+        frames = [{'cursorPosition': {'x': point[0] + i, 'y': point[1]}} for i in range(batch_size)]
+        data = {'userId': user_id, 'dataType': 'eye_gaze', 'frames': json.dumps(frames)}
+        return '/process-batch', data, [('images', (f'frame_{i}.png', frame)) for i in range(batch_size)], batch_size
+    raise ValueError(f"Unknown endpoint: {endpoint}")
+
+def register_sessions(client, user_ids):
+    session_ids = {}
+    for user_id in user_ids:
+        status, body = client.post('/session', {
+            'userId': user_id,
+            'screenData': json.dumps({'screenWidth': 1920, 'screenHeight': 1080}),
+            'cameraMatrix': json.dumps([[560, 0, 320], [0, 560, 240], [0, 0, 1]]),
+            'distCoeffs': json.dumps([0, 0, 0, 0, 0]),
+        }, [])
+        if status != 200:
+            raise RuntimeError(f"Could not register a session for {user_id}: {status}")
+        session_ids[user_id] = body['data']['sessionId']
+    return session_ids
+
+def percentile_ms(latencies, q):
+    return round(float(np.percentile(latencies, q)) * 1000, 3) if latencies else None
+
+def run_load_test(client, endpoint='process-image', rate=20.0, duration=10.0, num_users=4, batch_size=8,
+                  frame=None, concurrency=16):
+    """
+    Sends requests at a fixed target rate (open loop) from num_users simulated
+    users and reports throughput, latency percentiles and error rates.
+    Latency is measured from each request's scheduled start, so time spent
+    waiting for a free client thread counts against the server.
+    """
+    frame = frame if frame is not None else load_frame()
+    user_ids = [f'loadtest-user-{i}' for i in range(num_users)]
+    session_ids = register_sessions(client, user_ids) if endpoint == 'calibrate' else {}
+    num_requests = max(1, int(rate * duration))
+
+    latencies = []
+    job_ids = []
+    statuses = Counter()
+    lock = threading.Lock()
+    start = time.perf_counter() + 0.1
+
+    def send(request_index):
+        scheduled = start + request_index / rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        user_id = user_ids[request_index % num_users]
+        path, data, files, _ = build_request(endpoint, user_id, session_ids.get(user_id), frame, batch_size, request_index)
+        body = None
+        try:
+            status, body = client.post(path, data, files)
+        except Exception:
+            status = 'exception'
+        latency = time.perf_counter() - scheduled
+        with lock:
+            latencies.append(latency)
+            statuses[str(status)] += 1
+            job_id = ((body or {}).get('data') or {}).get('jobId')
+            if job_id:
+                job_ids.append(job_id)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(send, range(num_requests)))
+    elapsed = time.perf_counter() - start
+    drain_seconds, storage_job_errors, storage_frame_errors = client.drain(job_ids)
+
+    ok = sum(count for status, count in statuses.items() if status.isdigit() and int(status) < 300)
+    frames_per_request = batch_size if endpoint == 'process-batch' else 1
+    return {
+        'config': {
+            'endpoint': endpoint,
+            'target_rate': rate,
+            'duration_s': duration,
+            'users': num_users,
+            'batch_size': frames_per_request,
+            'frame_bytes': len(frame),
+            'concurrency': concurrency,
+        },
+        'requests': num_requests,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(num_requests / elapsed, 3),
+        'frames_per_s': round(ok * frames_per_request / elapsed, 3),
+        'latency_ms': {
+            'p50': percentile_ms(latencies, 50),
+            'p95': percentile_ms(latencies, 95),
+            'p99': percentile_ms(latencies, 99),
+            'max': percentile_ms(latencies, 100),
+        },
+        'status_counts': dict(statuses),
+        'error_rate': round(1 - ok / num_requests, 4),
+        'storage_drain_s': round(drain_seconds, 3) if drain_seconds is not None else None,
+        'storage_job_errors': storage_job_errors,
+        'storage_frame_errors': storage_frame_errors,
+    }
+
+def parse_resolution(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay capture frames against the ingest API and report latency as JSON.")
+    parser.add_argument('--url', help="Base URL of a running server; defaults to the app in-process on local storage.")
+    parser.add_argument('--storage-root', help="LocalStorage directory for in-process runs; defaults to a temporary one.")
+    parser.add_argument('--endpoint', default='process-image', choices=['process-image', 'calibrate', 'process-batch'])
+    parser.add_argument('--rate', type=float, default=20.0, help="Target requests per second.")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds of load to generate.")
+    parser.add_argument('--users', type=int, default=4, help="Number of simulated users.")
+    parser.add_argument('--batch-size', type=int, default=8, help="Frames per /process-batch request.")
+    parser.add_argument('--concurrency', type=int, default=16, help="Maximum requests in flight.")
+    parser.add_argument('--image', help="Frame to send; defaults to the bundled capture.")
+    parser.add_argument('--resolution', type=parse_resolution, help="Send a synthetic WIDTHxHEIGHT frame instead.")
+    parser.add_argument('--format', default='png', choices=['png', 'jpg'], help="Encoding of synthetic frames.")
+    parser.add_argument('--output', help="Also write the JSON report to this file.")
+    args = parser.parse_args()
+
+    frame = load_frame(args.image, args.resolution, args.format)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        client = HttpClient(args.url) if args.url else InProcessClient(args.storage_root or tmp_dir)
+        report = run_load_test(client, args.endpoint, args.rate, args.duration, args.users, args.batch_size,
+                               frame, args.concurrency)
+
+    report_json = json.dumps(report, indent=2)
+    print(report_json)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report_json)
+
+if __name__ == '__main__':
+    main()
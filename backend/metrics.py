@@ -0,0 +1,302 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+
+# METRICS_ENABLED=0 turns every instrument into an early return.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+# When set, every process writes its values to a file here and /metrics adds up all of them,
+# so a scrape covers every gunicorn worker. PROMETHEUS_MULTIPROC_DIR is honoured for familiarity.
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR') or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 1))
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL_TIMER = nullcontext()
+
+class _Metric:
+    metric_type = None
+    live_only = False
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _label_values(self, labels):
+        return tuple(str(labels.get(labelname, '')) for labelname in self.labelnames)
+
+    def _format_labels(self, label_values, extra=()):
+        pairs = list(zip(self.labelnames, label_values)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self, values=None):
+        """Renders values, as merged by the registry, or this process's own values."""
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        lines.extend(self._render_samples(self.snapshot() if values is None else values))
+        return lines
+
+    @staticmethod
+    def merge(total, values):
+        """Adds one process's snapshot into total; counters and gauges are plain sums."""
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    def _render_samples(self, values):
+        return [f'{self.name}{self._format_labels(key)} {value}' for key, value in sorted(values.items())]
+
+class Gauge(_Metric):
+    """
+    A gauge whose value is read from a callback when /metrics is scraped.
+    Across processes the live ones are summed, e.g. the depth of every worker's queue.
+    """
+
+    metric_type = 'gauge'
+    # Only meaningful while its process is alive, unlike a counter's total
+    live_only = True
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def snapshot(self):
+        return {(): self.callback()}
+
+    def _render_samples(self, values):
+        return [f'{self.name} {values.get((), 0)}']
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._label_values(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def time(self, **labels):
+        """Context manager observing the duration of its block in seconds."""
+        if not METRICS_ENABLED:
+            return _NULL_TIMER
+        return _Timer(self, labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {'counts': list(series['counts']), 'sum': series['sum'], 'count': series['count']}
+                    for key, series in self._series.items()}
+
+    @staticmethod
+    def merge(total, values):
+        for key, series in values.items():
+            merged = total.get(key)
+            if merged is None:
+                total[key] = {'counts': list(series['counts']), 'sum': series['sum'], 'count': series['count']}
+                continue
+            merged['counts'] = [a + b for a, b in zip(merged['counts'], series['counts'])]
+            merged['sum'] += series['sum']
+            merged['count'] += series['count']
+
+    def _render_samples(self, values):
+        lines = []
+        for key, series in sorted(values.items()):
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets, series['counts']):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{self._format_labels(key, [("le", repr(float(upper_bound)))])} {cumulative}')
+            lines.append(f'{self.name}_bucket{self._format_labels(key, [("le", "+Inf")])} {series["count"]}')
+            lines.append(f'{self.name}_sum{self._format_labels(key)} {series["sum"]}')
+            lines.append(f'{self.name}_count{self._format_labels(key)} {series["count"]}')
+        return lines
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'start')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+class MetricsRegistry:
+    """
+    The metrics of one process. With multiproc_dir set, each process also
+    keeps its values in a file there, rewritten every flush_seconds and on
+    every render, and render() adds up the files of all processes. A dead
+    worker's file stays, so counters never go backwards when a worker is
+    replaced; mark_process_dead() drops its gauges. The directory should be
+    emptied before the server starts. gunicorn.conf.py does both.
+    """
+
+    FILE_PATTERN = 'metrics_*.json'
+
+    def __init__(self, multiproc_dir=None, flush_seconds=None):
+        self._metrics = []
+        self._lock = threading.Lock()
+        self.multiproc_dir = multiproc_dir
+        self.flush_seconds = flush_seconds
+        self._pid = None
+        self._path = None
+        self._flusher_pid = None
+        # The flush thread and a scrape can write this process's file at the same time
+        self._write_lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self):
+        """Renders every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        values = {metric.name: metric.snapshot() for metric in metrics}
+        if self.multiproc_dir:
+            self._write(values)
+            values = self._read_all(metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(values.get(metric.name, {})))
+        return '\n'.join(lines) + '\n'
+
+    def start_flushing(self):
+        """Starts writing this process's values in the background; call again after a fork."""
+        if not self.multiproc_dir or not self.flush_seconds or self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True).start()
+
+    def flush(self):
+        """Writes this process's current values to its file, e.g. just before a worker exits."""
+        if not self.multiproc_dir:
+            return
+        with self._lock:
+            metrics = list(self._metrics)
+        self._write({metric.name: metric.snapshot() for metric in metrics})
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Could not write metrics: {e}")
+
+    def _file_path(self):
+        # A fresh name per process, so a forked or restarted worker never overwrites another's totals
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._path = os.path.join(self.multiproc_dir, f'metrics_{self._pid}_{uuid.uuid4().hex}.json')
+        return self._path
+
+    def _write(self, values):
+        path = self._file_path()
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        with self._lock:
+            live_only = {metric.name: metric.live_only for metric in self._metrics}
+        data = {name: {'live_only': live_only.get(name, False), 'samples': [[list(key), value] for key, value in metric_values.items()]}
+                for name, metric_values in values.items()}
+        # Written aside and renamed, so a scrape never reads a partial file
+        with self._write_lock:
+            tmp_path = f'{path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, path)
+
+    def _read_all(self, metrics):
+        totals = {metric.name: {} for metric in metrics}
+        by_name = {metric.name: metric for metric in metrics}
+        for path in glob.glob(os.path.join(self.multiproc_dir, self.FILE_PATTERN)):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, entry in data.items():
+                metric = by_name.get(name)
+                if metric is not None:
+                    metric.merge(totals[name], {tuple(key): value for key, value in entry['samples']})
+        return totals
+
+def clear_multiproc_dir(multiproc_dir=METRICS_MULTIPROC_DIR):
+    """Removes the files of a previous run; call once before any worker starts."""
+    if not multiproc_dir:
+        return
+    for path in glob.glob(os.path.join(multiproc_dir, MetricsRegistry.FILE_PATTERN)):
+        os.remove(path)
+
+def mark_process_dead(pid, multiproc_dir=METRICS_MULTIPROC_DIR):
+    """
+    Drops the gauges of a process that has exited, keeping its counters and
+    histograms. Runs in the gunicorn master, so it also covers crashed workers.
+    """
+    if not multiproc_dir:
+        return
+    for path in glob.glob(os.path.join(multiproc_dir, f'metrics_{pid}_*.json')):
+        with open(path) as f:
+            data = json.load(f)
+        data = {name: entry for name, entry in data.items() if not entry['live_only']}
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+registry = MetricsRegistry(METRICS_MULTIPROC_DIR, METRICS_FLUSH_SECONDS)
+registry.start_flushing()
+
+STAGE_SECONDS = Histogram('ingest_stage_seconds', "Time spent in each ingest stage.", ['stage'])
+REQUESTS = Counter('ingest_requests_total', "HTTP requests handled, by endpoint and status code.", ['endpoint', 'status'])
+FRAMES = Counter('ingest_frames_total', "Frames stored, by data type.", ['data_type'])
+BYTES = Counter('ingest_bytes_total', "Bytes stored, by kind of object.", ['kind'])
+ERRORS = Counter('ingest_errors_total', "Failures, by ingest stage.", ['stage'])
+QUEUE_REJECTIONS = Counter('ingest_queue_rejections_total', "Requests turned away because the ingest queue was full.")
+
+def stage_timer(stage):
+    """Times a block as one ingest stage; free when metrics are disabled."""
+    return STAGE_SECONDS.time(stage=stage)
@@ -1,35 +1,110 @@
-import boto3
 import csv
 import cv2
 import json
 import logging
 import numpy as np
+import os
+import random
+import socket
+import time
 import uuid
-from io import BytesIO, StringIO
+from concurrent.futures import ThreadPoolExecutor
+from eye_extraction import eye_extractor
+from image_header import probe_image
+from io import StringIO
+from metrics import BYTES, ERRORS, FRAMES, stage_timer
+from sessions import content_hash
+from storage import PreconditionFailedError, data_csv_key, get_storage, images_prefix, metadata_key
 
 logging.basicConfig(level=logging.DEBUG)
 
-def capture_and_save(user_id, original_frame, additional_data, data_type='eye_gaze', s3_client=boto3.client('s3'), bucket_name='eye-gaze-data'):
-    user_data_dir = f'data/{user_id}/'
-    metadata_file = f'{user_data_dir}metadata.json'
-    img_dir = f'{user_data_dir}{data_type}_images/'
-    csv_name = f'{user_data_dir}{data_type}_data.csv'
+# 'original' stores uploads byte-for-byte; 'png' transcodes them to PNG first.
+IMAGE_STORAGE_MODE = os.environ.get('IMAGE_STORAGE_MODE', 'original')
 
-    img_name, data_row = prepare_data_and_image(user_id, original_frame, additional_data, img_dir, data_type)
-    upload_image_to_s3(s3_client, bucket_name, f'{img_dir}{img_name}', original_frame)
-    append_data_to_csv(s3_client, bucket_name, csv_name, data_row)
-    if data_type == 'calibration':
+HOSTNAME = socket.gethostname()
+
+# Shared by all requests so a batch fans its image uploads out in parallel.
+upload_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='storage-upload')
+
+def capture_and_save(user_id, image_bytes, image_info, additional_data, data_type='eye_gaze', storage=None):
+    return capture_and_save_batch(user_id, [(image_bytes, image_info, additional_data)], data_type, storage)[0]
+
+def capture_and_save_batch(user_id, frames, data_type='eye_gaze', storage=None):
+    """
+    Saves several frames of one user in a single pass.
+    Images are uploaded concurrently and all their rows go into one CSV log part.
+    Args:
+        frames: List of (image_bytes, image_info, additional_data) tuples, as
+            returned by prepare_image_for_storage plus the frame's metadata.
+        storage: Storage backend, defaults to the process-wide one.
+    Returns:
+        A status dict per frame, in the order the frames were given.
+    """
+    with stage_timer('capture_total'):
+        return _capture_and_save_batch(user_id, frames, data_type, storage or get_storage())
+
+def _capture_and_save_batch(user_id, frames, data_type, storage):
+    img_dir = images_prefix(user_id, data_type)
+    csv_name = data_csv_key(user_id, data_type)
+
+    prepared = [prepare_data_and_image(user_id, image_info, additional_data, img_dir, data_type)
+                for _, image_info, additional_data in frames]
+
+    uploaded = upload_images(storage, [(f'{img_dir}{img_name}', image_bytes, image_info['content_type'])
+                                       for (img_name, _), (image_bytes, image_info, _) in zip(prepared, frames)])
+
+    if eye_extractor is not None:
+        for (img_name, _), (image_bytes, _, _), ok in zip(prepared, frames, uploaded):
+            if ok:
+                eye_extractor.submit(storage, f'{img_dir}{img_name}', image_bytes)
+
+    data_rows = [data_row for (_, data_row), ok in zip(prepared, uploaded) if ok]
+    rows_saved = append_rows_to_csv(storage, csv_name, data_rows) if data_rows else True
+
+    if data_type == 'calibration' and frames:
         # Assuming additional_data[1] is screen_data and additional_data[2:] is camera_info
+        additional_data = frames[-1][2]
         metadata = {
             "screenData": additional_data[1] if len(additional_data) > 1 else None,
             "cameraInfo": additional_data[2:] if len(additional_data) > 2 else None
         }
-        update_metadata_if_changed(s3_client, bucket_name, metadata_file, metadata)
+        update_metadata_if_changed(storage, metadata_key(user_id), metadata)
+
+    results = [{'image': f'{img_dir}{img_name}', 'status': 'saved' if ok and rows_saved else 'error'}
+               for (img_name, _), ok in zip(prepared, uploaded)]
+    FRAMES.inc(sum(1 for result in results if result['status'] == 'saved'), data_type=data_type)
+    return results
+
+def prepare_image_for_storage(image_bytes, storage_mode=IMAGE_STORAGE_MODE):
+    """
+    Validates an uploaded image from its header and picks the bytes to store.
+    In 'original' mode the upload is stored as it arrived, in its own format.
+    In 'png' mode anything that is not already a PNG is decoded and re-encoded.
+    Returns:
+        (image_bytes, image_info) where image_info is the probe_image() dict.
+    Raises:
+        InvalidImageError: If the upload is not a valid image.
+    """
+    with stage_timer('probe'):
+        image_info = probe_image(image_bytes)
+    if storage_mode == 'png' and image_info['content_type'] != 'image/png':
+        image = decode_image(image_bytes)
+        with stage_timer('encode'):
+            _, buffer = cv2.imencode('.png', image)
+        image_bytes = buffer.tobytes()
+        image_info = probe_image(image_bytes)
+    return image_bytes, image_info
+
+def decode_image(image_bytes):
+    # Only needed by features that work on the pixels
+    with stage_timer('decode'):
+        return cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
 
-def prepare_data_and_image(user_id, original_frame, additional_data, img_dir, data_type):
+def prepare_data_and_image(user_id, image_info, additional_data, img_dir, data_type):
     unique_id = uuid.uuid4()
-    img_name = f'{user_id}_{unique_id}.png'
+    img_name = f'{user_id}_{unique_id}.{image_info["extension"]}'
     data_row = format_data_row(additional_data, f'{img_dir}{img_name}', data_type)
+    data_row += [image_info['content_type'], image_info['size']]
     return img_name, data_row
 
 def format_data_row(additional_data, img_path, data_type):
@@ -43,37 +118,161 @@ def format_data_row(additional_data, img_path, data_type):
         # Handle other data types if needed
         return [img_path]
 
-def upload_image_to_s3(s3_client, bucket_name, img_path, original_frame):
+def upload_images(storage, images):
+    if len(images) == 1:
+        return [upload_image(storage, *images[0])]
+
+    uploads = []
+    for img_path, image_bytes, content_type in images:
+        try:
+            uploads.append(upload_executor.submit(upload_image, storage, img_path, image_bytes, content_type))
+        except RuntimeError:
+            # The executor refuses work once the interpreter is shutting down,
+            # which is when the ingest queue drains; upload inline instead.
+            uploads.append(upload_image(storage, img_path, image_bytes, content_type))
+    return [upload.result() if hasattr(upload, 'result') else upload for upload in uploads]
+
+def upload_image(storage, img_path, image_bytes, content_type):
     try:
-        _, buffer = cv2.imencode('.png', original_frame)
-        img_bytes = BytesIO(buffer)
-        s3_client.upload_fileobj(img_bytes, bucket_name, img_path)
-        logging.info(f"Successfully uploaded {img_path} to S3.")
+        with stage_timer('upload'):
+            storage.put_bytes(img_path, image_bytes, content_type)
+        BYTES.inc(len(image_bytes), kind='image')
+        logging.info(f"Successfully uploaded {img_path}.")
+        return True
     except Exception as e:
-        logging.error(f"Error uploading to S3: {e}")
+        ERRORS.inc(stage='upload')
+        logging.error(f"Error uploading {img_path}: {e}")
+        return False
+
+def append_data_to_csv(storage, csv_name, data_row):
+    return append_rows_to_csv(storage, csv_name, [data_row])
 
-def append_data_to_csv(s3_client, bucket_name, csv_name, data_row):
+def append_rows_to_csv(storage, csv_name, data_rows):
+    # Each append is written as its own small, immutable part object under
+    # `{csv}_parts/`, so the cost of a request no longer grows with the CSV.
+    # compact_csv_log() later folds the parts into the canonical CSV.
+    part_key = f'{get_csv_parts_prefix(csv_name)}{make_part_name()}'
     try:
-        existing_data = get_existing_csv_data(s3_client, bucket_name, csv_name)
-        csv_data = StringIO()
-        writer = csv.writer(csv_data)
-        writer.writerow(data_row)
-        all_data = existing_data + csv_data.getvalue()
-        s3_client.put_object(Body=all_data, Bucket=bucket_name, Key=csv_name)
-        logging.info("Successfully appended to CSV in S3.")
+        with stage_timer('csv_append'):
+            csv_data = StringIO()
+            writer = csv.writer(csv_data)
+            writer.writerows(data_rows)
+            part_data = csv_data.getvalue().encode('utf-8')
+            storage.put_bytes(part_key, part_data, 'text/csv')
+        BYTES.inc(len(part_data), kind='csv_part')
+        logging.info(f"Successfully appended {len(data_rows)} rows as {part_key} to the CSV log.")
+        return True
     except Exception as e:
-        logging.error(f"Error updating CSV in S3: {e}")
+        ERRORS.inc(stage='csv_append')
+        logging.error(f"Error appending to the CSV log: {e}")
+        return False
 
-def update_metadata_if_changed(s3_client, bucket_name, metadata_file, camera_info):
-    if camera_info:
+def get_csv_parts_prefix(csv_name):
+    base_name = csv_name[:-len('.csv')] if csv_name.endswith('.csv') else csv_name
+    return f'{base_name}_parts/'
+
+def make_part_name():
+    # Nanosecond timestamp first so parts sort in write order, then the writing
+    # worker, so each gunicorn worker or host appends to its own shard of parts.
+    return f'{time.time_ns():020d}_{HOSTNAME}-{os.getpid()}_{uuid.uuid4().hex}.part'
+
+def list_csv_parts(storage, csv_name):
+    return sorted(obj['Key'] for obj in storage.list_objects(get_csv_parts_prefix(csv_name))
+                  if obj['Key'].endswith('.part'))
+
+def merge_csv_text(chunks):
+    # Rows carry a unique image path, so an identical line can only be a part
+    # that was read while a compaction was still deleting it.
+    seen = set()
+    merged_lines = []
+    for chunk in chunks:
+        for line in chunk.splitlines():
+            if line and line not in seen:
+                seen.add(line)
+                merged_lines.append(line)
+    return ''.join(f'{line}\r\n' for line in merged_lines)
+
+def read_csv_log(storage, csv_name):
+    """Returns the compacted CSV plus every part not yet compacted into it."""
+    chunks = [get_existing_csv_data(storage, csv_name)]
+    for part_key in list_csv_parts(storage, csv_name):
+        chunks.append(get_existing_csv_data(storage, part_key))
+    return merge_csv_text(chunks)
+
+def compact_csv_log(storage, csv_name, max_attempts=10):
+    """
+    Merges the parts of csv_name into the canonical CSV and deletes them.
+    Safe to run from several workers or hosts at once: the canonical CSV is
+    committed with a conditional write against the version that was read,
+    and a compaction that loses the race starts over from the new version.
+    Returns:
+        The number of parts that were compacted.
+    Raises:
+        PreconditionFailedError: If every attempt lost the race.
+    """
+    for attempt in range(max_attempts):
+        existing_data, etag = storage.get_bytes_and_etag(csv_name)
+        part_keys = list_csv_parts(storage, csv_name)
+        if not part_keys:
+            return 0
+
+        chunks = [existing_data.decode('utf-8') if existing_data is not None else '']
+        for part_key in part_keys:
+            chunks.append(get_existing_csv_data(storage, part_key))
         try:
-            # Ensure all NumPy arrays are converted to lists
-            camera_info_serializable = convert_numpy_arrays_to_lists(camera_info)
+            storage.put_bytes_if_match(csv_name, merge_csv_text(chunks).encode('utf-8'), etag, 'text/csv')
+        except PreconditionFailedError:
+            logging.info(f"Another compaction committed {csv_name} first, retrying.")
+            time.sleep(random.uniform(0, 0.05 * (attempt + 1)))
+            continue
+
+        # Only the parts that made it into the canonical CSV are removed; parts
+        # written while compacting are picked up by the next run. A part deleted
+        # under us can only have been deleted after its rows were committed,
+        # and that commit would have failed ours.
+        storage.delete_keys(part_keys)
+        logging.info(f"Compacted {len(part_keys)} parts into {csv_name}.")
+        return len(part_keys)
 
-            s3_client.put_object(Body=json.dumps(camera_info_serializable), Bucket=bucket_name, Key=metadata_file)
-            logging.info("Successfully updated metadata in S3.")
+    raise PreconditionFailedError(csv_name)
+
+def update_metadata_if_changed(storage, metadata_file, camera_info):
+    """
+    Writes metadata.json only when its content differs from what is stored.
+    The stored file is read and the write is conditional on its ETag, so an
+    unchanged calibration frame costs one read, and a write from another
+    worker in between is compared against instead of being overwritten blindly.
+    Returns:
+        True if the metadata was written.
+    """
+    if camera_info:
+        try:
+            with stage_timer('metadata'):
+                return _update_metadata_if_changed(storage, metadata_file, camera_info)
         except Exception as e:
-            logging.error(f"Error updating metadata in S3: {e}")
+            ERRORS.inc(stage='metadata')
+            logging.error(f"Error updating metadata: {e}")
+    return False
+
+def _update_metadata_if_changed(storage, metadata_file, camera_info, max_attempts=10):
+    # Ensure all NumPy arrays are converted to lists
+    camera_info_serializable = convert_numpy_arrays_to_lists(camera_info)
+    new_hash = content_hash(camera_info_serializable)
+
+    for attempt in range(max_attempts):
+        existing, etag = storage.get_bytes_and_etag(metadata_file)
+        if existing is not None and content_hash(json.loads(existing.decode('utf-8'))) == new_hash:
+            return False
+        try:
+            storage.put_bytes_if_match(metadata_file, json.dumps(camera_info_serializable).encode('utf-8'), etag, 'application/json')
+        except PreconditionFailedError:
+            logging.info(f"{metadata_file} changed while updating it, retrying.")
+            time.sleep(random.uniform(0, 0.05 * (attempt + 1)))
+            continue
+        logging.info("Successfully updated metadata.")
+        return True
+
+    raise PreconditionFailedError(metadata_file)
 
 def convert_numpy_arrays_to_lists(data):
     if isinstance(data, np.ndarray):
@@ -86,9 +285,9 @@ def convert_numpy_arrays_to_lists(data):
         return tuple(convert_numpy_arrays_to_lists(item) for item in data)
     return data
 
-def get_existing_csv_data(s3_client, bucket_name, csv_name):
-    try:
-        return s3_client.get_object(Bucket=bucket_name, Key=csv_name)['Body'].read().decode('utf-8')
-    except s3_client.exceptions.NoSuchKey:
-        logging.info("CSV file does not exist. A new file will be created.")
+def get_existing_csv_data(storage, csv_name):
+    data = storage.get_bytes(csv_name)
+    if data is None:
+        logging.info(f"{csv_name} does not exist yet.")
         return ''
+    return data.decode('utf-8')
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from storage import user_prefix
+
+logging.basicConfig(level=logging.DEBUG)
+
+class LRUCache:
+    """Thread-safe mapping that evicts the least recently used entry beyond max_size."""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+def content_hash(data):
+    # Key order must not matter, so hash a canonical serialisation
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf-8')).hexdigest()
+
+def session_key(user_id, session_id):
+    return f'{user_prefix(user_id)}sessions/{session_id}.json'
+
+class SessionStore:
+    """
+    Screen and camera info registered once per capture session.
+    Sessions are kept in an LRU cache and persisted to storage, so a worker
+    that did not handle the registration can still resolve the session id.
+    """
+
+    def __init__(self, max_sessions=1024):
+        self._cache = LRUCache(max_sessions)
+
+    def register(self, storage, user_id, screen_data, camera_info):
+        session_id = uuid.uuid4().hex
+        session = {
+            'userId': user_id,
+            'screenData': screen_data,
+            'cameraInfo': camera_info,
+        }
+        storage.put_bytes(session_key(user_id, session_id), json.dumps(session).encode('utf-8'), 'application/json')
+        self._cache.set(session_id, session)
+        return session_id
+
+    def get(self, storage, user_id, session_id):
+        """Returns the session dict, or None if it is unknown or belongs to another user."""
+        session = self._cache.get(session_id)
+        if session is None:
+            data = storage.get_bytes(session_key(user_id, session_id))
+            if data is None:
+                return None
+            session = json.loads(data.decode('utf-8'))
+            self._cache.set(session_id, session)
+        return session if session['userId'] == user_id else None
@@ -0,0 +1,307 @@
+import abc
+import boto3
+import fcntl
+import logging
+import os
+import shutil
+import threading
+import uuid
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from io import BytesIO
+
+logging.basicConfig(level=logging.DEBUG)
+
+DATA_ROOT = 'data/'
+
+# Key layout shared by the backend and the data_processing DataHandler
+def user_prefix(user_id):
+    return f'{DATA_ROOT}{user_id}/'
+
+def metadata_key(user_id):
+    return f'{user_prefix(user_id)}metadata.json'
+
+def images_prefix(user_id, data_type):
+    return f'{user_prefix(user_id)}{data_type}_images/'
+
+def eye_crops_prefix(user_id, data_type):
+    return f'{user_prefix(user_id)}{data_type}_eye_crops/'
+
+def eye_crop_keys(image_key):
+    """
+    Returns the (crop, landmarks) keys stored next to a captured frame,
+    e.g. 'data/u/eye_gaze_images/u_1.png' -> 'data/u/eye_gaze_eye_crops/u_1.png'
+    and '.../u_1.json'. Works on local copies of the same layout too.
+    """
+    image_dir, image_name = image_key.replace('\\', '/').rsplit('/', 1)
+    crops_dir = image_dir[:-len('_images')] + '_eye_crops' if image_dir.endswith('_images') else f'{image_dir}_eye_crops'
+    stem = image_name.rsplit('.', 1)[0]
+    return f'{crops_dir}/{stem}.png', f'{crops_dir}/{stem}.json'
+
+def data_csv_key(user_id, data_type):
+    return f'{user_prefix(user_id)}{data_type}_data.csv'
+
+def user_id_from_key(key):
+    """Returns the user id of a key under DATA_ROOT, or None."""
+    if not key.startswith(DATA_ROOT):
+        return None
+    parts = key[len(DATA_ROOT):].split('/', 1)
+    return parts[0] if len(parts) == 2 else None
+
+class PreconditionFailedError(Exception):
+    """A conditional write lost the race: the object changed since it was read."""
+
+class Storage(abc.ABC):
+    """
+    Object storage used for captured frames, CSV logs and metadata.
+    Keys are '/'-separated paths such as 'data/<user>/metadata.json'.
+    """
+
+    @abc.abstractmethod
+    def put_bytes(self, key, data, content_type=None):
+        pass
+
+    @abc.abstractmethod
+    def get_bytes(self, key):
+        """Returns the object's bytes, or None if the key does not exist."""
+        pass
+
+    @abc.abstractmethod
+    def get_bytes_and_etag(self, key):
+        """Returns (bytes, ETag), or (None, None) if the key does not exist."""
+        pass
+
+    @abc.abstractmethod
+    def put_bytes_if_match(self, key, data, etag, content_type=None):
+        """
+        Writes the object only if it is still at etag, or still absent when
+        etag is None; otherwise raises PreconditionFailedError. This is the
+        optimistic commit that lets several workers share one object.
+        """
+        pass
+
+    @abc.abstractmethod
+    def list_objects(self, prefix):
+        """Yields {'Key', 'Size', 'ETag'} dicts for every object under prefix, in key order."""
+        pass
+
+    @abc.abstractmethod
+    def list_prefixes(self, prefix):
+        """Returns the immediate 'sub-directory' prefixes under prefix."""
+        pass
+
+    @abc.abstractmethod
+    def delete_keys(self, keys):
+        pass
+
+    @abc.abstractmethod
+    def download_file(self, key, local_path):
+        pass
+
+class S3Storage(Storage):
+    def __init__(self, bucket_name='eye-gaze-data', max_pool_connections=32, multipart_threshold=8 * 1024 * 1024,
+                 multipart_chunksize=8 * 1024 * 1024, max_concurrency=10, max_attempts=5, retry_mode='adaptive'):
+        self.bucket_name = bucket_name
+        # The pool has to cover every thread that talks to S3 at once: ingest
+        # workers times the per-batch upload fan-out, plus download threads.
+        self.client = boto3.client('s3', config=Config(
+            max_pool_connections=max_pool_connections,
+            retries={'max_attempts': max_attempts, 'mode': retry_mode},
+        ))
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency,
+        )
+
+    def put_bytes(self, key, data, content_type=None):
+        extra_args = {'ContentType': content_type} if content_type else None
+        self.client.upload_fileobj(BytesIO(data), self.bucket_name, key, ExtraArgs=extra_args, Config=self.transfer_config)
+
+    def get_bytes(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket_name, Key=key)['Body'].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+
+    def get_bytes_and_etag(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket_name, Key=key)
+        except self.client.exceptions.NoSuchKey:
+            return None, None
+        return response['Body'].read(), response['ETag']
+
+    def put_bytes_if_match(self, key, data, etag, content_type=None):
+        condition = {'IfMatch': etag} if etag is not None else {'IfNoneMatch': '*'}
+        if content_type:
+            condition['ContentType'] = content_type
+        try:
+            self.client.put_object(Bucket=self.bucket_name, Key=key, Body=data, **condition)
+        except ClientError as e:
+            # 409 is returned when a concurrent conditional write is still in flight
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                raise PreconditionFailedError(key) from e
+            raise
+
+    def list_objects(self, prefix):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield {'Key': obj['Key'], 'Size': obj['Size'], 'ETag': obj['ETag']}
+
+    def list_prefixes(self, prefix):
+        prefixes = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, Delimiter='/'):
+            for common_prefix in page.get('CommonPrefixes', []):
+                prefixes.append(common_prefix['Prefix'])
+        return prefixes
+
+    def delete_keys(self, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), 1000):
+            batch = keys[start:start + 1000]
+            self.client.delete_objects(Bucket=self.bucket_name, Delete={'Objects': [{'Key': key} for key in batch]})
+
+    def download_file(self, key, local_path):
+        self.client.download_file(self.bucket_name, key, local_path, Config=self.transfer_config)
+
+class LocalStorage(Storage):
+    """Stores objects as files under root, mirroring the S3 key layout."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        parts = key.split('/')
+        if any(part in ('', '.', '..') for part in parts):
+            raise ValueError(f"Invalid key: {key}")
+        return os.path.join(self.root, *parts)
+
+    def put_bytes(self, key, data, content_type=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a hidden temporary file and rename, so readers never see a partial object
+        tmp_path = os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{uuid.uuid4().hex}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get_bytes(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def get_bytes_and_etag(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                # Stat the open file, so the ETag belongs to the bytes read even if the key is replaced meanwhile
+                return f.read(), _stat_etag(os.fstat(f.fileno()))
+        except FileNotFoundError:
+            return None, None
+
+    def _etag(self, key):
+        try:
+            return _stat_etag(os.stat(self._path(key)))
+        except FileNotFoundError:
+            return None
+
+    def put_bytes_if_match(self, key, data, etag, content_type=None):
+        os.makedirs(self.root, exist_ok=True)
+        # One lock file serialises conditional writes across threads and processes
+        with open(os.path.join(self.root, '.conditional-write.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if self._etag(key) != etag:
+                    raise PreconditionFailedError(key)
+                self.put_bytes(key, data, content_type)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def list_objects(self, prefix):
+        # Only walk the deepest directory the prefix names
+        base_dir = prefix.rsplit('/', 1)[0] if '/' in prefix else ''
+        start = os.path.join(self.root, *base_dir.split('/')) if base_dir else self.root
+
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(start):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            rel_dir = os.path.relpath(dirpath, self.root).replace(os.sep, '/')
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                key = filename if rel_dir == '.' else f'{rel_dir}/{filename}'
+                if key.startswith(prefix):
+                    keys.append(key)
+
+        for key in sorted(keys):
+            try:
+                stat = os.stat(self._path(key))
+            except FileNotFoundError:
+                continue
+            yield {'Key': key, 'Size': stat.st_size, 'ETag': _stat_etag(stat)}
+
+    def list_prefixes(self, prefix):
+        directory = self._path(prefix.rstrip('/')) if prefix.strip('/') else self.root
+        if not os.path.isdir(directory):
+            return []
+        return sorted(f'{prefix}{name}/' for name in os.listdir(directory)
+                      if not name.startswith('.') and os.path.isdir(os.path.join(directory, name)))
+
+    def delete_keys(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def download_file(self, key, local_path):
+        shutil.copyfile(self._path(key), local_path)
+
+def _stat_etag(stat):
+    # Every put_bytes renames a new file into place, so inode, size and mtime change with each write;
+    # listing stays O(files) instead of hashing every byte
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+def storage_from_env():
+    """
+    Builds the storage backend described by the environment:
+    STORAGE_BACKEND ('s3' or 'local'), LOCAL_STORAGE_ROOT for the local
+    backend, and S3_BUCKET / S3_MAX_POOL_CONNECTIONS / S3_MULTIPART_THRESHOLD /
+    S3_MULTIPART_CHUNKSIZE / S3_MAX_CONCURRENCY / S3_MAX_ATTEMPTS /
+    S3_RETRY_MODE for S3.
+    """
+    backend = os.environ.get('STORAGE_BACKEND', 's3')
+    if backend == 'local':
+        return LocalStorage(os.environ.get('LOCAL_STORAGE_ROOT', './local_storage'))
+    if backend == 's3':
+        return S3Storage(
+            bucket_name=os.environ.get('S3_BUCKET', 'eye-gaze-data'),
+            max_pool_connections=int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 32)),
+            multipart_threshold=int(os.environ.get('S3_MULTIPART_THRESHOLD', 8 * 1024 * 1024)),
+            multipart_chunksize=int(os.environ.get('S3_MULTIPART_CHUNKSIZE', 8 * 1024 * 1024)),
+            max_concurrency=int(os.environ.get('S3_MAX_CONCURRENCY', 10)),
+            max_attempts=int(os.environ.get('S3_MAX_ATTEMPTS', 5)),
+            retry_mode=os.environ.get('S3_RETRY_MODE', 'adaptive'),
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+_default_storage = None
+_default_storage_lock = threading.Lock()
+
+def get_storage():
+    """Returns the process-wide storage backend, creating it on first use."""
+    global _default_storage
+    with _default_storage_lock:
+        if _default_storage is None:
+            _default_storage = storage_from_env()
+        return _default_storage
+
+def set_storage(storage):
+    """Replaces the process-wide storage backend, e.g. with a LocalStorage for load tests."""
+    global _default_storage
+    with _default_storage_lock:
+        _default_storage = storage
@@ -26,7 +26,7 @@ class TestS3BucketIntegration(unittest.TestCase):
         response = requests.post(url, data=data, files=files)
 
         # Assert the response status code and any other expected behavior
-        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.status_code, 202)
         # Additional assertions can be added as needed
 
         # Clean up: Close the file
@@ -0,0 +1,62 @@
+import multiprocessing
+import tempfile
+import threading
+import unittest
+from s3_data_handling import append_rows_to_csv, compact_csv_log, list_csv_parts, read_csv_log
+from storage import LocalStorage
+
+CSV_NAME = 'data/cheif/eye_gaze_data.csv'
+NUM_WORKERS = 4
+NUM_THREADS_PER_WORKER = 4
+REQUESTS_PER_THREAD = 25
+
+def run_worker(root, worker_index):
+    """Plays one gunicorn worker: several request threads appending rows at once."""
+    storage = LocalStorage(root)
+
+    def handle_requests(thread_index):
+        for request_index in range(REQUESTS_PER_THREAD):
+            image = f'w{worker_index}-t{thread_index}-r{request_index}.png'
+            assert append_rows_to_csv(storage, CSV_NAME, [[image, worker_index, request_index]])
+
+    threads = [threading.Thread(target=handle_requests, args=(i,)) for i in range(NUM_THREADS_PER_WORKER)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+class TestConcurrentIngest(unittest.TestCase):
+    def test_no_rows_lost_with_concurrent_writers_and_compactors(self):
+        with tempfile.TemporaryDirectory() as root:
+            storage = LocalStorage(root)
+            context = multiprocessing.get_context('fork')
+            workers = [context.Process(target=run_worker, args=(root, i)) for i in range(NUM_WORKERS)]
+            for worker in workers:
+                worker.start()
+
+            # Compact continuously from two threads while the workers append
+            stop = threading.Event()
+            def compact_until_stopped():
+                while not stop.is_set():
+                    compact_csv_log(storage, CSV_NAME)
+            compactors = [threading.Thread(target=compact_until_stopped) for _ in range(2)]
+            for compactor in compactors:
+                compactor.start()
+
+            for worker in workers:
+                worker.join()
+                self.assertEqual(worker.exitcode, 0)
+            stop.set()
+            for compactor in compactors:
+                compactor.join()
+            compact_csv_log(storage, CSV_NAME)
+
+            self.assertEqual(list_csv_parts(storage, CSV_NAME), [])
+            rows = storage.get_bytes(CSV_NAME).decode('utf-8').splitlines()
+            expected_rows = NUM_WORKERS * NUM_THREADS_PER_WORKER * REQUESTS_PER_THREAD
+            self.assertEqual(len(rows), expected_rows)
+            self.assertEqual(len({row.split(',')[0] for row in rows}), expected_rows)
+            self.assertEqual(read_csv_log(storage, CSV_NAME).splitlines(), rows)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import cv2
+import os
+import tempfile
+import unittest
+import numpy as np
+from s3_data_handling import (append_data_to_csv, capture_and_save_batch, compact_csv_log, list_csv_parts,
+                              prepare_image_for_storage, read_csv_log)
+from storage import LocalStorage
+
+class TestCsvLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.tmp_dir.name)
+        self.csv_name = 'data/cheif/eye_gaze_data.csv'
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_append_writes_a_part_per_row(self):
+        append_data_to_csv(self.storage, self.csv_name, ['a.png', 1, 2])
+        append_data_to_csv(self.storage, self.csv_name, ['b.png', 3, 4])
+
+        self.assertIsNone(self.storage.get_bytes(self.csv_name))
+        self.assertEqual(len(list_csv_parts(self.storage, self.csv_name)), 2)
+        self.assertEqual(read_csv_log(self.storage, self.csv_name), 'a.png,1,2\r\nb.png,3,4\r\n')
+
+    def test_compaction_merges_parts_into_canonical_csv(self):
+        self.storage.put_bytes(self.csv_name, b'old.png,0,0\r\n')
+        append_data_to_csv(self.storage, self.csv_name, ['a.png', 1, 2])
+        append_data_to_csv(self.storage, self.csv_name, ['b.png', 3, 4])
+
+        self.assertEqual(compact_csv_log(self.storage, self.csv_name), 2)
+        self.assertEqual(list_csv_parts(self.storage, self.csv_name), [])
+        self.assertEqual(self.storage.get_bytes(self.csv_name), b'old.png,0,0\r\na.png,1,2\r\nb.png,3,4\r\n')
+        self.assertEqual(compact_csv_log(self.storage, self.csv_name), 0)
+
+    def test_read_ignores_parts_already_compacted(self):
+        append_data_to_csv(self.storage, self.csv_name, ['a.png', 1, 2])
+        # Simulate a reader running between the canonical write and the part delete.
+        self.storage.put_bytes(self.csv_name, b'a.png,1,2\r\n')
+
+        self.assertEqual(read_csv_log(self.storage, self.csv_name), 'a.png,1,2\r\n')
+
+    def test_batch_writes_one_part_for_all_frames(self):
+        _, buffer = cv2.imencode('.jpg', np.zeros((4, 4, 3), dtype=np.uint8))
+        image_bytes, image_info = prepare_image_for_storage(buffer.tobytes())
+        frames = [(image_bytes, image_info, [{'x': i, 'y': i}]) for i in range(3)]
+
+        results = capture_and_save_batch('cheif', frames, 'eye_gaze', self.storage)
+
+        self.assertEqual([result['status'] for result in results], ['saved'] * 3)
+        self.assertEqual(len(list_csv_parts(self.storage, self.csv_name)), 1)
+        rows = [row.split(',') for row in read_csv_log(self.storage, self.csv_name).splitlines()]
+        self.assertEqual([row[0] for row in rows], [result['image'] for result in results])
+        self.assertEqual(rows[0][3:], ['image/jpeg', str(len(image_bytes))])
+        for result in results:
+            self.assertTrue(result['image'].endswith('.jpg'))
+            # Stored byte-for-byte, without a transcode
+            self.assertEqual(self.storage.get_bytes(result['image']), image_bytes)
+            self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, *result['image'].split('/'))))
+
+if __name__ == '__main__':
+    unittest.main()
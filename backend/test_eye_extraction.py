@@ -0,0 +1,39 @@
+import json
+import tempfile
+import unittest
+from eye_extraction import store_eye_crop
+from storage import LocalStorage, eye_crop_keys
+
+class TestEyeExtraction(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_crop_keys_sit_next_to_the_frame(self):
+        self.assertEqual(eye_crop_keys('data/cheif/eye_gaze_images/cheif_1.jpg'),
+                         ('data/cheif/eye_gaze_eye_crops/cheif_1.png', 'data/cheif/eye_gaze_eye_crops/cheif_1.json'))
+
+    def test_crop_and_landmarks_are_stored(self):
+        image_key = 'data/cheif/calibration_images/cheif_1.png'
+        landmarks = {'face': True, 'landmarks': [[1, 2]] * 68, 'boundingBox': [0, 0, 10, 5], 'cropSize': [200, 100]}
+        store_eye_crop(self.storage, image_key, b'crop', landmarks)
+
+        crop_key, landmarks_key = eye_crop_keys(image_key)
+        self.assertEqual(self.storage.get_bytes(crop_key), b'crop')
+        stored = json.loads(self.storage.get_bytes(landmarks_key))
+        self.assertEqual(stored['image'], image_key)
+        self.assertEqual(len(stored['landmarks']), 68)
+
+    def test_frame_without_face_only_gets_landmarks_file(self):
+        image_key = 'data/cheif/eye_gaze_images/cheif_2.png'
+        store_eye_crop(self.storage, image_key, None, {'face': False})
+
+        crop_key, landmarks_key = eye_crop_keys(image_key)
+        self.assertIsNone(self.storage.get_bytes(crop_key))
+        self.assertFalse(json.loads(self.storage.get_bytes(landmarks_key))['face'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import cv2
+import numpy as np
+import unittest
+from image_header import InvalidImageError, probe_image
+
+class TestImageHeader(unittest.TestCase):
+    def encode(self, extension, width=64, height=48):
+        _, buffer = cv2.imencode(extension, np.full((height, width, 3), 128, dtype=np.uint8))
+        return buffer.tobytes()
+
+    def test_reads_size_of_supported_formats(self):
+        for extension, content_type in [('.png', 'image/png'), ('.jpg', 'image/jpeg'), ('.webp', 'image/webp')]:
+            data = self.encode(extension)
+            info = probe_image(data)
+            self.assertEqual(info['content_type'], content_type)
+            self.assertEqual((info['width'], info['height']), (64, 48))
+            self.assertEqual(info['size'], len(data))
+
+    def test_reads_bundled_capture(self):
+        with open('./eye_head_capture_1702669188.0753756.png', 'rb') as img:
+            data = img.read()
+        height, width = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR).shape[:2]
+
+        info = probe_image(data)
+        self.assertEqual((info['width'], info['height']), (width, height))
+
+    def test_rejects_bad_uploads(self):
+        for data in [b'', b'not an image', self.encode('.png')[:-20], self.encode('.jpg')[:-20]]:
+            with self.assertRaises(InvalidImageError):
+                probe_image(data)
+        with self.assertRaises(InvalidImageError):
+            probe_image(self.encode('.png'), max_dimension=32)
+
+if __name__ == '__main__':
+    unittest.main()
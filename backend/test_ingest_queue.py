@@ -0,0 +1,51 @@
+import threading
+import time
+import unittest
+from ingest_queue import IngestQueue, QueueFullError
+
+class TestIngestQueue(unittest.TestCase):
+    def test_rejects_work_when_full_and_drains_the_rest(self):
+        ingest_queue = IngestQueue(max_size=2, num_workers=1)
+        release = threading.Event()
+        blocking_job = ingest_queue.submit(release.wait)
+        time.sleep(0.1)  # let the worker pick up the blocking job
+        queued_jobs = [ingest_queue.submit(lambda i=i: i) for i in range(2)]
+
+        with self.assertRaises(QueueFullError):
+            ingest_queue.submit(lambda: None)
+        self.assertEqual(ingest_queue.depth(), 2)
+
+        release.set()
+        self.assertTrue(ingest_queue.drain(timeout=5))
+        self.assertEqual(ingest_queue.status(blocking_job)['status'], 'done')
+        self.assertEqual([ingest_queue.status(job)['result'] for job in queued_jobs], [0, 1])
+        with self.assertRaises(QueueFullError):
+            ingest_queue.submit(lambda: None)
+
+    def test_records_failed_jobs(self):
+        ingest_queue = IngestQueue(max_size=4, num_workers=1)
+        job_id = ingest_queue.submit(lambda: 1 / 0)
+        ingest_queue.drain(timeout=5)
+
+        self.assertEqual(ingest_queue.status(job_id)['status'], 'error')
+        self.assertIsNone(ingest_queue.status('unknown'))
+
+    def test_drain_honours_its_timeout_when_the_queue_is_full(self):
+        ingest_queue = IngestQueue(max_size=1, num_workers=1)
+        release = threading.Event()
+        ingest_queue.submit(release.wait)
+        time.sleep(0.1)
+        queued_job = ingest_queue.submit(lambda: 'stored')
+
+        start = time.monotonic()
+        self.assertFalse(ingest_queue.drain(timeout=0.3))
+        self.assertLess(time.monotonic() - start, 2)
+        with self.assertRaises(QueueFullError):
+            ingest_queue.submit(lambda: None)
+
+        release.set()
+        self.assertTrue(ingest_queue.drain(timeout=5))
+        self.assertEqual(ingest_queue.status(queued_job)['result'], 'stored')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import tempfile
+import unittest
+from load_test import InProcessClient, load_frame, run_load_test
+
+class TestLoadTest(unittest.TestCase):
+    def test_report_covers_every_request(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            client = InProcessClient(tmp_dir)
+            report = run_load_test(client, 'process-batch', rate=20, duration=0.5, num_users=2, batch_size=2,
+                                   frame=load_frame(resolution=(64, 48)), concurrency=4)
+
+        self.assertEqual(report['requests'], 10)
+        self.assertEqual(report['status_counts'], {'202': 10})
+        self.assertEqual(report['error_rate'], 0.0)
+        self.assertEqual(report['storage_job_errors'], 0)
+        self.assertEqual(report['storage_frame_errors'], 0)
+        self.assertLessEqual(report['latency_ms']['p50'], report['latency_ms']['p99'])
+
+    def test_failed_frames_are_counted_apart_from_failed_jobs(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            client = InProcessClient(tmp_dir)
+            ingest_queue = client.app_module.ingest_queue
+            job_ids = [
+                ingest_queue.submit(lambda: [{'image': 'a', 'status': 'saved'}, {'image': 'b', 'status': 'error'}]),
+                ingest_queue.submit(lambda: {'image': 'c', 'status': 'error'}),
+                ingest_queue.submit(lambda: 1 / 0),
+            ]
+            _, job_errors, frame_errors = client.drain(job_ids)
+
+        self.assertEqual((job_errors, frame_errors), (1, 2))
+
+if __name__ == '__main__':
+    unittest.main()
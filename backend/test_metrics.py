@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+import metrics
+from metrics import Counter, Gauge, Histogram, MetricsRegistry, mark_process_dead
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        # Keep these test instruments out of the app's registry
+        self.registry = metrics.registry
+        metrics.registry = MetricsRegistry()
+
+    def tearDown(self):
+        metrics.registry = self.registry
+
+    def test_renders_prometheus_text(self):
+        counter = Counter('test_requests_total', "Requests.", ['endpoint'])
+        histogram = Histogram('test_stage_seconds', "Stage time.", ['stage'], buckets=(0.1, 1.0))
+        counter.inc(endpoint='calibrate')
+        counter.inc(2, endpoint='calibrate')
+        histogram.observe(0.05, stage='upload')
+        histogram.observe(0.5, stage='upload')
+        histogram.observe(5, stage='upload')
+
+        lines = metrics.registry.render().splitlines()
+        self.assertIn('# TYPE test_requests_total counter', lines)
+        self.assertIn('test_requests_total{endpoint="calibrate"} 3', lines)
+        self.assertIn('test_stage_seconds_bucket{stage="upload",le="0.1"} 1', lines)
+        self.assertIn('test_stage_seconds_bucket{stage="upload",le="1.0"} 2', lines)
+        self.assertIn('test_stage_seconds_bucket{stage="upload",le="+Inf"} 3', lines)
+        self.assertIn('test_stage_seconds_count{stage="upload"} 3', lines)
+
+    def test_disabled_instruments_record_nothing(self):
+        histogram = Histogram('test_disabled_seconds', "Stage time.", ['stage'])
+        enabled, metrics.METRICS_ENABLED = metrics.METRICS_ENABLED, False
+        try:
+            with histogram.time(stage='upload'):
+                pass
+            histogram.observe(1, stage='upload')
+        finally:
+            metrics.METRICS_ENABLED = enabled
+
+        self.assertNotIn('test_disabled_seconds_count', metrics.registry.render())
+
+    def test_multiproc_registries_add_up(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Two registries sharing a directory stand in for two gunicorn workers
+            worker_metrics = []
+            for depth in (2, 3):
+                metrics.registry = MetricsRegistry(tmp_dir)
+                counter = Counter('test_frames_total', "Frames.", ['data_type'])
+                histogram = Histogram('test_upload_seconds', "Upload time.", buckets=(0.1, 1.0))
+                Gauge('test_queue_depth', "Queue depth.", lambda depth=depth: depth)
+                counter.inc(depth, data_type='calibration')
+                histogram.observe(0.5)
+                worker_metrics.append(metrics.registry)
+            worker_metrics[0].flush()
+
+            lines = worker_metrics[1].render().splitlines()
+            self.assertIn('test_frames_total{data_type="calibration"} 5', lines)
+            self.assertIn('test_upload_seconds_bucket{le="1.0"} 2', lines)
+            self.assertIn('test_queue_depth 5', lines)
+
+            # An exited worker keeps its counts but no longer adds to gauges
+            mark_process_dead(os.getpid(), tmp_dir)
+            lines = worker_metrics[1].render().splitlines()
+            self.assertIn('test_frames_total{data_type="calibration"} 5', lines)
+            self.assertIn('test_queue_depth 3', lines)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import json
+import tempfile
+import unittest
+from load_test import InProcessClient, load_frame
+
+class TestProcessBatchValidation(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.client = InProcessClient(self.tmp_dir.name)
+        self.frame = load_frame(resolution=(64, 48))
+
+    def tearDown(self):
+        self.client.app_module.ingest_queue.join()
+        self.tmp_dir.cleanup()
+
+    def post(self, frames, filenames=None, data_type='eye_gaze'):
+        filenames = filenames or [f'frame_{i}.png' for i in range(len(frames))]
+        data = {'userId': 'batch_user', 'dataType': data_type, 'frames': json.dumps(frames)}
+        return self.client.post('/process-batch', data, [('images', (name, self.frame)) for name in filenames])
+
+    def test_bad_frames_are_rejected_and_the_rest_queued(self):
+        status, body = self.post([{'cursorPosition': {'x': 1, 'y': 2}}, {'cursorPosition': {'x': 'a'}}, {}])
+
+        self.assertEqual(status, 202)
+        self.assertEqual(sorted(body['data']['rejected']), ['1', '2'])
+        self.client.app_module.ingest_queue.join()
+        job = self.client.app_module.ingest_queue.status(body['data']['jobId'])
+        self.assertEqual(len(job['result']), 1)
+
+    def test_batch_with_no_valid_frames_is_rejected(self):
+        status, body = self.post([{'calibrationPoints': [1]}], data_type='calibration')
+
+        self.assertEqual(status, 400)
+        self.assertIn('0', body['data']['rejected'])
+
+    def test_out_of_order_images_are_rejected(self):
+        frames = [{'cursorPosition': {'x': 1, 'y': 2}}, {'cursorPosition': {'x': 3, 'y': 4}}]
+        status, _ = self.post(frames, filenames=['frame_1.png', 'frame_0.png'])
+
+        self.assertEqual(status, 400)
+
+    def test_malformed_frames_json_is_rejected(self):
+        status, _ = self.client.post('/process-batch', {'userId': 'batch_user', 'frames': '[{'},
+                                     [('images', ('frame_0.png', self.frame))])
+
+        self.assertEqual(status, 400)
+
+if __name__ == '__main__':
+    unittest.main()
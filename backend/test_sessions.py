@@ -0,0 +1,66 @@
+import json
+import tempfile
+import unittest
+from s3_data_handling import update_metadata_if_changed
+from sessions import SessionStore
+from storage import LocalStorage
+
+class CountingStorage(LocalStorage):
+    def __init__(self, root):
+        super().__init__(root)
+        self.puts = []
+
+    def put_bytes(self, key, data, content_type=None):
+        self.puts.append(key)
+        super().put_bytes(key, data, content_type)
+
+class TestSessions(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage = CountingStorage(self.tmp_dir.name)
+        self.camera_info = [[[560, 0, 320], [0, 560, 240], [0, 0, 1]], [0, 0, 0, 0, 0]]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_session_resolves_from_another_worker(self):
+        session_id = SessionStore().register(self.storage, 'cheif', {'screenWidth': 1780}, self.camera_info)
+
+        # A fresh store has an empty cache, like a different gunicorn worker
+        other_worker = SessionStore()
+        session = other_worker.get(self.storage, 'cheif', session_id)
+        self.assertEqual(session['cameraInfo'], self.camera_info)
+        self.assertIsNone(other_worker.get(self.storage, 'someone-else', session_id))
+        self.assertIsNone(other_worker.get(self.storage, 'cheif', 'unknown'))
+
+    def test_metadata_is_written_only_when_it_changes(self):
+        metadata_file = 'data/cheif/metadata.json'
+        metadata = {'screenData': {'screenWidth': 1780}, 'cameraInfo': self.camera_info}
+
+        self.assertTrue(update_metadata_if_changed(self.storage, metadata_file, metadata))
+        self.assertFalse(update_metadata_if_changed(self.storage, metadata_file, dict(reversed(list(metadata.items())))))
+
+        metadata['screenData'] = {'screenWidth': 1920}
+        self.assertTrue(update_metadata_if_changed(self.storage, metadata_file, metadata))
+        self.assertEqual(self.storage.puts, [metadata_file, metadata_file])
+        self.assertEqual(json.loads(self.storage.get_bytes(metadata_file))['screenData'], {'screenWidth': 1920})
+
+    def test_metadata_written_by_another_worker_is_not_masked(self):
+        metadata_file = 'data/cheif/metadata.json'
+        metadata = {'screenData': {'screenWidth': 1780}, 'cameraInfo': self.camera_info}
+        self.assertTrue(update_metadata_if_changed(self.storage, metadata_file, metadata))
+
+        # Another worker switches the user to a new screen; returning to the first one must be written again
+        self.storage.put_bytes(metadata_file, json.dumps({**metadata, 'screenData': {'screenWidth': 1920}}).encode('utf-8'))
+        self.assertTrue(update_metadata_if_changed(self.storage, metadata_file, metadata))
+        self.assertEqual(json.loads(self.storage.get_bytes(metadata_file)), metadata)
+
+    def test_unknown_session_id_is_rejected(self):
+        from load_test import InProcessClient
+        client = InProcessClient(self.tmp_dir.name)
+        status, _ = client.post('/session', {'userId': 'cheif', 'sessionId': 'unknown'}, [])
+
+        self.assertEqual(status, 400)
+
+if __name__ == '__main__':
+    unittest.main()
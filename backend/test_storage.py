@@ -0,0 +1,26 @@
+import tempfile
+import unittest
+from storage import LocalStorage, PreconditionFailedError, Storage
+
+class TestLocalStorage(unittest.TestCase):
+    def test_listing_etag_matches_read_and_changes_on_write(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            storage = LocalStorage(tmp_dir)
+            storage.put_bytes('data/u/metadata.json', b'{}')
+            data, etag = storage.get_bytes_and_etag('data/u/metadata.json')
+            [listed] = storage.list_objects('data/u/')
+
+            self.assertEqual(data, b'{}')
+            self.assertEqual(listed, {'Key': 'data/u/metadata.json', 'Size': 2, 'ETag': etag})
+
+            storage.put_bytes_if_match('data/u/metadata.json', b'{}', etag)
+            with self.assertRaises(PreconditionFailedError):
+                storage.put_bytes_if_match('data/u/metadata.json', b'{"a": 1}', etag)
+            self.assertNotEqual(storage.get_bytes_and_etag('data/u/metadata.json')[1], etag)
+
+    def test_storage_is_abstract(self):
+        with self.assertRaises(TypeError):
+            Storage()
+
+if __name__ == '__main__':
+    unittest.main()
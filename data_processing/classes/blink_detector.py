@@ -1,5 +1,5 @@
-import math
 import numpy as np
+from classes.landmarks import landmarks_to_array
 
 class BlinkDetector:
     def __init__(self, eye_aspect_ratio_threshold=5.7, consecutive_frames_threshold=2):
@@ -8,22 +8,16 @@ class BlinkDetector:
         self.blink_count = 0
         self.blinking = False
 
-    def _midpoint(self, point1, point2):
-        return (point1.x + point2.x) / 2, (point1.y + point2.y) / 2
-
-    def _euclidean_distance(self, point1, point2):
-        return math.sqrt((point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2)
-
     def _get_blink_ratio(self, eye_points, facial_landmarks):
-        corner_left = (facial_landmarks.part(eye_points[0]).x, facial_landmarks.part(eye_points[0]).y)
-        corner_right = (facial_landmarks.part(eye_points[3]).x, facial_landmarks.part(eye_points[3]).y)
-        center_top = self._midpoint(facial_landmarks.part(eye_points[1]), facial_landmarks.part(eye_points[2]))
-        center_bottom = self._midpoint(facial_landmarks.part(eye_points[5]), facial_landmarks.part(eye_points[4]))
-        horizontal_length = self._euclidean_distance(corner_left, corner_right)
-        vertical_length = self._euclidean_distance(center_top, center_bottom)
+        eye = landmarks_to_array(facial_landmarks)[eye_points].astype(np.float64)
+        center_top = (eye[1] + eye[2]) / 2
+        center_bottom = (eye[5] + eye[4]) / 2
+        horizontal_length = np.linalg.norm(eye[0] - eye[3])
+        vertical_length = np.linalg.norm(center_top - center_bottom)
         return horizontal_length / vertical_length
 
     def detect_blink(self, facial_landmarks, left_eye_points, right_eye_points):
+        facial_landmarks = landmarks_to_array(facial_landmarks)
         left_eye_ratio = self._get_blink_ratio(left_eye_points, facial_landmarks)
         right_eye_ratio = self._get_blink_ratio(right_eye_points, facial_landmarks)
         blink_ratio = (left_eye_ratio + right_eye_ratio) / 2
@@ -1,6 +1,28 @@
+import csv
+import glob
+import itertools
+import math
 import os
+import shutil
 import pandas as pd
 import numpy as np
+
+# Typed columns written next to each processed CSV, one .npy file per column:
+# name -> (dtype, components per row)
+COLUMNS = {
+    'image_path': (str, 1),
+    'label': (np.float64, 2),
+    # Pupil centres are sub-pixel, boxes whole pixels
+    'left_pupil': (np.float32, 2),
+    'left_box': (np.int32, 4),
+    'right_pupil': (np.float32, 2),
+    'right_box': (np.int32, 4),
+    'rotation': (np.float64, 3),
+    'translation': (np.float64, 3),
+}
+# Fields of a processed row: image path, labels, eye data, rotation and translation
+ROW_LENGTH = 17
+
 class CSVManager:
     def __init__(self, local_base_dir):
         self.local_base_dir = local_base_dir
@@ -47,4 +69,153 @@ class CSVManager:
         new_data_df = pd.DataFrame(image_data)
         
         # Write the new DataFrame to the CSV file, overwriting the old data
-        new_data_df.to_csv(csv_path, index=False, header=False)
\ No newline at end of file
+        new_data_df.to_csv(csv_path, index=False, header=False)
+
+    def read_data_log(self, csv_path):
+        """
+        Reads a data CSV together with its append-only part log.
+        The backend writes each request as a part under `<name>_parts/` and
+        compacts them into `<name>.csv` later, so both have to be read.
+        Args:
+            csv_path: Path to the compacted CSV file.
+        Returns:
+            A list of rows (lists of strings), compacted rows first, with
+            duplicates left behind by a compaction removed.
+        """
+        parts_dir = csv_path[:-len('.csv')] + '_parts' if csv_path.endswith('.csv') else csv_path + '_parts'
+        paths = [csv_path] + sorted(glob.glob(os.path.join(parts_dir, '*.part')))
+
+        rows = []
+        seen = set()
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, newline='') as f:
+                for row in csv.reader(f):
+                    key = tuple(row)
+                    if row and key not in seen:
+                        seen.add(key)
+                        rows.append(row)
+        return rows
+
+    @staticmethod
+    def columns_path(csv_path):
+        """Directory holding the typed columns of a processed CSV."""
+        return (csv_path[:-len('.csv')] if csv_path.endswith('.csv') else csv_path) + '_columns'
+
+    @staticmethod
+    def rows_to_columns(image_data):
+        """
+        Converts processed rows, as produced by format_*_data_row with the image
+        path in front, into typed arrays. Rows read back from a CSV work too.
+        """
+        def floats(values):
+            return [float(value) if value not in ('', None) else np.nan for value in values]
+
+        def vector(value):
+            return [float(x) for x in str(value).strip('"').split(',')]
+
+        count = len(image_data)
+        values = {
+            'image_path': [row[0] for row in image_data],
+            'label': [floats(row[1:3]) for row in image_data],
+            'left_pupil': [row[3:5] for row in image_data],
+            'left_box': [row[5:9] for row in image_data],
+            'right_pupil': [row[9:11] for row in image_data],
+            'right_box': [row[11:15] for row in image_data],
+            'rotation': [vector(row[15]) for row in image_data],
+            'translation': [vector(row[16]) for row in image_data],
+        }
+        columns = {}
+        for name, (dtype, width) in COLUMNS.items():
+            # Through float so boxes read back from a CSV as '12.0' still convert
+            column = np.array(values[name], dtype=str if dtype is str else np.float64)
+            columns[name] = column.astype(dtype).reshape((count, width) if width > 1 else count)
+        return columns
+
+    def write_processed(self, local_base_dir, subdirectory, csv_file_name, rows, write_csv=True, chunk_size=4096):
+        """
+        Streams processed rows into the typed columns and, with write_csv, the
+        CSV export, replacing both. rows may be any iterable, e.g. a generator
+        over the processing state; it is read once, chunk_size rows at a time,
+        so only the compact column arrays are held, never every row as a list.
+        Returns:
+            The number of rows written.
+        """
+        csv_path = os.path.join(local_base_dir, subdirectory, csv_file_name)
+        columns_dir = self.columns_path(csv_path)
+        tmp_dir = columns_dir + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        rows = iter(rows)
+        parts = {name: [] for name in COLUMNS}
+        count = 0
+        csv_file = open(f'{csv_path}.tmp', 'w', newline='') if write_csv else None
+        try:
+            writer = csv.writer(csv_file) if csv_file is not None else None
+            for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+                if writer is not None:
+                    # Blank for NaN, as pandas wrote it
+                    writer.writerows([['' if isinstance(value, float) and math.isnan(value) else value for value in row]
+                                      for row in chunk])
+                for name, column in self.rows_to_columns(chunk).items():
+                    parts[name].append(column)
+                count += len(chunk)
+        finally:
+            if csv_file is not None:
+                csv_file.close()
+
+        empty = self.rows_to_columns([])
+        for name in COLUMNS:
+            column = np.concatenate(parts[name]) if parts[name] else empty[name]
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), column, allow_pickle=False)
+        shutil.rmtree(columns_dir, ignore_errors=True)
+        os.replace(tmp_dir, columns_dir)
+        if write_csv:
+            os.replace(f'{csv_path}.tmp', csv_path)
+        return count
+
+    def load_columns(self, csv_path, mmap_mode=None):
+        """
+        Loads the typed columns of a processed CSV, falling back to parsing the
+        CSV itself for data processed before the columns existed.
+        Args:
+            csv_path: Path to the processed CSV file.
+            mmap_mode: Passed to np.load, e.g. 'r' to map the numeric columns.
+        Returns:
+            A dict of column name to array, as in COLUMNS, or None if neither exists.
+        """
+        columns_dir = self.columns_path(csv_path)
+        if os.path.isdir(columns_dir):
+            return {name: np.load(os.path.join(columns_dir, f'{name}.npy'),
+                                  mmap_mode=None if name == 'image_path' else mmap_mode, allow_pickle=False)
+                    for name in COLUMNS}
+        if not os.path.exists(csv_path):
+            return None
+        with open(csv_path, newline='') as f:
+            # Raw CSVs that were never processed have no rows of this length
+            return self.rows_to_columns([row for row in csv.reader(f) if len(row) == ROW_LENGTH])
+
+    def load_dataset_columns(self, base_dir, csv_filter=None):
+        """
+        Concatenates the columns of every processed CSV under base_dir.
+        Args:
+            csv_filter: Optional predicate on the CSV path selecting which files to load.
+        Returns:
+            A dict of column name to array, plus 'source' with the CSV path of each row.
+        """
+        csv_paths = sorted(glob.glob(os.path.join(base_dir, '**', '*.csv'), recursive=True))
+        loaded = []
+        for csv_path in csv_paths:
+            if csv_filter is not None and not csv_filter(csv_path):
+                continue
+            columns = self.load_columns(csv_path)
+            if columns is not None:
+                loaded.append((csv_path, columns))
+
+        if not loaded:
+            return {**self.rows_to_columns([]), 'source': np.array([], dtype=str)}
+        dataset = {name: np.concatenate([columns[name] for _, columns in loaded]) for name in COLUMNS}
+        dataset['source'] = np.concatenate([np.full(len(columns['image_path']), csv_path) for csv_path, columns in loaded])
+        return dataset
@@ -1,85 +1,198 @@
-import boto3
-from botocore.exceptions import ClientError
+import sys
+from pathlib import Path
+# The storage backends live with the backend so both sides share one key layout
+sys.path.append(str(Path(__file__).resolve().parents[2] / 'backend'))
+
 import os
 import numpy as np
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from classes.inventory import INVENTORY_NAME, BucketInventory
+from storage import DATA_ROOT, S3Storage, images_prefix, user_id_from_key
+
+MANIFEST_NAME = '.sync_manifest.json'
+
 class DataHandler:
-    def __init__(self, bucket_name, local_base_dir):
-        self.s3_client = boto3.client('s3')
+    def __init__(self, bucket_name, local_base_dir, storage=None, download_concurrency=16, download_retries=3):
+        self.storage = storage or S3Storage(bucket_name, max_pool_connections=max(32, download_concurrency))
         self.bucket_name = bucket_name
         self.local_base_dir = local_base_dir
+        self.download_concurrency = download_concurrency
+        self.download_retries = download_retries
+        self._manifests = {}
+        self._manifest_lock = threading.Lock()
+        # Set by process_s3_bucket_data; queries list the bucket directly while it is None
+        self.inventory = None
 
     def get_camera_info(self, camera_info):
         camera_matrix = np.array(camera_info[0], dtype='double')
         dist_coeffs = np.array(camera_info[1], dtype='double')
         return camera_matrix, dist_coeffs
-        
-    def get_metadata(self, bucket_name, metadata_file_key, s3_client):
+
+    def get_metadata(self, metadata_file_key):
         try:
-            metadata_object = s3_client.get_object(Bucket=bucket_name, Key=metadata_file_key)
-            metadata_content = metadata_object['Body'].read().decode('utf-8')
-            metadata = json.loads(metadata_content)
+            if self.inventory is not None:
+                metadata = self.inventory.get_metadata(metadata_file_key)
+                if metadata is None:
+                    raise FileNotFoundError(metadata_file_key)
+                return metadata
+            metadata_content = self.storage.get_bytes(metadata_file_key)
+            if metadata_content is None:
+                raise FileNotFoundError(metadata_file_key)
+            metadata = json.loads(metadata_content.decode('utf-8'))
             return metadata
         except Exception as e:
-            print(f"Error retrieving metadata from S3: {e}")
+            print(f"Error retrieving metadata from storage: {e}")
             return None
-        
-    def get_image_paths(self, bucket_name, key_prefix, subdirectory, s3_client):
-        paginator = s3_client.get_paginator('list_objects_v2')
+
+    def get_image_paths(self, key_prefix, subdirectory):
         image_paths = []
+        listing = self.inventory.listing if self.inventory is not None else self.storage.list_objects
 
         # List objects within a specific subdirectory
-        for page in paginator.paginate(Bucket=bucket_name, Prefix=f"{key_prefix}{subdirectory}"):
-            for obj in page.get('Contents', []):
-                # Skip directories
-                if obj['Key'].endswith('/'):
-                    continue
-                image_paths.append(obj['Key'])
+        for obj in listing(f"{key_prefix}{subdirectory}"):
+            # Skip directories
+            if obj['Key'].endswith('/'):
+                continue
+            image_paths.append(obj['Key'])
 
         return image_paths
 
-    def download_data(self, key_prefix, local_base_dir, s3_client, bucket_name):
-        paginator = s3_client.get_paginator('list_objects_v2')
-        for page in paginator.paginate(Bucket=bucket_name, Prefix=key_prefix):
-            print(f"Downloading data from {key_prefix}")
-            for obj in page.get('Contents', []):
-                s3_object_key = obj['Key']
-                if s3_object_key.endswith('/'):
-                    continue
-                local_file_path = os.path.join(local_base_dir, s3_object_key)
-                os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-
+    def load_manifest(self, local_base_dir):
+        """
+        Size and ETag of every object synced into local_base_dir, as of its
+        download. Kept in .sync_manifest.json so a sync never has to compare
+        against the remote copy.
+        """
+        if local_base_dir not in self._manifests:
+            try:
+                with open(os.path.join(local_base_dir, MANIFEST_NAME), 'r') as f:
+                    self._manifests[local_base_dir] = json.load(f)
+            except FileNotFoundError:
+                self._manifests[local_base_dir] = {}
+        return self._manifests[local_base_dir]
+
+    def save_manifest(self, local_base_dir):
+        with self._manifest_lock:
+            manifest_json = json.dumps(self.load_manifest(local_base_dir))
+        os.makedirs(local_base_dir, exist_ok=True)
+        manifest_path = os.path.join(local_base_dir, MANIFEST_NAME)
+        with open(f'{manifest_path}.tmp', 'w') as f:
+            f.write(manifest_json)
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+
+    def needs_download(self, obj, local_base_dir):
+        local_file_path = os.path.join(local_base_dir, obj['Key'])
+        if not os.path.exists(local_file_path):
+            return True
+        entry = self.load_manifest(local_base_dir).get(obj['Key'])
+        if entry is None:
+            # Synced before the manifest existed: trust it if the size matches, as the old sync did
+            if os.stat(local_file_path).st_size != obj['Size']:
+                return True
+            self.load_manifest(local_base_dir)[obj['Key']] = {'size': obj['Size'], 'etag': obj['ETag']}
+            return False
+        return entry['size'] != obj['Size'] or entry['etag'] != obj['ETag']
+
+    def download_object(self, obj, local_base_dir):
+        local_file_path = os.path.join(local_base_dir, obj['Key'])
+        os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+        for attempt in range(self.download_retries + 1):
+            try:
+                self.storage.download_file(obj['Key'], local_file_path)
+                break
+            except Exception as e:
+                if attempt == self.download_retries:
+                    raise
+                delay = 0.5 * 2 ** attempt
+                print(f"Retrying {obj['Key']} in {delay:.1f}s after error: {e}")
+                time.sleep(delay)
+        with self._manifest_lock:
+            self.load_manifest(local_base_dir)[obj['Key']] = {'size': obj['Size'], 'etag': obj['ETag']}
+
+    def download_data(self, key_prefix, local_base_dir, objects=None):
+        """
+        Syncs every object under key_prefix into local_base_dir.
+        Objects are skipped when their listed size and ETag match the manifest,
+        and the rest are downloaded on a pool of download_concurrency threads.
+        Args:
+            objects: Listing entries (dicts with Key, Size and ETag) to sync
+                instead of listing key_prefix again.
+        Returns:
+            A dict with the number of files and bytes downloaded, skipped and failed.
+        """
+        print(f"Downloading data from {key_prefix}")
+        if objects is None:
+            listing = self.inventory.listing if self.inventory is not None else self.storage.list_objects
+            objects = listing(key_prefix)
+        objects = [obj for obj in objects if not obj['Key'].endswith('/')]
+        to_download = [obj for obj in objects if self.needs_download(obj, local_base_dir)]
+
+        summary = {'downloaded': 0, 'bytes': 0, 'failed': 0, 'skipped': len(objects) - len(to_download)}
+        if not to_download:
+            self.save_manifest(local_base_dir)
+            return summary
+
+        total_bytes = sum(obj['Size'] for obj in to_download)
+        start = last_report = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.download_concurrency) as executor:
+            futures = [(obj, executor.submit(self.download_object, obj, local_base_dir)) for obj in to_download]
+            for obj, future in futures:
                 try:
-                    local_file_info = os.stat(local_file_path)
-                    s3_object_info = s3_client.head_object(Bucket=bucket_name, Key=s3_object_key)
-                    if local_file_info.st_size == s3_object_info['ContentLength']:
-                        continue
-                except (FileNotFoundError, ClientError):
-                    pass
+                    future.result()
+                    summary['downloaded'] += 1
+                    summary['bytes'] += obj['Size']
+                except Exception as e:
+                    summary['failed'] += 1
+                    print(f"Failed to download {obj['Key']}: {e}")
+
+                now = time.perf_counter()
+                if now - last_report >= 5:
+                    last_report = now
+                    # Saving as we go means an interrupted sync resumes where it stopped
+                    self.save_manifest(local_base_dir)
+                    print(f"{summary['downloaded']}/{len(to_download)} files, "
+                          f"{summary['bytes'] / 1e6:.1f}/{total_bytes / 1e6:.1f} MB, "
+                          f"{summary['bytes'] / 1e6 / (now - start):.1f} MB/s")
+
+        self.save_manifest(local_base_dir)
+        elapsed = time.perf_counter() - start
+        print(f"Downloaded {summary['downloaded']} files ({summary['bytes'] / 1e6:.1f} MB) in {elapsed:.1f}s, "
+              f"{summary['downloaded'] / elapsed:.1f} files/s, {summary['failed']} failed")
+        return summary
+
+    def get_all_metadata_keys(self):
+        if self.inventory is not None:
+            return self.inventory.metadata_keys()
 
-                s3_client.download_file(bucket_name, s3_object_key, local_file_path)
-
-    def get_all_metadata_keys(self, bucket_name, s3_client):
         metadata_keys = []
-        paginator = s3_client.get_paginator('list_objects_v2')
-        print(f"Looking for metadata files in bucket {bucket_name}")
-        for page in paginator.paginate(Bucket=bucket_name, Prefix='data/'):
-            for content in page.get('Contents', []):
-                key = content['Key']
-                if key.endswith('metadata.json'):
-                    metadata_keys.append(key)
+        print(f"Looking for metadata files in bucket {self.bucket_name}")
+        for obj in self.storage.list_objects(DATA_ROOT):
+            key = obj['Key']
+            if key.endswith('metadata.json'):
+                metadata_keys.append(key)
         print(f"Found {len(metadata_keys)} metadata files")
         return metadata_keys
 
     def should_process(self, metadata_key):
-        metadata = self.get_metadata(self.bucket_name, metadata_key, self.s3_client)
-        return 'cameraInfo' in metadata
+        metadata = self.get_metadata(metadata_key)
+        return metadata is not None and 'cameraInfo' in metadata
+
+    def load_inventory(self, local_base_dir):
+        """Refreshes the bucket inventory with one listing; every later query is answered from it."""
+        self.inventory = BucketInventory(self.storage, os.path.join(local_base_dir, INVENTORY_NAME))
+        self.inventory.refresh()
+        return self.inventory
 
     def process_s3_bucket_data(self, bucket_name, local_base_dir, process_image, csv_manager):
-        metadata_keys = self.get_all_metadata_keys(bucket_name, self.s3_client)
+        self.load_inventory(local_base_dir)
+        metadata_keys = self.get_all_metadata_keys()
 
         for metadata_key in metadata_keys:
             subdir_prefix = '/'.join(metadata_key.split('/')[:-1]) + '/'
+            user_id = user_id_from_key(metadata_key)
             print(f"Processing data for {subdir_prefix}")
             local_dir = os.path.join(local_base_dir, subdir_prefix)
             should_download = not os.path.exists(local_dir) or not os.listdir(local_dir)
@@ -88,15 +201,15 @@ class DataHandler:
             needs_processing = self.should_process(metadata_key)
 
 
-            self.download_data(subdir_prefix, local_base_dir, self.s3_client, bucket_name)
+            self.download_data(subdir_prefix, local_base_dir)
 
             # Process data if it needs processing, regardless of whether it was just downloaded or was already present
             if needs_processing:
-                metadata = self.get_metadata(bucket_name, metadata_key, self.s3_client)
+                metadata = self.get_metadata(metadata_key)
                 if 'cameraInfo' in metadata:
                     camera_matrix, dist_coeffs = self.get_camera_info(metadata['cameraInfo'])
-                    calibration_image_paths = self.get_image_paths(bucket_name, subdir_prefix, 'calibration_images/', self.s3_client)
-                    eye_gaze_image_paths = self.get_image_paths(bucket_name, subdir_prefix, 'eye_gaze_images/', self.s3_client)
+                    calibration_image_paths = self.get_image_paths(images_prefix(user_id, 'calibration'), '')
+                    eye_gaze_image_paths = self.get_image_paths(images_prefix(user_id, 'eye_gaze'), '')
 
                     if calibration_image_paths:
                         process_image(calibration_image_paths, local_base_dir, subdir_prefix, 'calibration_data.csv', csv_manager, (camera_matrix, dist_coeffs))
@@ -108,3 +221,5 @@ class DataHandler:
             elif not should_download and not needs_processing:
                 print(f"No processing or downloading needed for {subdir_prefix}")
 
+        # Keeps the metadata fetched this run for the next one
+        self.inventory.save()
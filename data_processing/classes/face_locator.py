@@ -0,0 +1,70 @@
+import cv2
+import dlib
+
+class FaceLocator:
+    """
+    Drop-in replacement for the dlib frontal face detector with cheaper modes.
+    It is called like the detector, so it can be handed to ImageProcessor as
+    its detector, and it returns dlib rectangles in full-frame coordinates.
+
+    Modes:
+        'full': the HOG detector on the whole frame, as before.
+        'downscaled': the detector on a grayscale copy resized to detect_width,
+            with the boxes mapped back to full size.
+        'tracking': like 'downscaled', but once a face is found only a window
+            around the previous box is searched. Our frames are consecutive
+            captures of one seated user, so the face rarely moves far. A miss
+            falls back to a downscaled search of the whole frame.
+    """
+
+    MODES = ('full', 'downscaled', 'tracking')
+
+    def __init__(self, detector=None, mode='downscaled', detect_width=320, roi_margin=0.5):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown face locator mode: {mode}")
+        self.detector = detector or dlib.get_frontal_face_detector()
+        self.mode = mode
+        self.detect_width = detect_width
+        self.roi_margin = roi_margin
+        self.previous_face = None
+        self.stats = {'full': 0, 'downscaled': 0, 'roi': 0, 'roi_misses': 0}
+
+    def reset(self):
+        """Forgets the tracked face, e.g. when a new session or user starts."""
+        self.previous_face = None
+
+    def __call__(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        if self.mode == 'full':
+            self.stats['full'] += 1
+            return list(self.detector(gray))
+
+        faces = None
+        if self.mode == 'tracking' and self.previous_face is not None:
+            faces = self._detect_around(gray, self.previous_face)
+            self.stats['roi' if faces else 'roi_misses'] += 1
+        if not faces:
+            faces = self._detect_scaled(gray, 0, 0)
+            self.stats['downscaled'] += 1
+
+        if self.mode == 'tracking':
+            self.previous_face = faces[0] if faces else None
+        return faces
+
+    def _detect_around(self, gray, face):
+        margin_x = int(face.width() * self.roi_margin)
+        margin_y = int(face.height() * self.roi_margin)
+        left = max(face.left() - margin_x, 0)
+        top = max(face.top() - margin_y, 0)
+        right = min(face.right() + margin_x, gray.shape[1])
+        bottom = min(face.bottom() + margin_y, gray.shape[0])
+        return self._detect_scaled(gray[top:bottom, left:right], left, top)
+
+    def _detect_scaled(self, gray, offset_x, offset_y):
+        """Runs the detector on gray shrunk to at most detect_width wide; boxes come back offset into the full frame."""
+        scale = min(1.0, self.detect_width / gray.shape[1])
+        if scale < 1.0:
+            gray = cv2.resize(gray, (self.detect_width, max(1, round(gray.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+        return [dlib.rectangle(int(face.left() / scale) + offset_x, int(face.top() / scale) + offset_y,
+                               int(face.right() / scale) + offset_x, int(face.bottom() / scale) + offset_y)
+                for face in self.detector(gray)]
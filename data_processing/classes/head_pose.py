@@ -0,0 +1,87 @@
+import cv2
+import numpy as np
+from classes.landmarks import landmarks_to_array
+
+# Points of a generic 3D face model, matched to the landmarks below
+MODEL_POINTS = np.array([
+    (0.0, 0.0, 0.0),             # Nose tip
+    (0.0, -330.0, -65.0),        # Chin
+    (-225.0, 170.0, -135.0),     # Left eye left corner
+    (225.0, 170.0, -135.0),      # Right eye right corner
+    (-150.0, -150.0, -125.0),    # Left Mouth corner
+    (150.0, -150.0, -125.0)      # Right mouth corner
+])
+IMAGE_POINT_INDICES = [30, 8, 36, 45, 48, 54]
+
+class HeadPoseEstimator:
+    """
+    solvePnP head pose for one camera, i.e. one user.
+    The intrinsics are converted once, and with warm_start each solve starts
+    from the previous frame's pose, which for a seated user is close to the
+    answer. If a warm-started solve fails or reprojects worse than
+    max_reprojection_error pixels, it is redone from scratch.
+    """
+
+    def __init__(self, camera_matrix, dist_coeffs, warm_start=True, max_reprojection_error=5.0):
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64).reshape(3, 3)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64).reshape(-1, 1)
+        self.warm_start = warm_start
+        self.max_reprojection_error = max_reprojection_error
+        self.previous = None
+        self.stats = {'warm': 0, 'cold': 0, 'fallbacks': 0}
+
+    def reset(self):
+        """Forgets the previous pose, e.g. at the start of a new session."""
+        self.previous = None
+
+    def estimate(self, landmarks):
+        """
+        Args:
+            landmarks: (68, 2) array or dlib full_object_detection.
+        Returns:
+            (rotation_vector, translation_vector) as (3, 1) arrays, or None if solvePnP failed.
+        """
+        image_points = landmarks_to_array(landmarks)[IMAGE_POINT_INDICES].astype(np.float64)
+
+        if self.warm_start and self.previous is not None:
+            rotation_vector, translation_vector = (vector.copy() for vector in self.previous)
+            success, rotation_vector, translation_vector = cv2.solvePnP(
+                MODEL_POINTS, image_points, self.camera_matrix, self.dist_coeffs,
+                rotation_vector, translation_vector, useExtrinsicGuess=True, flags=cv2.SOLVEPNP_ITERATIVE)
+            if success and self._reprojection_error(image_points, rotation_vector, translation_vector) <= self.max_reprojection_error:
+                self.stats['warm'] += 1
+                self.previous = (rotation_vector, translation_vector)
+                return rotation_vector, translation_vector
+            self.stats['fallbacks'] += 1
+
+        success, rotation_vector, translation_vector = cv2.solvePnP(
+            MODEL_POINTS, image_points, self.camera_matrix, self.dist_coeffs, flags=cv2.SOLVEPNP_ITERATIVE)
+        self.stats['cold'] += 1
+        if not success:
+            self.previous = None
+            return None
+        self.previous = (rotation_vector, translation_vector)
+        return rotation_vector, translation_vector
+
+    def estimate_batch(self, landmarks_batch):
+        """
+        Solves a sequence of frames in order, warm-starting each from the last.
+        Args:
+            landmarks_batch: (N, 68, 2) array, or a sequence of landmark arrays with None for frames without a face.
+        Returns:
+            (rotations, translations) as (N, 3) float arrays, NaN where there was no pose.
+        """
+        rotations = np.full((len(landmarks_batch), 3), np.nan)
+        translations = np.full((len(landmarks_batch), 3), np.nan)
+        for i, landmarks in enumerate(landmarks_batch):
+            if landmarks is None:
+                continue
+            pose = self.estimate(landmarks)
+            if pose is not None:
+                rotations[i] = pose[0].ravel()
+                translations[i] = pose[1].ravel()
+        return rotations, translations
+
+    def _reprojection_error(self, image_points, rotation_vector, translation_vector):
+        projected, _ = cv2.projectPoints(MODEL_POINTS, rotation_vector, translation_vector, self.camera_matrix, self.dist_coeffs)
+        return float(np.mean(np.linalg.norm(projected.reshape(-1, 2) - image_points, axis=1)))
@@ -0,0 +1,153 @@
+import glob
+import json
+import os
+import numpy as np
+from classes.processing_state import file_hash
+
+HEAD_POSE_STATS_NAME = 'head_pose_stats.json'
+# Rotation then translation vector in MPIIGaze's annotation.txt lines
+MPII_HEAD_POSE_COLUMNS = range(29, 35)
+
+def head_pose_stats_path(dataset_dir):
+    return os.path.join(dataset_dir, HEAD_POSE_STATS_NAME)
+
+def read_mpii_head_pose(annotation_path):
+    """Returns the (N, 6) head rotation and translation of an MPIIGaze annotation.txt."""
+    return np.loadtxt(annotation_path, usecols=MPII_HEAD_POSE_COLUMNS, ndmin=2, dtype=np.float64)
+
+class HeadPoseStats:
+    """
+    Per-dimension min and max of the 6 head pose values (rotation, then
+    translation) used to scale them to [0, 1]. They are kept per source file,
+    keyed by its path relative to the stats file and its content hash, so
+    adding a user only reads that user's data. Both the custom and the MPIIGaze
+    pipelines add their sources to the same file and normalise with the
+    combined range.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.sources = {}
+        self._dirty = False
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.sources = json.load(f)['sources']
+
+    def _key(self, source_path):
+        return os.path.relpath(source_path, os.path.dirname(os.path.abspath(self.path)))
+
+    def update(self, source_path, content_hash, load):
+        """
+        Recomputes the range of one source if its content changed.
+        Args:
+            load: Called without arguments to get the source's (N, 6) head pose array.
+        Returns:
+            True if the source was (re)read.
+        """
+        key = self._key(source_path)
+        entry = self.sources.get(key)
+        if entry is not None and entry['hash'] == content_hash:
+            return False
+        head_pose = np.asarray(load(), dtype=np.float64).reshape(-1, 6)
+        self.sources[key] = {
+            'hash': content_hash,
+            'count': len(head_pose),
+            'min': head_pose.min(axis=0).tolist() if len(head_pose) else None,
+            'max': head_pose.max(axis=0).tolist() if len(head_pose) else None,
+        }
+        self._dirty = True
+        return True
+
+    def prune(self, base_dir, source_paths):
+        """Forgets sources under base_dir that are not in source_paths, e.g. deleted users."""
+        base_key = self._key(base_dir)
+        prefix = '' if base_key == os.curdir else base_key + os.sep
+        keep = {self._key(source_path) for source_path in source_paths}
+        for key in [key for key in self.sources if key.startswith(prefix) and key not in keep]:
+            del self.sources[key]
+            self._dirty = True
+
+    @property
+    def count(self):
+        return sum(entry['count'] for entry in self.sources.values())
+
+    @property
+    def min_vals(self):
+        return self._reduce('min', np.min)
+
+    @property
+    def max_vals(self):
+        return self._reduce('max', np.max)
+
+    def _reduce(self, field, reduce):
+        values = [entry[field] for entry in self.sources.values() if entry['count']]
+        if not values:
+            raise ValueError(f"No head pose data recorded in {self.path}")
+        return reduce(np.array(values), axis=0)
+
+    def normalize(self, head_pose):
+        """Scales (..., 6) head pose values to [0, 1] over the recorded range."""
+        min_vals = self.min_vals
+        return (np.asarray(head_pose, dtype=np.float64) - min_vals) / (self.max_vals - min_vals)
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'sources': self.sources}, f, indent=1, sort_keys=True)
+        os.replace(self.path + '.tmp', self.path)
+        self._dirty = False
+
+def renormalize_head_pose(head_pose, stored_range, min_vals, max_vals):
+    """Moves (..., 6) head pose values normalised over stored_range, a [min, max] pair, to [min_vals, max_vals]."""
+    old_min, old_max = np.array(stored_range[0]), np.array(stored_range[1])
+    return (np.asarray(head_pose) * (old_max - old_min) + old_min - min_vals) / (max_vals - min_vals)
+
+def rescale_head_pose(writer, min_vals, max_vals):
+    """
+    Brings the head pose labels (columns 2 onwards) already in a MemmapWriter
+    to the current range, so an incremental build never mixes samples
+    normalised with different stats. Each shard records the range of its
+    labels and is swapped in whole, so a rerun after a crash only rescales the
+    shards that were not done.
+    """
+    current = [min_vals.tolist(), max_vals.tolist()]
+    # Shards written before ranges were kept per shard use the dataset's
+    default = writer.metadata.get('head_pose_range')
+    for number, shard in enumerate(writer.shards):
+        stored = shard.get('head_pose_range', default)
+        if stored is None or stored == current or not shard['count']:
+            shard['head_pose_range'] = current
+            continue
+        print(f"Head pose range changed, rescaling the labels of shard {number}")
+        labels = np.array(writer.read_labels(number))
+        labels[:, 2:] = renormalize_head_pose(labels[:, 2:], stored, min_vals, max_vals)
+        writer.replace_labels(number, labels, head_pose_range=current)
+    writer.metadata['head_pose_range'] = current
+    writer.flush()
+
+def _custom_head_pose(csv_manager, csv_path):
+    columns = csv_manager.load_columns(csv_path)
+    return np.hstack([columns['rotation'], columns['translation']])
+
+def update_custom_stats(stats, base_dir, csv_manager):
+    """Adds every processed data CSV under base_dir, reading only new or changed ones."""
+    csv_paths = sorted(glob.glob(os.path.join(base_dir, '**', '*.csv'), recursive=True))
+    for csv_path in csv_paths:
+        columns_dir = csv_manager.columns_path(csv_path)
+        if os.path.isdir(columns_dir):
+            content_hash = '-'.join(file_hash(os.path.join(columns_dir, f'{name}.npy')) for name in ('rotation', 'translation'))
+        else:
+            content_hash = file_hash(csv_path)
+        if stats.update(csv_path, content_hash, lambda: _custom_head_pose(csv_manager, csv_path)):
+            print(f"Updated head pose stats from {csv_path}")
+    stats.prune(base_dir, csv_paths)
+
+def update_mpii_stats(stats, base_dir):
+    """Adds every MPIIGaze annotation.txt under base_dir, reading only new or changed ones."""
+    annotation_paths = sorted(glob.glob(os.path.join(base_dir, '**', 'annotation.txt'), recursive=True))
+    for annotation_path in annotation_paths:
+        if stats.update(annotation_path, file_hash(annotation_path), lambda: read_mpii_head_pose(annotation_path)):
+            print(f"Updated head pose stats from {annotation_path}")
+    stats.prune(base_dir, annotation_paths)
@@ -0,0 +1,129 @@
+import json
+import os
+from storage import DATA_ROOT, user_id_from_key
+
+INVENTORY_NAME = '.bucket_inventory.json'
+
+def parse_data_key(key):
+    """
+    Splits a key under DATA_ROOT into (user_id, data_type, kind), e.g.
+    'data/u/eye_gaze_images/u_1.png' -> ('u', 'eye_gaze', 'images') and
+    'data/u/metadata.json' -> ('u', None, 'metadata').
+    """
+    user_id = user_id_from_key(key)
+    if user_id is None:
+        return None, None, None
+    rest = key[len(DATA_ROOT) + len(user_id) + 1:]
+    if rest == 'metadata.json':
+        return user_id, None, 'metadata'
+    head = rest.split('/', 1)[0]
+    for kind in ('images', 'eye_crops', 'data_parts', 'data.csv'):
+        if head.endswith(f'_{kind}'):
+            return user_id, head[:-len(kind) - 1], kind if kind != 'data.csv' else 'csv'
+    return user_id, None, head
+
+class BucketInventory:
+    """
+    Local index of every object under DATA_ROOT, built from one listing pass
+    and kept in a JSON file between runs. DataHandler answers its queries
+    from here instead of listing each user prefix and fetching each metadata
+    file again. Metadata bodies are cached by ETag, so an unchanged
+    metadata.json is never fetched twice.
+    """
+
+    def __init__(self, storage, index_path):
+        self.storage = storage
+        self.index_path = index_path
+        self.objects = {}
+        self.metadata = {}
+        self._by_user = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return
+        self.objects = index['objects']
+        self.metadata = index['metadata']
+        self._group_by_user()
+
+    def _group_by_user(self):
+        # Per-user key lists keep each query proportional to one user's data, not the bucket's
+        self._by_user = {}
+        for key in sorted(self.objects):
+            self._by_user.setdefault(self.objects[key]['user'], []).append(key)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+        with open(f'{self.index_path}.tmp', 'w') as f:
+            json.dump({'objects': self.objects, 'metadata': self.metadata}, f)
+        os.replace(f'{self.index_path}.tmp', self.index_path)
+
+    def refresh(self):
+        """
+        Lists DATA_ROOT once and replaces the index with the result.
+        Returns:
+            (added, changed, removed) lists of keys compared with the previous index.
+        """
+        objects = {}
+        for obj in self.storage.list_objects(DATA_ROOT):
+            if obj['Key'].endswith('/'):
+                continue
+            user_id, data_type, kind = parse_data_key(obj['Key'])
+            objects[obj['Key']] = {'size': obj['Size'], 'etag': obj['ETag'],
+                                   'user': user_id, 'data_type': data_type, 'kind': kind}
+
+        added = [key for key in objects if key not in self.objects]
+        changed = [key for key, entry in objects.items()
+                   if key in self.objects and self.objects[key]['etag'] != entry['etag']]
+        removed = [key for key in self.objects if key not in objects]
+
+        self.objects = objects
+        self.metadata = {key: cached for key, cached in self.metadata.items() if key in objects}
+        self._group_by_user()
+        self.save()
+        print(f"Inventory: {len(objects)} objects, {len(added)} added, {len(changed)} changed, {len(removed)} removed")
+        return added, changed, removed
+
+    def _candidate_keys(self, user_id):
+        if user_id is None:
+            return sorted(self.objects)
+        return self._by_user.get(user_id, [])
+
+    def listing(self, prefix):
+        """Entries under prefix in the form Storage.list_objects yields them."""
+        user_id = user_id_from_key(prefix) if '/' in prefix[len(DATA_ROOT):] else None
+        return [{'Key': key, 'Size': self.objects[key]['size'], 'ETag': self.objects[key]['etag']}
+                for key in self._candidate_keys(user_id) if key.startswith(prefix)]
+
+    def keys(self, user_id=None, data_type=None, kind=None):
+        return [key for key in self._candidate_keys(user_id)
+                if (data_type is None or self.objects[key]['data_type'] == data_type)
+                and (kind is None or self.objects[key]['kind'] == kind)]
+
+    def metadata_keys(self):
+        return self.keys(kind='metadata')
+
+    def image_keys(self, user_id, data_type):
+        return self.keys(user_id, data_type, 'images')
+
+    def get_metadata(self, key):
+        """
+        Returns the parsed metadata.json at key, fetching it only if its ETag
+        changed. Call save() afterwards to keep what was fetched.
+        """
+        entry = self.objects.get(key)
+        if entry is None:
+            return None
+        cached = self.metadata.get(key)
+        if cached is not None and cached['etag'] == entry['etag']:
+            return cached['content']
+
+        data = self.storage.get_bytes(key)
+        if data is None:
+            return None
+        content = json.loads(data.decode('utf-8'))
+        self.metadata[key] = {'etag': entry['etag'], 'content': content}
+        return content
@@ -0,0 +1,77 @@
+import functools
+import os
+import numpy as np
+from classes.landmarks import NUM_LANDMARKS
+from classes.processing_state import file_hash
+
+LANDMARK_CACHE_NAME = '.landmarks.npz'
+
+@functools.lru_cache(maxsize=None)
+def landmark_cache_version(face_detection_mode, predictor_path):
+    """Landmarks depend on how faces are located and on the predictor model."""
+    return f'{face_detection_mode}-{file_hash(predictor_path)}'
+
+def landmark_cache_path(user_dir):
+    return os.path.join(user_dir, LANDMARK_CACHE_NAME)
+
+class LandmarkCache:
+    """
+    Face box and 68 landmarks of every image of one user, kept in a compressed
+    NPZ next to the user's data and keyed by image key and content hash.
+    Frames without a face are cached too, so no stage runs detection on a
+    frame twice. Only the parent process writes it; pool workers are handed
+    the cached detections with their tasks.
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.entries = {}
+        self._dirty = False
+        if not os.path.exists(path):
+            return
+        with np.load(path, allow_pickle=False) as cache:
+            if str(cache['version']) != version:
+                print(f"Landmark cache {path} was built with other settings, ignoring it")
+                return
+            for key, content_hash, has_face, box, landmarks in zip(
+                    cache['keys'], cache['hashes'], cache['has_face'], cache['boxes'], cache['landmarks']):
+                self.entries[str(key)] = (str(content_hash), tuple(box.tolist()) if has_face else None,
+                                          landmarks if has_face else None)
+
+    def get(self, image_key, content_hash):
+        """
+        Returns (box, landmarks) if the image is cached with this hash, where
+        both are None for a frame without a face, or None on a miss.
+        """
+        entry = self.entries.get(image_key)
+        if entry is None or entry[0] != content_hash:
+            return None
+        return entry[1], entry[2]
+
+    def put(self, image_key, content_hash, box, landmarks):
+        """box is (left, top, right, bottom) and landmarks a (68, 2) array, or both None for no face."""
+        self.entries[image_key] = (content_hash, tuple(box) if box is not None else None,
+                                   np.asarray(landmarks, dtype=np.int32) if landmarks is not None else None)
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        keys = sorted(self.entries)
+        has_face = np.array([self.entries[key][1] is not None for key in keys], dtype=bool)
+        boxes = np.zeros((len(keys), 4), dtype=np.int32)
+        landmarks = np.zeros((len(keys), NUM_LANDMARKS, 2), dtype=np.int32)
+        for i, key in enumerate(keys):
+            _, box, points = self.entries[key]
+            if box is not None:
+                boxes[i] = box
+                landmarks[i] = points
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        # np.savez adds .npz to names without it, so write to a temporary .npz and rename
+        tmp_path = f'{self.path[:-len(".npz")]}.tmp.npz'
+        np.savez_compressed(tmp_path, version=np.array(self.version), keys=np.array(keys, dtype=str),
+                            hashes=np.array([self.entries[key][0] for key in keys], dtype=str),
+                            has_face=has_face, boxes=boxes, landmarks=landmarks)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
@@ -0,0 +1,13 @@
+import numpy as np
+
+NUM_LANDMARKS = 68
+
+def landmarks_to_array(landmarks):
+    """
+    Converts a dlib full_object_detection to a (68, 2) int array of (x, y)
+    points, reading each point through the binding exactly once. Arrays are
+    returned unchanged, so every consumer can accept either form.
+    """
+    if isinstance(landmarks, np.ndarray):
+        return landmarks
+    return np.array([(point.x, point.y) for point in landmarks.parts()], dtype=np.int32)
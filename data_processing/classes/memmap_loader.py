@@ -0,0 +1,128 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from classes.quantization import dequantize
+
+class MemmapBatchLoader:
+    """
+    Batches from memmapped samples and labels, assembled ahead of time in
+    background threads.
+
+    Shuffle modes:
+        'none': batches in index order.
+        'global': every epoch is a full permutation, as memmap_batch_generator
+            does. Each batch is scattered over the whole file.
+        'block': the indices are cut into runs of block_size neighbouring
+            samples and the runs are shuffled. The result is read buffer_size
+            samples at a time, each buffer sorted, so reads are near-sequential.
+            Samples are then shuffled within each buffer.
+
+    x and y are arrays (e.g. np.memmap, or .npy opened with mmap_mode='r'),
+    or lists of per-shard arrays. The (x, y) pairs memmap_writer.open_shards
+    returns can be passed as x on their own, with y left out.
+    prefetch is the number of batches kept assembled ahead of the consumer;
+    in block mode a whole buffer is read at once, so one buffer is always
+    read ahead. Iterating runs forever, like the Keras generators it replaces, unless
+    epochs is given. Batches are yielded as (transform(x_batch), y_batch).
+    """
+
+    SHUFFLE_MODES = ('none', 'global', 'block')
+
+    def __init__(self, x, y=None, batch_size=32, indices=None, shuffle='block', block_size=64, buffer_size=1024,
+                 prefetch=4, workers=2, transform=dequantize, epochs=None, seed=None):
+        if shuffle not in self.SHUFFLE_MODES:
+            raise ValueError(f"Unknown shuffle mode: {shuffle}")
+        if y is None:
+            # Shards as open_shards returns them
+            x, y = [shard[0] for shard in x], [shard[1] for shard in x]
+        self.x = x if isinstance(x, (list, tuple)) else [x]
+        self.y = y if isinstance(y, (list, tuple)) else [y]
+        self.offsets = np.cumsum([0] + [len(shard) for shard in self.x])
+        self.indices = np.sort(np.asarray(indices)) if indices is not None else np.arange(self.offsets[-1])
+        if not len(self.indices):
+            # Nothing to read would make an endless loader spin without yielding
+            raise ValueError("MemmapBatchLoader needs at least one sample")
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.block_size = block_size
+        # Whole batches per buffer, so no batch spans two reads
+        self.buffer_size = max(batch_size, buffer_size // batch_size * batch_size)
+        self.prefetch = prefetch
+        self.workers = workers
+        self.transform = transform
+        self.epochs = epochs
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        """Batches per epoch."""
+        return -(-len(self.indices) // self.batch_size)
+
+    def __iter__(self):
+        with ThreadPoolExecutor(self.workers) as executor:
+            pending = collections.deque()
+            reads = self._reads()
+            ahead = 0
+
+            def fill():
+                # Keep prefetch batches assembled or in progress, and always the next read
+                nonlocal ahead
+                while not pending or ahead < self.prefetch:
+                    read = next(reads, None)
+                    if read is None:
+                        return
+                    batches = -(-len(read[0]) // self.batch_size)
+                    pending.append((executor.submit(self._assemble, *read), batches))
+                    ahead += batches
+
+            fill()
+            while pending:
+                # Taken in order, so a run is reproducible with a seed
+                future, batches = pending.popleft()
+                ahead -= batches
+                fill()
+                yield from future.result()
+
+    def _reads(self):
+        """Yields (sorted indices to read, order to emit them in) for each read, epoch after epoch."""
+        epoch = 0
+        while self.epochs is None or epoch < self.epochs:
+            epoch += 1
+            if self.shuffle == 'block':
+                blocks = [self.indices[start:start + self.block_size] for start in range(0, len(self.indices), self.block_size)]
+                order = np.concatenate([blocks[i] for i in self.rng.permutation(len(blocks))]) if blocks else self.indices
+                for start in range(0, len(order), self.buffer_size):
+                    buffer = np.sort(order[start:start + self.buffer_size])
+                    yield buffer, self.rng.permutation(len(buffer))
+            else:
+                order = self.rng.permutation(self.indices) if self.shuffle == 'global' else self.indices
+                for start in range(0, len(order), self.batch_size):
+                    batch = np.sort(order[start:start + self.batch_size])
+                    yield batch, np.arange(len(batch))
+
+    def _assemble(self, indices, order):
+        """Runs in a worker thread: reads the samples and cuts them into batches."""
+        x = self._read(self.x, indices)
+        y = self._read(self.y, indices)
+        batches = []
+        for start in range(0, len(indices), self.batch_size):
+            # Gathered straight into each batch, so a shuffled buffer is never copied whole
+            batch_order = order[start:start + self.batch_size]
+            x_batch = x[batch_order]
+            batches.append((self.transform(x_batch) if self.transform is not None else x_batch, y[batch_order]))
+        return batches
+
+    def _read(self, shards, indices):
+        """Reads sorted global indices, one slice per run of consecutive samples within a shard."""
+        parts = []
+        shard_ids = np.searchsorted(self.offsets, indices, side='right') - 1
+        # A new run starts where the index jumps or the shard changes
+        breaks = np.flatnonzero((np.diff(indices) != 1) | (np.diff(shard_ids) != 0)) + 1
+        for run in np.split(np.arange(len(indices)), breaks):
+            if not len(run):
+                continue
+            shard_id = shard_ids[run[0]]
+            start = indices[run[0]] - self.offsets[shard_id]
+            parts.append(shards[shard_id][start:start + len(run)])
+        if not parts:
+            return np.empty((0,) + shards[0].shape[1:], dtype=shards[0].dtype)
+        return np.concatenate(parts)
@@ -0,0 +1,161 @@
+import json
+import os
+import numpy as np
+
+INDEX_NAME = 'index.json'
+
+class MemmapWriter:
+    """
+    Streams samples into fixed-size .npy shards opened with open_memmap, so a
+    dataset of any size is built without holding more than one batch in
+    memory. Shard i holds x_{i:05d}.npy (samples) and y_{i:05d}.npy (labels)
+    plus keys_{i:05d}.json, the key of every sample, used to resume.
+    metadata is a JSON-serialisable dict stored in the index, e.g. for the
+    normalisation the labels were written with; replace_labels can record
+    such settings per shard as well.
+
+    index.json records how many samples of each shard are complete. It is only
+    rewritten after the shards are flushed, so after a crash it never counts
+    samples that did not reach the disk; anything past the count is overwritten
+    when the build resumes.
+    """
+
+    def __init__(self, out_dir, x_shape, y_width, x_dtype=np.float32, y_dtype=np.float32, shard_size=4096):
+        self.out_dir = out_dir
+        self.x_shape = tuple(x_shape)
+        self.y_width = y_width
+        self.x_dtype = np.dtype(x_dtype)
+        self.y_dtype = np.dtype(y_dtype)
+        self.shard_size = shard_size
+        self.shards = []
+        self.metadata = {}
+        self.keys = set()
+        self._x = self._y = None
+        self._shard_keys = []
+        os.makedirs(out_dir, exist_ok=True)
+
+        index_path = os.path.join(out_dir, INDEX_NAME)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path) as f:
+            index = json.load(f)
+        settings = (list(self.x_shape), self.y_width, self.x_dtype.str, self.y_dtype.str, self.shard_size)
+        stored = (index['x_shape'], index['y_width'], index['x_dtype'], index['y_dtype'], index['shard_size'])
+        if stored != settings:
+            if stored[2] == np.dtype(np.float32).str and self.x_dtype == np.uint8 and stored[:2] + stored[3:] == settings[:2] + settings[3:]:
+                raise ValueError(f"{out_dir} holds float32 crops; convert it with `python quantize_memmap_main.py {out_dir}`")
+            raise ValueError(f"{out_dir} holds a dataset with other shapes or dtypes; use another directory")
+        self.shards = index['shards']
+        self.metadata = index.get('metadata', {})
+        for shard in self.shards:
+            with open(os.path.join(out_dir, shard['keys'])) as f:
+                self.keys.update(json.load(f)[:shard['count']])
+        print(f"Resuming {out_dir} with {len(self)} samples")
+
+    def __len__(self):
+        return sum(shard['count'] for shard in self.shards)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def append(self, key, x, y):
+        """Adds one sample; samples whose key is already stored are ignored."""
+        if key in self.keys:
+            return
+        if self._x is None or self.shards[-1]['count'] == self.shard_size:
+            self._open_shard()
+        shard = self.shards[-1]
+        self._x[shard['count']] = x
+        self._y[shard['count']] = y
+        self._shard_keys.append(key)
+        shard['count'] += 1
+        self.keys.add(key)
+        if shard['count'] == self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Makes every sample appended so far durable and part of the index."""
+        if self._x is not None:
+            self._x.flush()
+            self._y.flush()
+            self._write_json(self.shards[-1]['keys'], self._shard_keys)
+        self._write_json(INDEX_NAME, {
+            'x_shape': list(self.x_shape), 'y_width': self.y_width,
+            'x_dtype': self.x_dtype.str, 'y_dtype': self.y_dtype.str,
+            'shard_size': self.shard_size, 'shards': self.shards, 'metadata': self.metadata,
+        })
+
+    def replace_labels(self, number, labels, **shard_metadata):
+        """
+        Swaps in new labels for shard number, e.g. renormalised ones. They are
+        written to a new file, and a single index write switches the shard to
+        it together with shard_metadata (stored on the shard), so after a crash
+        the shard is wholly old or wholly new.
+        """
+        shard = self.shards[number]
+        generation = shard.get('y_generation', 0) + 1
+        name = f'y_{number:05d}.{generation}.npy'
+        y = np.lib.format.open_memmap(os.path.join(self.out_dir, name), mode='w+', dtype=self.y_dtype,
+                                      shape=(self.shard_size, self.y_width))
+        y[:shard['count']] = labels
+        y.flush()
+        old_path = os.path.join(self.out_dir, shard['y'])
+        if self._y is not None and number == len(self.shards) - 1:
+            # Keep appending to the shard being filled through its new file
+            self._y = y
+        del y
+        shard.update(shard_metadata, y=name, y_generation=generation)
+        self.flush()
+        os.remove(old_path)
+
+    def read_labels(self, number):
+        """The stored labels of shard number."""
+        shard = self.shards[number]
+        return np.load(os.path.join(self.out_dir, shard['y']), mmap_mode='r')[:shard['count']]
+
+    def close(self):
+        self.flush()
+        self._x = self._y = None
+
+    def _open_shard(self):
+        self.flush()
+        if self.shards and self.shards[-1]['count'] < self.shard_size:
+            # The last shard of an interrupted build still has room
+            shard = self.shards[-1]
+            mode = 'r+'
+            with open(os.path.join(self.out_dir, shard['keys'])) as f:
+                self._shard_keys = json.load(f)[:shard['count']]
+        else:
+            number = len(self.shards)
+            shard = {'x': f'x_{number:05d}.npy', 'y': f'y_{number:05d}.npy', 'keys': f'keys_{number:05d}.json', 'count': 0}
+            mode = 'w+'
+            self.shards.append(shard)
+            self._shard_keys = []
+        self._x = np.lib.format.open_memmap(os.path.join(self.out_dir, shard['x']), mode=mode, dtype=self.x_dtype,
+                                            shape=(self.shard_size,) + self.x_shape)
+        self._y = np.lib.format.open_memmap(os.path.join(self.out_dir, shard['y']), mode=mode, dtype=self.y_dtype,
+                                            shape=(self.shard_size, self.y_width))
+
+    def _write_json(self, name, data):
+        path = os.path.join(self.out_dir, name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def open_shards(out_dir):
+    """
+    Opens a dataset written by MemmapWriter read-only.
+    Returns:
+        A list of (x, y) memmaps per shard, cut to the samples the index counts.
+    """
+    with open(os.path.join(out_dir, INDEX_NAME)) as f:
+        index = json.load(f)
+    return [(np.load(os.path.join(out_dir, shard['x']), mmap_mode='r')[:shard['count']],
+             np.load(os.path.join(out_dir, shard['y']), mmap_mode='r')[:shard['count']])
+            for shard in index['shards'] if shard['count']]
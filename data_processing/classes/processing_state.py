@@ -0,0 +1,140 @@
+import hashlib
+import json
+import math
+import os
+from classes.data_handelr import MANIFEST_NAME
+
+def file_hash(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+def content_hashes(local_base_dir, image_keys):
+    """
+    Content hash of each synced image: the ETag recorded by DataHandler's sync
+    manifest, or a sha1 of the local file for images synced some other way.
+    Images missing locally are left out.
+    """
+    try:
+        with open(os.path.join(local_base_dir, MANIFEST_NAME), 'r') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {}
+
+    hashes = {}
+    for key in image_keys:
+        local_path = os.path.join(local_base_dir, key)
+        if not os.path.exists(local_path):
+            continue
+        entry = manifest.get(key)
+        hashes[key] = entry['etag'] if entry is not None else file_hash(local_path)
+    return hashes
+
+class ProcessingState:
+    """
+    What has already been extracted from each image of one data CSV, keyed by
+    image key and content hash. It stores the output row too (None when no
+    eyes were found), so a run only processes new or changed images and
+    writes everything else back unchanged. Any change to the version string
+    (code, model or camera) discards the whole state.
+    Results are also appended to a journal as they arrive, so the rows of a
+    run that crashed are picked up by the next one. outputs records what was
+    last written from the state, so an unchanged run can skip rewriting it.
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.journal_path = f'{path}.journal'
+        self.version = version
+        self.images = {}
+        self.outputs = {}
+        self._journal = None
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+            if state['version'] == version:
+                self.images = state['images']
+                self.outputs = state.get('outputs', {})
+            else:
+                print(f"Processing version changed, rebuilding {path}")
+        except FileNotFoundError:
+            pass
+        self._replay_journal()
+
+    def _replay_journal(self):
+        try:
+            with open(self.journal_path, 'r') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        recovered = 0
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line of a crashed run may be cut short
+                continue
+            if entry['version'] == self.version:
+                self.record(entry['image'], entry['hash'], entry['row'])
+                recovered += 1
+        print(f"Recovered {recovered} results from an interrupted run")
+
+    def append(self, image_key, content_hash, row):
+        """Records a result and writes it to the journal straight away."""
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a')
+        self._journal.write(json.dumps({'version': self.version, 'image': image_key, 'hash': content_hash, 'row': row}) + '\n')
+        self._journal.flush()
+        self.record(image_key, content_hash, row)
+
+    def is_current(self, image_key, content_hash):
+        entry = self.images.get(image_key)
+        return entry is not None and entry['hash'] == content_hash
+
+    def record(self, image_key, content_hash, row):
+        self.images[image_key] = {'hash': content_hash, 'row': row}
+
+    def row(self, image_key):
+        entry = self.images.get(image_key)
+        return entry['row'] if entry is not None else None
+
+    def rows(self, image_keys):
+        """Yields the stored rows of image_keys in order, skipping images without one."""
+        for image_key in image_keys:
+            row = self.row(image_key)
+            if row is not None:
+                yield row
+
+    def set_labels(self, image_key, labels):
+        """
+        Updates the cursor or calibration point of a processed row, which needs no reprocessing.
+        Returns True if the row changed.
+        """
+        row = self.row(image_key)
+        if row is None:
+            return False
+        current = row[1:1 + len(labels)]
+        if len(current) == len(labels) and all(_same_label(a, b) for a, b in zip(current, labels)):
+            return False
+        row[1:1 + len(labels)] = labels
+        return True
+
+    def save(self):
+        """Writes the state and drops the journal it now contains."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump({'version': self.version, 'images': self.images, 'outputs': self.outputs}, f)
+        os.replace(f'{self.path}.tmp', self.path)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+def _same_label(a, b):
+    # NaN marks a missing label, and a missing label has not changed
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b
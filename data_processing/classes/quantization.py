@@ -0,0 +1,70 @@
+import json
+import os
+import numpy as np
+from classes.memmap_writer import INDEX_NAME
+
+# Crops are stored as the uint8 pixels they were cropped from; the model sees them scaled to [0, 1]
+SCALE = 255.0
+
+def quantize(images):
+    """Converts images in [0, 1], as get_combined_eyes returns them, back to uint8 pixels."""
+    return np.rint(np.clip(np.asarray(images, dtype=np.float32), 0.0, 1.0) * SCALE).astype(np.uint8)
+
+def dequantize(batch):
+    """Scales a batch of uint8 crops to float32 in [0, 1], exactly as get_combined_eyes does."""
+    # One pass, casting inside the division; the result is the same as astype(float32) / 255
+    return np.divide(batch, np.float32(SCALE), dtype=np.float32)
+
+def quantize_memmap(src_path, dst_path, sample_shape, num_samples=None, chunk_size=1024):
+    """
+    One-shot conversion of a raw float32 memmap of crops in [0, 1] into a raw
+    uint8 memmap of the same layout, a quarter of the size. Converted in
+    chunks, so memory use stays at chunk_size samples.
+    Args:
+        num_samples: Samples in the source; derived from its size if omitted.
+    Returns:
+        The number of samples converted.
+    """
+    sample_shape = tuple(sample_shape)
+    src = np.memmap(src_path, dtype=np.float32, mode='r')
+    sample_size = int(np.prod(sample_shape))
+    if num_samples is None:
+        num_samples = src.size // sample_size
+    src = src[:num_samples * sample_size].reshape((num_samples,) + sample_shape)
+    dst = np.memmap(dst_path, dtype=np.uint8, mode='w+', shape=(num_samples,) + sample_shape)
+    for start in range(0, num_samples, chunk_size):
+        dst[start:start + chunk_size] = quantize(src[start:start + chunk_size])
+    dst.flush()
+    return num_samples
+
+def quantize_shards(out_dir, chunk_size=1024):
+    """
+    Converts the float32 samples of a MemmapWriter dataset to uint8 in place,
+    shard by shard, and records the new x_dtype in its index. Each shard is
+    written aside and renamed over the old one, and shards already in uint8
+    are skipped, so an interrupted conversion is finished by running it again.
+    Returns:
+        The number of shards converted.
+    """
+    index_path = os.path.join(out_dir, INDEX_NAME)
+    with open(index_path) as f:
+        index = json.load(f)
+    converted = 0
+    for shard in index['shards']:
+        path = os.path.join(out_dir, shard['x'])
+        src = np.load(path, mmap_mode='r')
+        if src.dtype == np.uint8:
+            continue
+        tmp_path = f'{path[:-len(".npy")]}.tmp.npy'
+        dst = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=src.shape)
+        for start in range(0, len(src), chunk_size):
+            dst[start:start + chunk_size] = quantize(src[start:start + chunk_size])
+        dst.flush()
+        del src, dst
+        os.replace(tmp_path, path)
+        converted += 1
+    index['x_dtype'] = np.dtype(np.uint8).str
+    with open(f'{index_path}.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(f'{index_path}.tmp', index_path)
+    return converted
@@ -2,46 +2,66 @@ import sys
 from pathlib import Path
 parent_dir = Path.cwd().parent.parent
 sys.path.append(str(parent_dir))
+sys.path.append(str(Path(__file__).resolve().parents[1] / 'backend'))
 
+import argparse
 import os
 import cv2
 import numpy as np
 import json
+from classes.csv_manager import CSVManager
+from classes.face_locator import FaceLocator
+from classes.head_pose_stats import HeadPoseStats, head_pose_stats_path, rescale_head_pose, update_custom_stats
 from classes.image_processing import ImageProcessor
+from classes.landmark_cache import LandmarkCache, landmark_cache_path, landmark_cache_version
+from classes.processing_state import content_hashes
 from multiprocessing import Pool
-import pandas as pd
 import dlib
 import glob
-import pickle
+from classes.memmap_writer import MemmapWriter
+from storage import eye_crop_keys
+
+SHAPE_PREDICTOR_PATH = 'shape_predictor_68_face_landmarks.dat'
+# FACE_DETECTION_MODE=downscaled or tracking trades a little landmark accuracy for speed
+FACE_DETECTION_MODE = os.environ.get('FACE_DETECTION_MODE', 'full')
+# Shards of eye crops and labels, read with classes.memmap_writer.open_shards
+DATASET_DIR = os.environ.get('DATASET_DIR', './calib_head_pose_dataset')
+# Rows in flight at once; memory use is bounded by this many crops
+WINDOW_SIZE = int(os.environ.get('CROP_WINDOW_SIZE', 512))
+# Rows per pool task
+CHUNK_SIZE = int(os.environ.get('CROP_CHUNK_SIZE', 32))
+# Data CSVs used within each user directory
+CSV_PATTERN = '*calibration*.csv'
+X_SHAPE = (100, 200, 3)
+# Crops are stored as uint8 pixels, a quarter of float32; loaders scale batches with classes.quantization.dequantize
+X_DTYPE = np.uint8
+# Cursor x and y, then the 6 normalised head pose values
+Y_WIDTH = 8
 
 # Global initialization
-global_detector = dlib.get_frontal_face_detector()
-global_predictor = dlib.shape_predictor('shape_predictor_68_face_landmarks.dat')
+global_detector = FaceLocator(dlib.get_frontal_face_detector(), FACE_DETECTION_MODE)
+global_predictor = dlib.shape_predictor(SHAPE_PREDICTOR_PATH)
 global_sr_model = cv2.dnn_superres.DnnSuperResImpl_create()
 ImageProcessor = ImageProcessor(global_detector, global_predictor)
 
 def main():
-    local_base_dir = './data'
-    X, Y = process_images_parallel(local_base_dir)
-
-    print(f"Processed {len(X)} items.")
+    parser = argparse.ArgumentParser(description="Crop the eyes of every processed row into the training dataset.")
+    parser.add_argument('--csv-pattern', default=CSV_PATTERN, help="Glob of the data CSVs to use within each user directory.")
+    parser.add_argument('--users', nargs='*', help="Only these user directories; all users when omitted.")
+    args = parser.parse_args()
 
-    # Save the processed data
-    with open('./calib_head_pose.pkl', 'wb') as f:
-        pickle.dump((X,Y), f)
+    local_base_dir = './data'
+    # Reopening the directory resumes an interrupted build
+    with MemmapWriter(DATASET_DIR, X_SHAPE, Y_WIDTH, x_dtype=X_DTYPE) as writer:
+        process_images_parallel(local_base_dir, writer, args.csv_pattern, args.users)
+        print(f"Processed {len(writer)} items.")
 
 def compute_global_stats(base_dir):
-    all_head_pose_data = []
-    for csv_file in glob.glob(os.path.join(base_dir, '**', '*.csv'), recursive=True):
-        data = pd.read_csv(csv_file, usecols=[15, 16])
-        for _, row in data.iterrows():
-            head_pose_data = [float(x) for x in row.iloc[0].strip('"').split(',')]
-            head_translation_data = [float(x) for x in row.iloc[1].strip('"').split(',')]
-            all_head_pose_data.append(head_pose_data + head_translation_data)
-    all_head_pose_data = np.array(all_head_pose_data)
-    min_vals = np.min(all_head_pose_data, axis=0)
-    max_vals = np.max(all_head_pose_data, axis=0)
-    return  min_vals, max_vals
+    # Kept with the dataset and shared with the MPIIGaze pipeline; only new or changed CSVs are read
+    stats = HeadPoseStats(head_pose_stats_path(DATASET_DIR))
+    update_custom_stats(stats, base_dir, CSVManager(base_dir))
+    stats.save()
+    return stats.min_vals, stats.max_vals
 
 def get_screen_size(metadata_file_path):
     with open(metadata_file_path, 'r') as f:
@@ -60,84 +80,109 @@ def get_screen_size(metadata_file_path):
 
         return screen_width, screen_height
 
-def process_row(data, metadata_file_path, local_base_dir, min_vals, max_vals):
-    screen_width, screen_height = get_screen_size(metadata_file_path)
-    data = data[0]
-    data = data[0]
-    image_path = data[0]
-    cursor_x = data[1]
-    cursor_y = data[2]
-    eye_box_pupil_data = data[3:15]
-    head_pose = data[15]
-    head_translation = data[16]
-    # Unpack the row data
-    # image_path, cursor_x, cursor_y, *eye_box_pupil_data, head_pose, head_translation = data
-    eye_gaze_image_path = os.path.join(image_path)
-    calibration_image_path = os.path.join(image_path)
-
-    if os.path.exists(eye_gaze_image_path):
-        full_image_path = eye_gaze_image_path
-    elif os.path.exists(calibration_image_path):
-        full_image_path = calibration_image_path
-    else:
-        print(f"Image not found: {image_path}")
-        return None 
-    
-    full_image_path = os.path.join(image_path)
-    image = cv2.imread(full_image_path)
-    if image is None:
-        print(f"Image not found: {full_image_path}")
+def load_stored_eye_crop(image_path):
+    """
+    Returns the uint8 eye crop stored at ingest time (EYE_EXTRACTION=1) as
+    extract_combined_eyes would, False if ingest found no face, or None if
+    nothing was stored and the frame needs the full detection pass.
+    """
+    crop_path, landmarks_path = eye_crop_keys(image_path)
+    if not os.path.exists(landmarks_path):
         return None
-    
-    combined_eyes = ImageProcessor.get_combined_eyes(image, global_detector, global_predictor)
-    if combined_eyes is None:
+    with open(landmarks_path, 'r') as f:
+        if not json.load(f).get('face'):
+            return False
+    return cv2.imread(crop_path)
+
+def crop_row(image_path, cached_detection=None):
+    """Returns the row's combined eye crop in uint8, or None if there is no usable face."""
+    combined_eyes = load_stored_eye_crop(image_path)
+    if combined_eyes is False:
         return None
-    
-    # Normalize eye box pupil data
-    # normalized_eye_box_pupil_data = [float(coord) / screen_width if i % 2 == 0 else float(coord) / screen_height for i, coord in enumerate(eye_box_pupil_data)]
-
-    head_pose_data = [float(x) for x in head_pose.strip('"').split(',')]
-    head_translation_data = [float(x) for x in head_translation.strip('"').split(',')]
-    
-    head_pose_data = np.array(head_pose_data + head_translation_data)
-    normalized_head_pose_data = (head_pose_data - min_vals) / (max_vals - min_vals)
-    
-    # Normalize cursor positions
-    normalized_cursor_x = float(cursor_x) / screen_width
-    normalized_cursor_y = float(cursor_y) / screen_height
-    
-    # Prepare X and Y
-    # X: Combined eyes image
-    # Y: Cursor position, eye box pupil data, head pose data
-    X = combined_eyes
-    Y = [normalized_cursor_x, normalized_cursor_y, full_image_path] +  normalized_head_pose_data.tolist()
-    return X, Y
-
-def process_images_parallel(base_dir):
-    subdirs = glob.glob(os.path.join(base_dir, '*/'))
+    if combined_eyes is not None:
+        return combined_eyes
+
+    cached_landmarks = None
+    if cached_detection is not None:
+        cached_box, cached_landmarks = cached_detection
+        if cached_box is None:
+            # image_processing_main already found no face here
+            return None
+
+    image = cv2.imread(image_path)
+    if image is None:
+        print(f"Image not found: {image_path}")
+        return None
+    extracted = ImageProcessor.extract_combined_eyes(image, global_detector, global_predictor, landmarks=cached_landmarks)
+    return extracted[0] if extracted is not None else None
+
+def process_chunk(chunk):
+    """
+    Crops a chunk of one CSV's rows in a pool worker.
+    Args:
+        chunk: List of (image_path, cached_detection) pairs.
+    Returns:
+        The crops in the same order, None for rows without one.
+    """
+    return [crop_row(image_path, cached_detection) for image_path, cached_detection in chunk]
+
+def normalize_labels(columns, screen_size, min_vals, max_vals):
+    """Vectorized Y for a whole CSV: cursor position over the screen size, then the normalised head pose."""
+    cursor = columns['label'] / np.asarray(screen_size, dtype=np.float64)
+    head_pose = np.hstack([columns['rotation'], columns['translation']])
+    return np.hstack([cursor, (head_pose - min_vals) / (max_vals - min_vals)]).astype(np.float32)
+
+def select_csv_files(subdir, csv_pattern, users):
+    """The subdir's data CSVs matching csv_pattern, or none if users is given and the subdir is not among them."""
+    if users and os.path.basename(os.path.normpath(subdir)) not in users:
+        return []
+    return sorted(glob.glob(os.path.join(subdir, csv_pattern)))
+
+def process_images_parallel(base_dir, writer, csv_pattern=CSV_PATTERN, users=None):
+    """
+    Crops every row not yet in writer and streams the results into it, at
+    most WINDOW_SIZE rows at a time. Workers get chunks of CHUNK_SIZE image
+    paths; screen size and labels are resolved once per CSV in this process.
+    Args:
+        csv_pattern: Glob of the data CSVs to use within each user directory.
+        users: User directory names to include, or None for all.
+    """
+    subdirs = sorted(glob.glob(os.path.join(base_dir, '*/')))
     min_vals, max_vals = compute_global_stats(base_dir)
-    
+    rescale_head_pose(writer, min_vals, max_vals)
+    csv_manager = CSVManager(base_dir)
+
     with Pool() as pool:
-        results = []
         for subdir in subdirs:
+            csv_files = select_csv_files(subdir, csv_pattern, users)
+            if not csv_files:
+                continue
             print(f"Processing images in {subdir}")
-            metadata_file_path = os.path.join(subdir, 'metadata.json')
-            csv_files = glob.glob(os.path.join(subdir, '*.csv'))  # Correctly use glob.glob() here as well
+            screen_size = get_screen_size(os.path.join(subdir, 'metadata.json'))
+            # Landmarks found by image_processing_main; image paths are relative to the working directory
+            landmark_cache = LandmarkCache(landmark_cache_path(subdir),
+                                           landmark_cache_version(FACE_DETECTION_MODE, SHAPE_PREDICTOR_PATH))
 
-            csv_files = [csv_file for csv_file in csv_files if 'calibration' in csv_file and 'eloise' in csv_file]
-            
             for csv_file in csv_files:
                 print(f"Processing file: {csv_file}")
-                dataset = pd.read_csv(csv_file, header=None)
-                data_rows = [([row.values], metadata_file_path, base_dir, min_vals, max_vals) for index, row in dataset.iterrows()]
-                                
-                processed_data = pool.starmap(process_row, [(row, metadata_file_path, base_dir, min_vals, max_vals) for row in data_rows])
-                results.extend(processed_data)
-
-    X = [result[0] for result in results if result is not None]
-    Y = [result[1] for result in results if result is not None]
-
-    return X, Y
+                columns = csv_manager.load_columns(csv_file)
+                if columns is None:
+                    continue
+                # Rows stored by an earlier, interrupted build are skipped
+                pending = np.array([image_path not in writer for image_path in columns['image_path'].tolist()], dtype=bool)
+                image_paths = columns['image_path'][pending].tolist()
+                labels = normalize_labels(columns, screen_size, min_vals, max_vals)[pending]
+                hashes = content_hashes('.', image_paths)
+                rows = [(image_path, landmark_cache.get(image_path, hashes.get(image_path))) for image_path in image_paths]
+
+                for start in range(0, len(rows), WINDOW_SIZE):
+                    window = rows[start:start + WINDOW_SIZE]
+                    chunks = [window[i:i + CHUNK_SIZE] for i in range(0, len(window), CHUNK_SIZE)]
+                    crops = [crop for chunk_crops in pool.map(process_chunk, chunks) for crop in chunk_crops]
+                    for (image_path, _), crop, y in zip(window, crops, labels[start:start + WINDOW_SIZE]):
+                        if crop is not None:
+                            writer.append(image_path, crop, y)
+                    writer.flush()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
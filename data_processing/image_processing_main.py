@@ -3,114 +3,289 @@ from pathlib import Path
 parent_dir = Path.cwd().parent.parent
 sys.path.append(str(parent_dir))
 
+import argparse
+import functools
+import hashlib
+import json
 import os
 import cv2
 import numpy as np
 from classes.data_handelr import DataHandler
+from classes.face_locator import FaceLocator
+from classes.head_pose import HeadPoseEstimator
+from classes.landmark_cache import LandmarkCache, landmark_cache_path, landmark_cache_version
+from classes.pupil_detector import PupilDetector
+from classes.processing_state import ProcessingState, content_hashes, file_hash
+from storage import storage_from_env
 from classes.image_processing import ImageProcessor
 from classes.csv_manager import CSVManager
 from multiprocessing import Pool
-import pandas as pd
 import dlib
 
 
-# Global initialization
-global_detector = dlib.get_frontal_face_detector()
-global_predictor = dlib.shape_predictor('shape_predictor_68_face_landmarks.dat')
-global_sr_model = cv2.dnn_superres.DnnSuperResImpl_create()
+# Bump whenever a change here or in ImageProcessor alters the rows, so every image is reprocessed.
+# 3: failures are no longer stored as "no face" results, so states from before are discarded.
+# 4: pupil centres are stored at sub-pixel precision instead of truncated.
+PROCESSING_VERSION = 4
+SHAPE_PREDICTOR_PATH = 'shape_predictor_68_face_landmarks.dat'
+# 'full', 'downscaled' or 'tracking'; see FaceLocator
+FACE_DETECTION_MODE = os.environ.get('FACE_DETECTION_MODE', 'full')
+# 'threshold', 'projection', 'contour' or 'super_resolution'; see PupilDetector
+PUPIL_STRATEGY = os.environ.get('PUPIL_STRATEGY', 'contour')
+
+PROCESSING_WORKERS = int(os.environ.get('PROCESSING_WORKERS', os.cpu_count() or 1))
+# Consecutive captures of one user handed to a worker as one ordered task. The face tracker starts
+# afresh at each, so results do not depend on how segments are scheduled; larger segments cut IPC
+# and cold starts, smaller ones balance better
+PROCESSING_SEGMENT_SIZE = int(os.environ.get('PROCESSING_SEGMENT_SIZE', 256))
+
+# Set once per worker process by init_worker
+worker_image_processor = None
+worker_csv_manager = None
+worker_pool = None
+# One warm-started estimator per camera, reset at the start of every segment
+worker_head_pose_estimators = {}
+
+def init_worker(predictor_path, csv_manager):
+    global worker_image_processor, worker_csv_manager
+    face_locator = FaceLocator(dlib.get_frontal_face_detector(), FACE_DETECTION_MODE)
+    worker_image_processor = ImageProcessor(face_locator, dlib.shape_predictor(predictor_path), PupilDetector(PUPIL_STRATEGY))
+    worker_csv_manager = csv_manager
+
+def get_worker_pool(csv_manager):
+    """One pool for the whole run, so the models are loaded once per worker rather than per user."""
+    global worker_pool
+    if worker_pool is None:
+        worker_pool = Pool(PROCESSING_WORKERS, initializer=init_worker, initargs=(SHAPE_PREDICTOR_PATH, csv_manager))
+    return worker_pool
+
+def close_worker_pool():
+    global worker_pool
+    if worker_pool is not None:
+        worker_pool.close()
+        worker_pool.join()
+        worker_pool = None
+
+@functools.lru_cache(maxsize=None)
+def model_hash():
+    return file_hash(SHAPE_PREDICTOR_PATH)
 
 def main():
+    parser = argparse.ArgumentParser(description="Extract eye and head pose features from the captured frames.")
+    parser.add_argument('--full-rebuild', action='store_true', help="Reprocess every image, ignoring what was processed before.")
+    parser.add_argument('--no-csv', action='store_true', help="Only write the typed columns, not the processed CSV export.")
+    args = parser.parse_args()
+
     bucket_name = 'eye-gaze-data'
     local_base_dir = './'
-    data_handler = DataHandler(bucket_name, local_base_dir)
+    # STORAGE_BACKEND=local reads a LocalStorage tree instead of the bucket
+    storage = storage_from_env() if os.environ.get('STORAGE_BACKEND') else None
+    data_handler = DataHandler(bucket_name, local_base_dir, storage,
+                               download_concurrency=int(os.environ.get('SYNC_CONCURRENCY', 16)))
     csv_manager = CSVManager(local_base_dir)
 
-    data_handler.process_s3_bucket_data(bucket_name, local_base_dir, process_images, csv_manager)
-
-def process_single_image(image_path, existing_data, local_base_dir, subdirectory, csv_file_name, camera_info, csv_manager):
-    image_processor = ImageProcessor(global_detector, global_predictor)
-
     try:
-        # Construct the full path to the image
-        full_image_path = os.path.join(local_base_dir, image_path)
-        image = cv2.imread(full_image_path)
+        data_handler.process_s3_bucket_data(bucket_name, local_base_dir,
+                                            functools.partial(process_images, full_rebuild=args.full_rebuild,
+                                                              write_csv=not args.no_csv), csv_manager)
+    finally:
+        close_worker_pool()
 
-        # Process the image
-        processed_data = image_processor.pre_process_image(image)
-        if processed_data is None:
-            return None
-        processed_data, left_eye_info, right_eye_info, left_eye_bbox, right_eye_bbox, shape = processed_data
-
-        # Get head pose data
-        camera_matrix, dist_coeffs = camera_info
-        head_pose = image_processor.get_head_pose(shape, camera_matrix, dist_coeffs)
-
-        # Determine cursor or calibration data based on the file path
-        if existing_data is not None:
-            cursor_or_calibration = existing_data  # Use existing data for this image
-        else:
-            print(f"Skipping image {image_path} because no cursor or calibration data was found")
-            cursor_or_calibration = [np.nan, np.nan]  # Replace with your actual data source
-
-        # Format the data row for CSV, including the existing data
-        if left_eye_bbox is None or right_eye_bbox is None:
-            print(f"Skipping image {image_path} because no eyes were detected")
-            return None
-        if right_eye_info is None and left_eye_info is None:
-            print(f"Skipping image {image_path} because no eyes were detected")
-            return None
+def get_head_pose_estimator(camera_info):
+    camera_matrix, dist_coeffs = camera_info
+    key = (np.asarray(camera_matrix, dtype=np.float64).tobytes(), np.asarray(dist_coeffs, dtype=np.float64).tobytes())
+    if key not in worker_head_pose_estimators:
+        worker_head_pose_estimators[key] = HeadPoseEstimator(camera_matrix, dist_coeffs)
+    return worker_head_pose_estimators[key]
 
-        if 'calibration' in image_path:
-            data_row = csv_manager.format_calibration_data_row(cursor_or_calibration, left_eye_info, right_eye_info, left_eye_bbox, right_eye_bbox, head_pose)
-        else:
-            data_row = csv_manager.format_eye_gaze_data_row(cursor_or_calibration, left_eye_info, right_eye_info, left_eye_bbox, right_eye_bbox, head_pose)
+def process_segment_task(task):
+    """
+    Pool task: processes one segment of a user's frames in capture order,
+    starting the face tracker and the head pose warm start afresh, so each
+    pose is solved from the previous frame of the same user or from scratch.
+    Returns the results of process_image_task.
+    """
+    local_base_dir, camera_info, frames = task
+    worker_image_processor.detector.reset()
+    get_head_pose_estimator(camera_info).reset()
+    return [process_image_task((image_path, existing_data, local_base_dir, camera_info, cached_detection))
+            for image_path, existing_data, cached_detection in frames]
 
-        # Return the processed data for this image
-        print(f"Processed image {image_path}")
-        return [image_path] + data_row
+def process_image_task(task):
+    """
+    Processes one frame; returns (image_path, ok, row, detection). ok is False when the image could not be read or processing
+    raised; such results are not recorded, so the image is retried next run.
+    row is None when no face or eyes were found. detection is the
+    (box, landmarks) found here for the landmark cache, or None when the task
+    was handed a cached one.
+    """
+    image_path, existing_data, local_base_dir, camera_info, cached_detection = task
+    image = cv2.imread(os.path.join(local_base_dir, image_path))
+    if image is None:
+        print(f"Could not read image {image_path}")
+        return image_path, False, None, None
+
+    detection = cached_detection
+    if detection is None:
+        try:
+            detection = worker_image_processor.detect_landmarks(image) or (None, None)
+        except Exception as e:
+            print(f"Error detecting a face in {image_path}: {e}")
+            return image_path, False, None, None
+    try:
+        row = process_single_image(image_path, image, existing_data, camera_info, detection[1])
     except Exception as e:
         print(f"Error processing image {image_path}: {e}")
+        # The detection is still good; keep it so the retry skips the detector
+        return image_path, False, None, detection if cached_detection is None else None
+    return image_path, True, row, detection if cached_detection is None else None
+
+def process_single_image(image_path, image, existing_data, camera_info, landmarks):
+    """Returns the processed row, or None when no face or eyes were found. Errors are raised to the caller."""
+    image_processor = worker_image_processor
+    csv_manager = worker_csv_manager
+
+    if landmarks is None:
+        print(f"Skipping image {image_path} because no face was detected")
         return None
-    
-def process_images(image_paths, local_base_dir, subdirectory, csv_file_name, csv_manager, camera_info):
-    image_data = []
 
+    # Process the image
+    processed_data = image_processor.pre_process_image(image, landmarks)
+    if processed_data is None:
+        return None
+    processed_data, left_eye_info, right_eye_info, left_eye_bbox, right_eye_bbox, shape = processed_data
+
+    # Get head pose data
+    head_pose = get_head_pose_estimator(camera_info).estimate(shape)
+
+    # Determine cursor or calibration data based on the file path
+    if existing_data is not None:
+        cursor_or_calibration = existing_data  # Use existing data for this image
+    else:
+        print(f"Skipping image {image_path} because no cursor or calibration data was found")
+        cursor_or_calibration = [np.nan, np.nan]  # Replace with your actual data source
+
+    # Format the data row for CSV, including the existing data
+    if left_eye_bbox is None or right_eye_bbox is None:
+        print(f"Skipping image {image_path} because no eyes were detected")
+        return None
+    if right_eye_info is None and left_eye_info is None:
+        print(f"Skipping image {image_path} because no eyes were detected")
+        return None
+
+    if 'calibration' in image_path:
+        data_row = csv_manager.format_calibration_data_row(cursor_or_calibration, left_eye_info, right_eye_info, left_eye_bbox, right_eye_bbox, head_pose)
+    else:
+        data_row = csv_manager.format_eye_gaze_data_row(cursor_or_calibration, left_eye_info, right_eye_info, left_eye_bbox, right_eye_bbox, head_pose)
+
+    # Return the processed data for this image
+    print(f"Processed image {image_path}")
+    return [image_path] + data_row
+
+def processing_state_path(local_base_dir, subdirectory, csv_file_name):
+    return os.path.join(local_base_dir, subdirectory, f'.{csv_file_name}.state.json')
+
+def process_images(image_paths, local_base_dir, subdirectory, csv_file_name, csv_manager, camera_info, full_rebuild=False, write_csv=True):
+    """
+    Extracts features for new or changed images only and streams the typed
+    columns and the CSV from the processing state, so earlier results are kept.
+    Nothing is rewritten when no row changed.
+    Args:
+        full_rebuild: Reprocess every image regardless of the saved state.
+        write_csv: Also export the rows as CSV; the typed columns are always written.
+    """
     # Path to the current CSV file
     current_csv_path = os.path.join(local_base_dir, subdirectory, csv_file_name)
 
     # Create a mapping of image paths to existing data
     existing_data_map = {}
-    if os.path.exists(current_csv_path):
-        print(f"Reading existing data from {current_csv_path}")
-        current_data_df = pd.read_csv(current_csv_path, header=None)
-        for idx, row in current_data_df.iterrows():
-            image_path = row[0]
-            existing_data_map[image_path] = row[1:3].values.tolist()
-
-    with Pool() as pool:
-        print(f"Processing {len(image_paths)} images")
-        
-        # Prepare arguments for each process
-        args = []
-        for image_path in image_paths:
-            existing_data = existing_data_map.get(image_path, [np.nan, np.nan])  # Use mapped data or default
-            args.append((image_path, existing_data, local_base_dir, subdirectory, csv_file_name, camera_info, csv_manager))
-
-        # Map each image to a worker process
+    # The log is in capture order: compacted rows, then parts named by time
+    capture_order = {}
+    print(f"Reading existing data from {current_csv_path}")
+    for row in csv_manager.read_data_log(current_csv_path):
+        image_path = row[0]
+        existing_data_map[image_path] = [float(value) if value != '' else np.nan for value in row[1:3]]
+        capture_order.setdefault(image_path, len(capture_order))
+
+    # Rows depend on the code, the landmark model and the user's camera, as well as the image
+    camera_matrix, dist_coeffs = camera_info
+    camera_hash = hashlib.sha1(json.dumps([np.asarray(camera_matrix).tolist(), np.asarray(dist_coeffs).tolist()]).encode()).hexdigest()
+    state = ProcessingState(processing_state_path(local_base_dir, subdirectory, csv_file_name),
+                            f'{PROCESSING_VERSION}-{FACE_DETECTION_MODE}-{PUPIL_STRATEGY}-{model_hash()}-{camera_hash}')
+    if full_rebuild:
+        state.images = {}
+
+    hashes = content_hashes(local_base_dir, image_paths)
+    to_process = [image_path for image_path in image_paths
+                  if image_path in hashes and not state.is_current(image_path, hashes[image_path])]
+    # Frames the log does not know yet go last
+    to_process.sort(key=lambda image_path: (capture_order.get(image_path, len(capture_order)), image_path))
+    print(f"Processing {len(to_process)} of {len(image_paths)} images, {len(image_paths) - len(hashes)} not synced")
+
+    if to_process:
+        # Detections survive changes to the pupil or head pose code, so those reruns skip the detector
+        landmark_cache = LandmarkCache(landmark_cache_path(os.path.join(local_base_dir, subdirectory)),
+                                       landmark_cache_version(FACE_DETECTION_MODE, SHAPE_PREDICTOR_PATH))
+        pool = get_worker_pool(csv_manager)
+        # Each segment goes to one worker whole, so the tracker sees this user's frames in order
+        segments = ((local_base_dir, camera_info,
+                     [(image_path, existing_data_map.get(image_path, [np.nan, np.nan]), landmark_cache.get(image_path, hashes[image_path]))
+                      for image_path in to_process[start:start + PROCESSING_SEGMENT_SIZE]])
+                    for start in range(0, len(to_process), PROCESSING_SEGMENT_SIZE))
+        results = (result for segment_results in pool.imap_unordered(process_segment_task, segments)
+                   for result in segment_results)
+        done = failed = 0
         try:
-            results = pool.starmap(process_single_image, args)
-        except Exception as e:
-            print(f"Error processing image: {e}")
-            return None
+            for image_path, ok, result, detection in results:
+                if detection is not None:
+                    landmark_cache.put(image_path, hashes[image_path], *detection)
+                if ok:
+                    # Journaled as they arrive, so a crash keeps every finished row
+                    state.append(image_path, hashes[image_path], result)
+                else:
+                    failed += 1
+                done += 1
+                if done % 1000 == 0:
+                    print(f"Processed {done}/{len(to_process)} images")
+        finally:
+            landmark_cache.save()
+        if failed:
+            print(f"{failed} images failed and will be retried on the next run")
+
+    changed = bool(to_process) or full_rebuild
+    for image_path in image_paths:
+        if image_path in existing_data_map:
+            # Labels can arrive after the image was processed; they need no reprocessing
+            changed = state.set_labels(image_path, existing_data_map[image_path]) or changed
 
-        # Collect results from each worker
-        for result in results:
-            if result is not None:
-                image_data.append(result)
+    # Written from the state; skipped when no row changed and the last outputs are still in place
+    outputs = output_fingerprint(local_base_dir, subdirectory, csv_file_name, csv_manager, write_csv, image_paths)
+    if not changed and outputs is not None and outputs == state.outputs:
+        print(f"No changes to {csv_file_name}, keeping the existing outputs")
+        state.save()
+        return
 
-    # Create and replace the CSV file with the new data
-    csv_manager.create_and_replace_csv(local_base_dir, subdirectory, csv_file_name, image_data)
+    count = csv_manager.write_processed(local_base_dir, subdirectory, csv_file_name, state.rows(image_paths), write_csv)
+    state.outputs = output_fingerprint(local_base_dir, subdirectory, csv_file_name, csv_manager, write_csv, image_paths)
+    state.save()
+    print(f"Wrote {count} rows for {csv_file_name}")
 
+def output_fingerprint(local_base_dir, subdirectory, csv_file_name, csv_manager, write_csv, image_paths):
+    """
+    The images written and the size and mtime of the outputs, or None if any
+    output is missing. A sync that replaces the CSV with the raw log changes
+    it, and so does an image disappearing, so the rows get rewritten.
+    """
+    csv_path = os.path.join(local_base_dir, subdirectory, csv_file_name)
+    paths = [os.path.join(csv_manager.columns_path(csv_path), 'image_path.npy')] + ([csv_path] if write_csv else [])
+    fingerprint = {'images': hashlib.sha1('\n'.join(image_paths).encode()).hexdigest()}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        fingerprint[os.path.basename(path)] = [stat.st_size, stat.st_mtime_ns]
+    return fingerprint
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,26 @@
+import argparse
+import os
+from classes.memmap_writer import INDEX_NAME
+from classes.quantization import quantize_memmap, quantize_shards
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert float32 crops, e.g. x_dataset_head_pos.memmap or a float32 MemmapWriter dataset, to uint8.")
+    parser.add_argument('src', help="Raw float32 memmap of crops in [0, 1], or a MemmapWriter dataset directory, converted in place.")
+    parser.add_argument('dst', nargs='?', help="Raw uint8 memmap to write, a quarter of the size; only for a raw memmap.")
+    parser.add_argument('--shape', default='100,200,3', help="Shape of one sample.")
+    parser.add_argument('--num-samples', type=int, help="Samples in the source; derived from its size if omitted.")
+    parser.add_argument('--chunk-size', type=int, default=1024)
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.src, INDEX_NAME)):
+        converted = quantize_shards(args.src, args.chunk_size)
+        print(f"Converted {converted} shards of {args.src} to uint8")
+        return
+    if args.dst is None:
+        parser.error("dst is required when src is a raw memmap")
+    sample_shape = tuple(int(size) for size in args.shape.split(','))
+    num_samples = quantize_memmap(args.src, args.dst, sample_shape, args.num_samples, args.chunk_size)
+    print(f"Converted {num_samples} samples: {os.path.getsize(args.src) / 1e9:.2f} GB -> {os.path.getsize(args.dst) / 1e9:.2f} GB")
+
+if __name__ == '__main__':
+    main()
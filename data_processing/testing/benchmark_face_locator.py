@@ -0,0 +1,69 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import argparse
+import glob
+import json
+import os
+import time
+import cv2
+import dlib
+import numpy as np
+from classes.face_locator import FaceLocator
+from classes.landmarks import landmarks_to_array
+
+def load_frames(pattern, limit):
+    paths = sorted(glob.glob(pattern, recursive=True), key=os.path.getmtime)[:limit]
+    frames = [(path, cv2.imread(path)) for path in paths]
+    return [(path, frame) for path, frame in frames if frame is not None]
+
+def run_mode(frames, face_locator, predictor):
+    """Returns per-frame landmarks ((68, 2) arrays, or None) and the mean seconds per frame."""
+    landmarks = []
+    start = time.perf_counter()
+    for _, frame in frames:
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        faces = face_locator(gray)
+        if faces:
+            shape = predictor(gray, faces[0])
+            landmarks.append(landmarks_to_array(shape))
+        else:
+            landmarks.append(None)
+    return landmarks, (time.perf_counter() - start) / len(frames)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare FaceLocator modes against full-frame detection.")
+    parser.add_argument('images', help="Glob of captured frames, e.g. './data/<user>/calibration_images/*.png'.")
+    parser.add_argument('--predictor', default='shape_predictor_68_face_landmarks.dat')
+    parser.add_argument('--detect-width', type=int, default=320)
+    parser.add_argument('--limit', type=int, default=500)
+    args = parser.parse_args()
+
+    frames = load_frames(args.images, args.limit)
+    if not frames:
+        raise SystemExit(f"No frames match {args.images}")
+    detector = dlib.get_frontal_face_detector()
+    predictor = dlib.shape_predictor(args.predictor)
+
+    reference, reference_seconds = run_mode(frames, FaceLocator(detector, 'full'), predictor)
+    report = {'frames': len(frames), 'modes': {}}
+    for mode in FaceLocator.MODES:
+        face_locator = FaceLocator(detector, mode, detect_width=args.detect_width)
+        landmarks, seconds = run_mode(frames, face_locator, predictor)
+
+        drifts = [np.linalg.norm(found - expected, axis=1)
+                  for found, expected in zip(landmarks, reference) if found is not None and expected is not None]
+        missed = sum(1 for found, expected in zip(landmarks, reference) if found is None and expected is not None)
+        report['modes'][mode] = {
+            'ms_per_frame': round(seconds * 1000, 2),
+            'speedup': round(reference_seconds / seconds, 2),
+            'landmark_drift_px_mean': round(float(np.mean(drifts)), 3) if drifts else None,
+            'landmark_drift_px_max': round(float(np.max(drifts)), 3) if drifts else None,
+            'faces_missed': missed,
+            'detections': face_locator.stats,
+        }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
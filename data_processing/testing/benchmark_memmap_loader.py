@@ -0,0 +1,79 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from classes.memmap_loader import MemmapBatchLoader
+from classes.quantization import dequantize
+
+X_SHAPE = (100, 200, 3)
+Y_WIDTH = 8
+
+def memmap_batch_generator(x_memmap, y_memmap, batch_size, indices, shuffle=True):
+    """The generator from memmap_model_training.ipynb: global shuffle, fancy indexing, on the calling thread."""
+    while True:
+        if shuffle:
+            np.random.shuffle(indices)
+        for start_idx in range(0, len(indices), batch_size):
+            batch_indices = indices[start_idx:start_idx + batch_size]
+            x_batch = dequantize(x_memmap[batch_indices])
+            yield x_batch, {'gaze_output': y_memmap[batch_indices, :2], 'pose_output': y_memmap[batch_indices, 2:]}
+
+def synthetic_dataset(tmp_dir, num_samples):
+    x = np.lib.format.open_memmap(os.path.join(tmp_dir, 'x.npy'), mode='w+', dtype=np.uint8, shape=(num_samples,) + X_SHAPE)
+    y = np.lib.format.open_memmap(os.path.join(tmp_dir, 'y.npy'), mode='w+', dtype=np.float32, shape=(num_samples, Y_WIDTH))
+    rng = np.random.default_rng(0)
+    for start in range(0, num_samples, 1024):
+        count = min(1024, num_samples - start)
+        x[start:start + count] = rng.integers(0, 256, (count,) + X_SHAPE, dtype=np.uint8)
+        y[start:start + count] = rng.random((count, Y_WIDTH), dtype=np.float32)
+    x.flush()
+    y.flush()
+    del x, y
+    return (np.load(os.path.join(tmp_dir, 'x.npy'), mmap_mode='r'),
+            np.load(os.path.join(tmp_dir, 'y.npy'), mmap_mode='r'))
+
+def samples_per_second(batches, num_batches, step_seconds):
+    """Pulls num_batches batches, sleeping step_seconds after each to stand in for a training step."""
+    samples = 0
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        x_batch, _ = next(batches)
+        samples += len(x_batch)
+        if step_seconds:
+            time.sleep(step_seconds)
+    return round(samples / (time.perf_counter() - start), 1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Samples per second of MemmapBatchLoader against the notebook's memmap_batch_generator.")
+    parser.add_argument('--samples', type=int, default=8192, help="Synthetic samples; use more than fits in RAM to measure disk reads.")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--batches', type=int, default=200)
+    parser.add_argument('--step-ms', type=float, default=0.0, help="Simulated training step per batch, to show prefetch overlap.")
+    parser.add_argument('--prefetch', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--dir', help="Where to write the synthetic memmap; a temporary directory by default.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp_dir:
+        x, y = synthetic_dataset(tmp_dir, args.samples)
+        step_seconds = args.step_ms / 1000
+        report = {'samples': args.samples, 'batch_size': args.batch_size, 'step_ms': args.step_ms, 'samples_per_s': {}}
+
+        generator = memmap_batch_generator(x, y, args.batch_size, np.arange(args.samples))
+        report['samples_per_s']['memmap_batch_generator'] = samples_per_second(generator, args.batches, step_seconds)
+        for shuffle in MemmapBatchLoader.SHUFFLE_MODES:
+            loader = MemmapBatchLoader(x, y, args.batch_size, shuffle=shuffle, prefetch=args.prefetch, workers=args.workers, seed=0)
+            batches = iter(loader)
+            report['samples_per_s'][f'loader_{shuffle}'] = samples_per_second(batches, args.batches, step_seconds)
+            batches.close()
+        del x, y
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import argparse
+import csv
+import json
+import time
+import cv2
+import numpy as np
+from classes.pupil_detector import PupilDetector
+
+LEFT_EYE = list(range(36, 42))
+RIGHT_EYE = list(range(42, 48))
+
+def labelled_eyes(labels_csv, predictor_path):
+    """
+    Eye crops and their labelled pupil centres (crop coordinates) from a CSV of
+    image_path,left_x,left_y,right_x,right_y with centres in full-frame pixels.
+    """
+    import dlib
+    from classes.image_processing import ImageProcessor
+    from classes.landmarks import landmarks_to_array
+
+    image_processor = ImageProcessor(dlib.get_frontal_face_detector(), dlib.shape_predictor(predictor_path))
+    eyes = []
+    with open(labels_csv, newline='') as f:
+        for image_path, *centres in csv.reader(f):
+            image = cv2.imread(image_path)
+            faces = image_processor.detector(image) if image is not None else []
+            if not faces:
+                continue
+            landmarks = landmarks_to_array(image_processor.predictor(image, faces[0]))
+            for eye_points, (x, y) in ((LEFT_EYE, centres[0:2]), (RIGHT_EYE, centres[2:4])):
+                crop, (min_x, min_y, _, _) = image_processor.extract_eye_region(image, landmarks, eye_points, [], [], [])
+                eyes.append((crop, (float(x) - min_x, float(y) - min_y)))
+    return eyes
+
+def synthetic_eyes(count, seed=0):
+    """Eye-sized crops with a dark pupil at a known, random position, plus lashes, glint and noise."""
+    rng = np.random.default_rng(seed)
+    eyes = []
+    for _ in range(count):
+        width, height = rng.integers(30, 60), rng.integers(12, 24)
+        crop = np.full((height, width, 3), rng.integers(140, 200), dtype=np.uint8)
+        centre = (rng.uniform(width * 0.3, width * 0.7), rng.uniform(height * 0.35, height * 0.65))
+        radius = max(2, int(height * rng.uniform(0.25, 0.35)))
+        cv2.circle(crop, (int(round(centre[0])), int(round(centre[1]))), radius, (30, 30, 30), -1)
+        cv2.line(crop, (0, 0), (width - 1, 1), (60, 60, 60), 1)
+        cv2.circle(crop, (int(centre[0]) + 1, int(centre[1]) - 1), 1, (255, 255, 255), -1)
+        noise = rng.normal(0, 8, crop.shape)
+        eyes.append((np.clip(crop + noise, 0, 255).astype(np.uint8), centre))
+    return eyes
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-eye latency and pupil-centre error of each PupilDetector strategy.")
+    parser.add_argument('--labels', help="CSV of image_path,left_x,left_y,right_x,right_y in full-frame pixels.")
+    parser.add_argument('--predictor', default='shape_predictor_68_face_landmarks.dat')
+    parser.add_argument('--synthetic', type=int, default=1000, help="Number of synthetic eyes when no labels are given.")
+    parser.add_argument('--sr-model', default='EDSR_x4.pb', help="Model for the super_resolution strategy.")
+    args = parser.parse_args()
+
+    eyes = labelled_eyes(args.labels, args.predictor) if args.labels else synthetic_eyes(args.synthetic)
+    report = {'eyes': len(eyes), 'source': args.labels or 'synthetic', 'strategies': {}}
+    for strategy in PupilDetector.STRATEGIES:
+        try:
+            pupil_detector = PupilDetector(strategy, sr_model_path=args.sr_model)
+        except (ValueError, cv2.error) as e:
+            report['strategies'][strategy] = {'skipped': str(e)}
+            continue
+
+        latencies, errors, misses = [], [], 0
+        for crop, expected in eyes:
+            start = time.perf_counter()
+            found = pupil_detector.detect(crop)
+            latencies.append(time.perf_counter() - start)
+            if found is None:
+                misses += 1
+            else:
+                errors.append(np.hypot(found[0] - expected[0], found[1] - expected[1]))
+
+        report['strategies'][strategy] = {
+            'us_per_eye_mean': round(float(np.mean(latencies)) * 1e6, 1),
+            'us_per_eye_p95': round(float(np.percentile(latencies, 95)) * 1e6, 1),
+            'error_px_mean': round(float(np.mean(errors)), 2) if errors else None,
+            'error_px_p95': round(float(np.percentile(errors, 95)), 2) if errors else None,
+            'misses': misses,
+        }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
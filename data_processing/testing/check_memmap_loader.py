@@ -0,0 +1,46 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import tempfile
+import numpy as np
+from classes.memmap_loader import MemmapBatchLoader
+from classes.memmap_writer import MemmapWriter, open_shards
+
+X_SHAPE = (4, 4, 3)
+
+def main():
+    """Checks MemmapBatchLoader on a small sharded dataset: every sample once per epoch, in every mode."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with MemmapWriter(tmp_dir, X_SHAPE, 1, x_dtype=np.uint8, shard_size=50) as writer:
+            for i in range(230):
+                writer.append(str(i), np.full(X_SHAPE, i % 256, dtype=np.uint8), [i])
+        shards = open_shards(tmp_dir)
+
+        for shuffle in MemmapBatchLoader.SHUFFLE_MODES:
+            # open_shards output is passed straight in, with y left out
+            loader = MemmapBatchLoader(shards, batch_size=32, shuffle=shuffle, block_size=8, buffer_size=64, epochs=1, seed=0)
+            batches = list(loader)
+            seen = np.concatenate([y[:, 0] for _, y in batches]).astype(int)
+            assert len(batches) == len(loader), shuffle
+            assert sorted(seen.tolist()) == list(range(230)), shuffle
+            for x_batch, y_batch in batches:
+                # Each crop matches its label, scaled to [0, 1]
+                assert np.allclose(x_batch[:, 0, 0, 0] * 255, y_batch[:, 0] % 256), shuffle
+
+        subset = np.arange(40, 160, 3)
+        x_shards, y_shards = zip(*shards)
+        seen = np.concatenate([y[:, 0] for _, y in MemmapBatchLoader(list(x_shards), list(y_shards), indices=subset, epochs=1)])
+        assert sorted(seen.astype(int).tolist()) == subset.tolist()
+
+        try:
+            MemmapBatchLoader(shards, indices=[])
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("empty indices were accepted")
+        del shards, x_shards, y_shards
+    print("MemmapBatchLoader checks passed")
+
+if __name__ == '__main__':
+    main()
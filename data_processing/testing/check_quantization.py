@@ -0,0 +1,98 @@
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from classes.memmap_writer import MemmapWriter, open_shards
+from classes.quantization import dequantize, quantize_memmap, quantize_shards
+
+X_SHAPE = (100, 200, 3)
+
+def synthetic_memmap(path, num_samples, seed=0):
+    """float32 crops as get_combined_eyes produced them: uint8 pixels divided by 255."""
+    rng = np.random.default_rng(seed)
+    x = np.memmap(path, dtype=np.float32, mode='w+', shape=(num_samples,) + X_SHAPE)
+    for start in range(0, num_samples, 256):
+        count = min(256, num_samples - start)
+        x[start:start + count] = rng.integers(0, 256, (count,) + X_SHAPE, dtype=np.uint8).astype(np.float32) / 255.0
+    x.flush()
+
+def read_batches(x, batches, transform=None):
+    """Reads the batches as the training generator does; returns MB read from the memmap and samples per second."""
+    start = time.perf_counter()
+    read = 0
+    samples = 0
+    for indices in batches:
+        batch = x[indices]
+        read += batch.nbytes
+        samples += len(batch)
+        if transform is not None:
+            batch = transform(batch)
+    return round(read / 1e6, 1), round(samples / (time.perf_counter() - start), 1)
+
+def check_shards(tmp_dir, num_samples):
+    """Converts a float32 MemmapWriter dataset in place; returns the max error and whether it reopens as uint8."""
+    out_dir = os.path.join(tmp_dir, 'dataset')
+    rng = np.random.default_rng(2)
+    with MemmapWriter(out_dir, X_SHAPE, 8, x_dtype=np.float32, shard_size=256) as writer:
+        for i in range(num_samples):
+            writer.append(str(i), rng.integers(0, 256, X_SHAPE, dtype=np.uint8).astype(np.float32) / 255.0, np.zeros(8))
+    before = [np.array(x) for x, _ in open_shards(out_dir)]
+    try:
+        MemmapWriter(out_dir, X_SHAPE, 8, x_dtype=np.uint8, shard_size=256)
+    except ValueError as e:
+        print(f"Before conversion: {e}")
+    quantize_shards(out_dir)
+    after = [x for x, _ in open_shards(out_dir)]
+    max_error = max(float(np.max(np.abs(dequantize(x_uint8) - x_float))) for x_float, x_uint8 in zip(before, after))
+    reopened = MemmapWriter(out_dir, X_SHAPE, 8, x_dtype=np.uint8, shard_size=256)
+    return max_error, len(reopened) == num_samples and all(x.dtype == np.uint8 for x in after)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that uint8 crop storage gives the same batches as float32, and compare sizes.")
+    parser.add_argument('--samples', type=int, default=4096)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--batches', type=int, default=100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        float_path = os.path.join(tmp_dir, 'x_float32.memmap')
+        uint8_path = os.path.join(tmp_dir, 'x_uint8.memmap')
+        synthetic_memmap(float_path, args.samples)
+        quantize_memmap(float_path, uint8_path, X_SHAPE)
+
+        x_float = np.memmap(float_path, dtype=np.float32, mode='r', shape=(args.samples,) + X_SHAPE)
+        x_uint8 = np.memmap(uint8_path, dtype=np.uint8, mode='r', shape=(args.samples,) + X_SHAPE)
+
+        rng = np.random.default_rng(1)
+        batches = [rng.choice(args.samples, args.batch_size, replace=False) for _ in range(args.batches)]
+        max_error = max(float(np.max(np.abs(dequantize(x_uint8[indices]) - x_float[indices]))) for indices in batches)
+
+        report = {
+            'samples': args.samples,
+            'max_abs_error': max_error,
+            # Half a quantisation step; crops that started as uint8 pixels round-trip exactly
+            'within_quantization_error': max_error <= 0.5 / 255,
+            'bytes_per_sample': {'float32': x_float[0].nbytes, 'uint8': x_uint8[0].nbytes},
+            'file_mb': {'float32': round(os.path.getsize(float_path) / 1e6, 1), 'uint8': round(os.path.getsize(uint8_path) / 1e6, 1)},
+            # (MB read, samples per second); the page cache is warm, so the second number understates the gain on disk
+            'reads': {
+                'float32': read_batches(x_float, batches),
+                'uint8': read_batches(x_uint8, batches, dequantize),
+            },
+        }
+        shard_error, shards_reopen = check_shards(tmp_dir, min(args.samples, 1000))
+        report['shards'] = {'max_abs_error': shard_error, 'reopens_as_uint8': shards_reopen}
+    print(json.dumps(report, indent=2))
+    if not report['within_quantization_error'] or report['shards']['max_abs_error'] > 0.5 / 255:
+        raise SystemExit("uint8 batches differ from float32 by more than the quantisation error")
+    if not report['shards']['reopens_as_uint8']:
+        raise SystemExit("The converted shard dataset does not reopen as uint8")
+
+if __name__ == '__main__':
+    main()
@@ -1,42 +1,75 @@
 import React, { createContext, useContext, useState, useEffect } from "react";
-import sendImageToServer from "./utils/sendImageToServer";
+import sendBatchToServer from "./utils/sendBatchToServer";
 
 const QueueContext = createContext();
 
+const BATCH_ENDPOINT = "https://eye-gaze-data-collection-a78e84ce60e5.herokuapp.com/process-batch";
+
+// Queued captures are coalesced into one request of up to BATCH_SIZE frames,
+// or fewer once the oldest queued frame has waited BATCH_WINDOW_MS.
+const BATCH_SIZE = Number(process.env.REACT_APP_UPLOAD_BATCH_SIZE) || 8;
+const BATCH_WINDOW_MS = Number(process.env.REACT_APP_UPLOAD_BATCH_WINDOW_MS) || 1000;
+
 export const useQueue = () => useContext(QueueContext);
 
 export const QueueProvider = ({ children }) => {
   const [taskQueue, setTaskQueue] = useState([]);
   const [isProcessing, setIsProcessing] = useState(false);
   const [startQueue, setStartQueue] = useState(false);
+  const [flushTick, setFlushTick] = useState(0);
 
   const addToQueue = (item) => {
-    setTaskQueue((prev) => [...prev, item]);
+    setTaskQueue((prev) => [...prev, { ...item, queuedAt: Date.now() }]);
+  };
+
+  const takeBatch = (queue) => {
+    // Only consecutive items of the same type and user can share a request
+    const { type, data } = queue[0];
+    let size = 0;
+    while (
+      size < queue.length &&
+      size < BATCH_SIZE &&
+      queue[size].type === type &&
+      queue[size].data.userId === data.userId
+    ) {
+      size++;
+    }
+    return queue.slice(0, size);
   };
 
-  const processQueueItem = async (item) => {
+  const processBatch = async (batch) => {
+    setIsProcessing(true);
     try {
-      setIsProcessing(true);
-      const endpoint =
-        item.type === "calibration"
-          ? "https://eye-gaze-data-collection-a78e84ce60e5.herokuapp.com/calibrate"
-          : "https://eye-gaze-data-collection-a78e84ce60e5.herokuapp.com/process-image";
-
-      await sendImageToServer([item.data], endpoint);
-      setIsProcessing(false);
+      const dataType = batch[0].type === "calibration" ? "calibration" : "eye_gaze";
+      await sendBatchToServer(
+        batch.map((item) => item.data),
+        BATCH_ENDPOINT,
+        dataType
+      );
     } catch (error) {
-      console.error("Error processing queue item:", error);
+      console.error("Error processing queue batch:", error);
     }
+    // Dequeue and release together so the same batch is never picked twice
+    setTaskQueue((prev) => prev.slice(batch.length));
+    setIsProcessing(false);
   };
 
   useEffect(() => {
-    if (startQueue && taskQueue.length > 0 && !isProcessing) {
-      const item = taskQueue[0];
-      processQueueItem(item).then(() => {
-        setTaskQueue((prev) => prev.slice(1));
-      });
+    if (!startQueue || taskQueue.length === 0 || isProcessing) {
+      return;
+    }
+    const batch = takeBatch(taskQueue);
+    const waited = Date.now() - taskQueue[0].queuedAt;
+    const batchIsClosed = batch.length === BATCH_SIZE || batch.length < taskQueue.length;
+
+    if (!batchIsClosed && waited < BATCH_WINDOW_MS) {
+      // Give more captures a chance to join this batch
+      const timer = setTimeout(() => setFlushTick((tick) => tick + 1), BATCH_WINDOW_MS - waited);
+      return () => clearTimeout(timer);
     }
-  }, [taskQueue, isProcessing, startQueue]);
+
+    processBatch(batch);
+  }, [taskQueue, isProcessing, startQueue, flushTick]);
 
   return <QueueContext.Provider value={{ addToQueue, setStartQueue, taskQueue }}>{children}</QueueContext.Provider>;
 };
@@ -1,16 +1,20 @@
-import React, { useEffect, useState, useCallback } from "react";
+import React, { useEffect, useState, useCallback, useRef } from "react";
 import "./CalibrationComponent.css";
 import useCamera from "../../hooks/useCamera";
 import getCameraParameters from "../../utils/getCameraParameters";
+import registerSession from "../../utils/registerSession";
 import useEventListeners from "../../hooks/useEventListeners";
 import { useQueue } from "../../QueueContext";
 
+const SESSION_ENDPOINT = "https://eye-gaze-data-collection-a78e84ce60e5.herokuapp.com/session";
+
 function CalibrationComponent({ onCalibrationComplete, userId, setUserId }) {
   const [calibrationPoints, setCalibrationPoints] = useState([]);
   const [currentPoint, setCurrentPoint] = useState(0);
   const { videoRef, captureImage } = useCamera();
   const [processing, setProcessing] = useState(null);
   const { addToQueue, setStartQueue } = useQueue();
+  const sessionRef = useRef({ userId: null, sessionId: null });
 
   const generateCalibrationPoints = useCallback(() => {
     const screenWidth = window.screen.width;
@@ -55,14 +59,28 @@ function CalibrationComponent({ onCalibrationComplete, userId, setUserId }) {
           devicePixelRatio: window.devicePixelRatio,
         };
         const { cameraMatrix, distCoeffs } = getCameraParameters(videoRef.current);
-        const cacheItem = {
-          userId: userId,
-          screenData: JSON.stringify(screenData),
-          calibrationPoints: JSON.stringify([point.x, point.y]),
-          cameraMatrix: JSON.stringify(cameraMatrix),
-          distCoeffs: JSON.stringify(distCoeffs),
-          blob: blob,
-        };
+
+        // Register screen and camera info once per user instead of sending it with every frame
+        if (sessionRef.current.userId !== userId || !sessionRef.current.sessionId) {
+          const sessionId = await registerSession(SESSION_ENDPOINT, userId, screenData, cameraMatrix, distCoeffs);
+          sessionRef.current = { userId, sessionId };
+        }
+
+        const cacheItem = sessionRef.current.sessionId
+          ? {
+              userId: userId,
+              sessionId: sessionRef.current.sessionId,
+              calibrationPoints: JSON.stringify([point.x, point.y]),
+              blob: blob,
+            }
+          : {
+              userId: userId,
+              screenData: JSON.stringify(screenData),
+              calibrationPoints: JSON.stringify([point.x, point.y]),
+              cameraMatrix: JSON.stringify(cameraMatrix),
+              distCoeffs: JSON.stringify(distCoeffs),
+              blob: blob,
+            };
 
         // Add every captured point to the queue
         const taskItem = {
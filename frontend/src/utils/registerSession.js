@@ -0,0 +1,22 @@
+// Registers screen and camera info once, so calibration frames only need to send the session id.
+const registerSession = async (url, userId, screenData, cameraMatrix, distCoeffs) => {
+  const formData = new FormData();
+  formData.append("userId", userId);
+  formData.append("screenData", JSON.stringify(screenData));
+  formData.append("cameraMatrix", JSON.stringify(cameraMatrix));
+  formData.append("distCoeffs", JSON.stringify(distCoeffs));
+
+  try {
+    const response = await fetch(url, {
+      method: "POST",
+      body: formData,
+    });
+    const data = await response.json();
+    return response.ok ? data.data.sessionId : null;
+  } catch (err) {
+    console.error("Error registering session:", err);
+    return null;
+  }
+};
+
+export default registerSession;
@@ -0,0 +1,51 @@
+// Sends several queued captures of the same type as one /process-batch request.
+const MAX_ATTEMPTS = 5;
+
+const sendBatchToServer = async (items, url, dataType) => {
+  const formData = new FormData();
+  const first = items[0];
+
+  formData.append("userId", first.userId);
+  formData.append("dataType", dataType);
+
+  // Screen and camera info are the same for every frame of a calibration batch,
+  // and are sent by reference once a session has been registered
+  ["sessionId", "screenData", "cameraMatrix", "distCoeffs"].forEach((key) => {
+    if (first[key] !== undefined) {
+      formData.append(key, typeof first[key] === "object" ? JSON.stringify(first[key]) : first[key]);
+    }
+  });
+
+  const frames = items.map((item) =>
+    dataType === "calibration"
+      ? { calibrationPoints: JSON.parse(item.calibrationPoints) }
+      : { cursorPosition: item.cursorPosition }
+  );
+  formData.append("frames", JSON.stringify(frames));
+  items.forEach((item, index) => formData.append("images", item.blob, `frame_${index}.png`));
+
+  for (let attempt = 0; attempt < MAX_ATTEMPTS; attempt++) {
+    try {
+      const response = await fetch(url, {
+        method: "POST",
+        body: formData,
+      });
+      const data = await response.json();
+      if (response.status === 429) {
+        // The server's ingest queue is full: back off for as long as it asks
+        const retryAfter = Number(response.headers.get("Retry-After")) || 1;
+        await new Promise((resolve) => setTimeout(resolve, retryAfter * 1000));
+        continue;
+      }
+      console.log(data);
+      return data;
+    } catch (err) {
+      console.error("Error sending batch:", err);
+      // Handle error appropriately
+      return;
+    }
+  }
+  console.error("Giving up on batch after repeated 429 responses");
+};
+
+export default sendBatchToServer;